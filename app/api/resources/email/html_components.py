@@ -33,13 +33,16 @@ def _get_header(title: str):
     <div style="height: auto; padding: 24px; Continued: 0;">"""
 
 
-def record_ready_email(date_time, download_link, upload_link):
+def record_ready_email(date_time, download_link, upload_link, playback_link=None):
+    playback = f"""
+                    Puede verla en línea sin descargarla <a href = {playback_link}>aquí</a>. <br>""" \
+        if playback_link else ""
     body = _get_fist_part() + _get_header("Record ready for download // Grabación lista") + f"""
     <div style="height: auto; padding: 24px; Continued: 0;">
         <div style="height: auto; margin: 0 auto; padding: 32px 0;">
             <div style="height: auto; margin: 0 auto; text-align: center;">
                 <p style="width: 100%; font-weight: 400; font-size: 14px; line-height: 150%; color: #000000;">
-                    Su grabación está <a href = {download_link}>aquí</a>. <br>
+                    Su grabación está <a href = {download_link}>aquí</a>. <br>{playback}
                     Tambien tiene la opción de subirlo directo al drive de su usuario haciendo click
                     <a href = {upload_link}> aquí</a>. <br>
                 </p> <br>
@@ -0,0 +1,35 @@
+import html
+import json
+
+
+def _js_string(value: str) -> str:
+    # A JSON string is a valid JS literal, `<` is escaped so it cannot close the script element
+    return json.dumps(value).replace('<', '\\u003c')
+
+
+def hls_player_page(title: str, playlist: str, script_url: str):
+    return f"""<!DOCTYPE html>
+<html>
+
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>{html.escape(title)}</title>
+    <script src="{html.escape(script_url)}"></script>
+</head>
+<body style="margin: 0; background-color: #000000;">
+    <video id="video" controls style="width: 100%; max-height: 100vh;"></video>
+    <script>
+        var video = document.getElementById('video');
+        if (video.canPlayType('application/vnd.apple.mpegurl')) {{
+            video.src = {_js_string(playlist)};
+        }} else if (window.Hls && Hls.isSupported()) {{
+            var hls = new Hls();
+            hls.loadSource({_js_string(playlist)});
+            hls.attachMedia(video);
+        }}
+    </script>
+</body>
+
+</html>
+"""
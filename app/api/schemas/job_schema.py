@@ -0,0 +1,22 @@
+from typing import Optional
+
+from pydantic import BaseModel
+
+from app.api.schemas.base_schema import GetResponseBase
+
+
+class JobSchema(BaseModel):
+    id: str
+    kind: str
+    stage: str = 'queued'
+    # Share of the current stage done, when it is known
+    progress: Optional[float] = None
+    error: Optional[str] = None
+    # Runs of the job, one more each time a restart of the service resumes it
+    attempts: int = 1
+    created_at: float
+    updated_at: float
+
+
+class JobResponse(GetResponseBase[JobSchema]):
+    pass
@@ -1,7 +1,11 @@
+from typing import Optional
+
 from pydantic import BaseModel
+from starlette.status import HTTP_202_ACCEPTED
 
 from app.api.schemas.auth_schema import XBearerSchema
-from app.api.schemas.base_schema import ResponseBase
+from app.api.schemas.base_schema import GetResponseBase, ResponseBase
+from app.api.schemas.job_schema import JobSchema
 from app.config import current
 
 
@@ -16,6 +20,7 @@ class EmailInput(BaseModel):
     download_meeting_dir: str
     download_link: str
     upload_link: str
+    playback_link: Optional[str] = None
     sender_email: str = current.EMAIL.SENDER_EMAIL
     smtp_server: str = current.EMAIL.SMTP_SERVER
     smtp_port: int = current.EMAIL.SMTP_PORT
@@ -26,11 +31,12 @@ class RecordingSendEmailInput(BaseModel):
     url: str
     meeting_name: str
     email: str
+    audio_only: bool = False
 
 
 class RecordingUploadResponse(ResponseBase):
     pass
 
 
-class RecordingSendEmailResponse(ResponseBase):
-    pass
+class RecordingSendEmailResponse(GetResponseBase[JobSchema]):
+    code: int = HTTP_202_ACCEPTED
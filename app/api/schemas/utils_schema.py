@@ -1,3 +1,5 @@
+from typing import Dict
+
 from pydantic import BaseModel
 
 from app.api.schemas.base_schema import GetResponseBase
@@ -29,3 +31,12 @@ class EncryptMessageResponse(GetResponseBase[EncryptMessageSchema]):
 
 class DecryptMessageResponse(GetResponseBase[DecryptMessageSchema]):
     pass
+
+
+class DownloadMetricsSchema(BaseModel):
+    counters: Dict[str, float]
+    histograms: Dict[str, dict]
+
+
+class DownloadMetricsResponse(GetResponseBase[DownloadMetricsSchema]):
+    pass
@@ -0,0 +1,141 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import functools
+from http.client import responses
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+import uuid
+
+from starlette.status import HTTP_404_NOT_FOUND
+
+from app.api.schemas.job_schema import JobSchema
+from app.api.schemas.recording_schema import RecordingSendEmailInput
+from app.api.services.recording_service import RecordingService
+from app.config import current
+from app.error_codes import JOB_NOT_FOUND
+from app.exceptions import ApiException, raise_exception
+from app.utils import job_store_util
+from app.utils.progress_util import progress_listener
+
+LOGGER = logging.getLogger(__name__)
+
+# The event loop only keeps weak references to the running pipelines
+_tasks: Set[asyncio.Task] = set()
+
+# Writes the store off the event loop, a single thread keeps the reports of a job in order
+_store_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='job-store')
+
+
+async def _in_store(fn: Callable[..., Any], *args: Any) -> Any:
+    return await asyncio.get_running_loop().run_in_executor(_store_writer, functools.partial(fn, *args))
+
+
+def _send_email(params: dict) -> Awaitable[None]:
+    return RecordingService.send_email(recording_send_email_input=RecordingSendEmailInput(**params))
+
+
+# Pipeline of each kind of job, run with the parameters stored with the job
+RUNNERS: Dict[str, Callable[[dict], Awaitable[None]]] = {
+    'video': _send_email,
+    'audio': _send_email,
+}
+
+
+class JobService:
+
+    @staticmethod
+    async def submit(kind: str, params: dict) -> JobSchema:
+        """
+        Store a job running the `kind` pipeline with `params` and start it, its stage and errors can be polled.
+        """
+        await _in_store(JobService._prune)
+        job = JobSchema(**await _in_store(job_store_util.insert_job, uuid.uuid4().hex, kind, params, 'queued'))
+        JobService._start(job.id, kind, params)
+        return job
+
+    @staticmethod
+    def get(job_id: str) -> JobSchema:
+        job = job_store_util.get_job(job_id)
+        if job is None:
+            msg = f'{responses[HTTP_404_NOT_FOUND]}. Job {job_id} not found, finished jobs are kept for a while only.'
+            raise_exception(ApiException(), HTTP_404_NOT_FOUND, msg, JOB_NOT_FOUND)
+        return JobSchema(**job)  # type: ignore[arg-type]
+
+    @staticmethod
+    def stages(job_id: str) -> List[str]:
+        return job_store_util.job_stages(job_id)
+
+    @staticmethod
+    async def recover() -> None:
+        """
+        Start again the jobs a previous run of the service left unfinished.
+
+        The pipelines skip the work they already did: downloaded files, encoded segments, cached outputs and
+        sent emails are all checked before being made again, so a job resumes after its last completed stage.
+        Jobs interrupted `JOB_MAX_ATTEMPTS` times are given up.
+        """
+        for job in await _in_store(job_store_util.unfinished_jobs):
+            if job['kind'] not in RUNNERS:
+                await _in_store(JobService._write, job['id'], 'failed', None, f'Unknown job kind {job["kind"]}')
+            elif job['attempts'] >= current.BBB.JOB_MAX_ATTEMPTS:
+                LOGGER.warning(f'Job {job["id"]} interrupted {job["attempts"]} times in {job["stage"]}, giving up')
+                await _in_store(
+                    JobService._write, job['id'], 'failed', None,
+                    f'Interrupted {job["attempts"]} times, last in {job["stage"]}'
+                )
+            else:
+                LOGGER.info(f'Resuming job {job["id"]} interrupted in {job["stage"]}')
+                await _in_store(JobService._write, job['id'], 'queued', None, None, job['attempts'] + 1)
+                JobService._start(job['id'], job['kind'], job['params'])
+
+    @staticmethod
+    def _start(job_id: str, kind: str, params: dict) -> None:
+        task = asyncio.create_task(JobService._run(job_id, lambda: RUNNERS[kind](params)))
+        _tasks.add(task)
+        task.add_done_callback(_tasks.discard)
+
+    @staticmethod
+    async def _run(job_id: str, pipeline: Callable[[], Awaitable[None]]) -> None:
+        def listener(stage: str, progress: Optional[float]) -> None:
+            JobService._update(job_id, stage, progress)
+
+        # The stages reported by the pipeline, and by the shared downloads it joins, update the job
+        with progress_listener(listener):
+            try:
+                await pipeline()
+            except ApiException as ex:
+                await _in_store(JobService._write, job_id, 'failed', None, ex.message)
+            except Exception as ex:
+                LOGGER.exception(f'Job {job_id} failed')
+                await _in_store(JobService._write, job_id, 'failed', None, str(ex) or ex.__class__.__name__)
+            else:
+                await _in_store(JobService._write, job_id, 'done', 1)
+
+    @staticmethod
+    def _update(job_id: str, stage: str, progress: Optional[float] = None) -> None:
+        """
+        Record a progress report without waiting for it, reports come from the event loop and from worker threads.
+        """
+        def write() -> None:
+            try:
+                JobService._write(job_id, stage, progress)
+            except Exception as ex:
+                LOGGER.warning(f'Could not record the {stage} stage of job {job_id}: {ex}')
+
+        _store_writer.submit(write)
+
+    @staticmethod
+    def _write(
+            job_id: str, stage: str, progress: Optional[float] = None, error: Optional[str] = None,
+            attempts: Optional[int] = None
+    ) -> None:
+        if job_store_util.update_job(job_id, stage, progress, error, attempts):
+            LOGGER.info(f'Job {job_id}: {stage}' + (f' {progress:.0%}' if progress is not None else ''))
+
+    @staticmethod
+    def _prune() -> None:
+        """
+        Forget the jobs finished for longer than `JOB_RETENTION_SECONDS`.
+        """
+        job_store_util.delete_finished_before(time.time() - current.BBB.JOB_RETENTION_SECONDS)
@@ -1,8 +1,13 @@
+import asyncio
 import base64
+from http.client import responses
 import os
 import shutil
+from typing import List, Set, Tuple
+from urllib import parse
 
 from fastapi import Depends
+from starlette.status import HTTP_404_NOT_FOUND
 
 from app.api.schemas.recording_schema import (
     EmailInput,
@@ -17,9 +22,17 @@ from app.api.schemas.webdav_schema import (
 )
 from app.api.services.web_dav_service import WebDAVService
 from app.config import current
-from app.exceptions import ApiException
+from app.error_codes import FILE_NOT_FOUND
+from app.exceptions import ApiException, raise_exception
+from app.utils import cache_util, zip_util
 from app.utils.recording_util import get_full_folder_path, send_email
-from app.utils.file_util import combine, download_script
+from app.utils.file_util import (
+    archive_entries, combine, download_script, extract_audio, extract_meeting_id, has_deskshare, locate_audio_source,
+    meeting_folder_path, output_is_current, output_video_name, playback_page_path, recording_outputs
+)
+from app.utils.presentation_util import safe_relative_path
+from app.utils.flight_util import recording_flight
+from app.utils.progress_util import report_progress
 
 
 class RecordingService:
@@ -69,27 +82,37 @@ class RecordingService:
         meeting_name = recording_send_email_input.meeting_name
         user_email = recording_send_email_input.email
 
-        combine_boolean, folder_name, folder_exists = await download_script(url, meeting_name)
-
-        # Check if the folder for the downloaded meeting exists
-        if not folder_exists:
-            try:
-                await combine(folder_name, combine_boolean)
-            except ApiException:
-                # If an exception occurs, remove the downloaded meeting folder and try combining again
-                shutil.rmtree(os.path.join(
-                    current.BASE_DIR, current.BBB.DOWNLOADED_MEETINGS_FOLDER, meeting_name + "-" + url[-5:]
-                ))
-                await combine(folder_name, combine_boolean)
-
-        download_meeting_dir = f'{meeting_name}-{url[-5:]}'
-        download_link = f'{current.NEXT_CLOUD.DOWNLOAD_SERVER}/{download_meeting_dir}/{download_meeting_dir}.zip'
-
+        # Concurrent requests for the same recording share one download and combine...
+        _, meeting_id = extract_meeting_id(url)
         host = current.API.HOST
         api_prefix = current.API.PREFIX
         active_version = current.API.ACTIVE_VERSION
+        if recording_send_email_input.audio_only:
+            # ...or one audio extraction, the small audio file is linked directly
+            download_meeting_dir, recording_file = await recording_flight.do(
+                f'{meeting_id}/audio', lambda: RecordingService._prepare_audio(url, meeting_name)
+            )
+            download_link = f'{current.NEXT_CLOUD.DOWNLOAD_SERVER}/{download_meeting_dir}/{recording_file}'
+        else:
+            download_meeting_dir = await recording_flight.do(
+                meeting_id, lambda: RecordingService._prepare_recording(url, meeting_name)
+            )
+            recording_file = output_video_name(download_meeting_dir)
+            # Without archive the video itself is downloaded
+            archive_file = recording_file if current.BBB.ARCHIVE_MODE == 'none' else f'{download_meeting_dir}.zip'
+            download_link = f'{current.NEXT_CLOUD.DOWNLOAD_SERVER}/{download_meeting_dir}/{archive_file}'
+            if current.BBB.ARCHIVE_MODE == 'stream':
+                # The zip is not on the download server, this API builds it while it is downloaded
+                download_link = f'{host}{api_prefix}/{active_version}/download/{parse.quote(archive_file)}'
+
+        # The recording can be watched online when it was packaged for the browser
+        playback_link = None
+        if not recording_send_email_input.audio_only and os.path.isfile(playback_page_path(download_meeting_dir)):
+            playback_link = f'{current.NEXT_CLOUD.DOWNLOAD_SERVER}/{download_meeting_dir}/' \
+                            f'{current.BBB.HLS_FOLDER}/index.html'
+
         endpoint = 'upload/recording'
-        recording_url = f'{current.NEXT_CLOUD.DOWNLOAD_SERVER}/{download_meeting_dir}/{download_meeting_dir}.mp4'
+        recording_url = f'{current.NEXT_CLOUD.DOWNLOAD_SERVER}/{download_meeting_dir}/{recording_file}'
 
         # set base64 to urlsafe...
         x_bearer_encrypted = base64.urlsafe_b64encode(base64.urlsafe_b64decode(x_bearer_encrypted)).decode()
@@ -97,9 +120,92 @@ class RecordingService:
         upload_link = f'{host}{api_prefix}/{active_version}/{endpoint}?' \
                       f'recording_url={recording_url}&x_header={x_bearer_encrypted}'
 
-        send_email(
+        # ...but every caller gets its own email
+        report_progress('emailing')
+        await asyncio.to_thread(
+            send_email,
             EmailInput(
                 to_email=user_email, room_name=meeting_name, download_meeting_dir=download_meeting_dir,
-                download_link=download_link, upload_link=upload_link
+                download_link=download_link, upload_link=upload_link, playback_link=playback_link
             )
         )
+
+    @staticmethod
+    async def get_archive(meeting_dir: str) -> List[zip_util.ZipPart]:
+        """
+        Return the layout of the zip of a combined recording, streamed from its files.
+        """
+        if safe_relative_path(meeting_dir) != meeting_dir or '/' in meeting_dir:
+            raise_exception(
+                ApiException(), HTTP_404_NOT_FOUND, f'{responses[HTTP_404_NOT_FOUND]}. Recording not found.',
+                FILE_NOT_FOUND
+            )
+        entries = await asyncio.to_thread(archive_entries, meeting_dir)
+        return zip_util.build_layout(entries)
+
+    @staticmethod
+    async def _prepare_recording(url: str, meeting_name: str) -> str:
+        """
+        Download and combine the recording, return the name of its folder in the downloaded meetings.
+        """
+        _, meeting_id = extract_meeting_id(url)
+
+        # Make room before downloading, meetings with a job in flight are kept
+        await asyncio.to_thread(cache_util.evict, RecordingService._busy_meetings())
+
+        combine_boolean, folder_name, folder_exists = await RecordingService._download(url, meeting_name)
+
+        if combine_boolean is None:
+            combine_boolean = has_deskshare(meeting_folder_path(folder_name))
+
+        # Check if the folder for the downloaded meeting exists, and its outputs (skipped by audio-only jobs),
+        # built from the current inputs with an accepted encoding profile
+        outputs = recording_outputs(folder_name)
+        if not folder_exists or not all(os.path.isfile(output) for output in outputs) or \
+                not output_is_current(folder_name, combine_boolean):
+            try:
+                await combine(folder_name, combine_boolean)
+            except ApiException:
+                # If an exception occurs, remove the downloaded meeting folder and try combining again
+                shutil.rmtree(os.path.join(current.BASE_DIR, current.BBB.DOWNLOADED_MEETINGS_FOLDER, folder_name))
+                await combine(folder_name, combine_boolean)
+
+        # Record the access and size of the meeting, then enforce the cache quota
+        await asyncio.to_thread(cache_util.touch, meeting_id, folder_name)
+        await asyncio.to_thread(cache_util.evict, RecordingService._busy_meetings())
+
+        return folder_name
+
+    @staticmethod
+    async def _prepare_audio(url: str, meeting_name: str) -> Tuple[str, str]:
+        """
+        Extract the audio of the recording, return the meeting folder and the audio file names.
+
+        Only the webcams are read, straight from the BBB server unless the meeting was downloaded already.
+        """
+        _, meeting_id = extract_meeting_id(url)
+        await asyncio.to_thread(cache_util.evict, RecordingService._busy_meetings())
+
+        folder_name, webcams_source = await locate_audio_source(url, meeting_name)
+        audio_file = await extract_audio(folder_name, webcams_source)
+
+        await asyncio.to_thread(cache_util.touch, meeting_id, folder_name)
+        await asyncio.to_thread(cache_util.evict, RecordingService._busy_meetings())
+
+        return folder_name, audio_file
+
+    @staticmethod
+    async def _download(url: str, meeting_name: str):
+        """
+        Download the meeting once for the video and audio jobs running at the same time.
+        """
+        _, meeting_id = extract_meeting_id(url)
+        report_progress('downloading')
+        return await recording_flight.do(f'{meeting_id}/download', lambda: download_script(url, meeting_name))
+
+    @staticmethod
+    def _busy_meetings() -> Set[str]:
+        """
+        Return the meeting ids with a job in flight.
+        """
+        return {key.split('/')[0] for key in recording_flight.in_flight()}
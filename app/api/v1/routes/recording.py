@@ -1,29 +1,37 @@
-from typing import Annotated, Union
+from typing import Annotated, Optional, Union
 import logging
+from urllib import parse
 
-from fastapi import Header
-from fastapi.responses import RedirectResponse
+from fastapi import Header, Request
+from fastapi.responses import RedirectResponse, Response, StreamingResponse
 
 from app.api.schemas.exception_schema import ApiExceptionResponse
 from fastapi import APIRouter, Depends
 from starlette.status import (
     HTTP_200_OK,
+    HTTP_202_ACCEPTED,
+    HTTP_206_PARTIAL_CONTENT,
     HTTP_302_FOUND,
     HTTP_400_BAD_REQUEST,
     HTTP_401_UNAUTHORIZED,
     HTTP_403_FORBIDDEN,
     HTTP_404_NOT_FOUND,
-    HTTP_405_METHOD_NOT_ALLOWED
+    HTTP_405_METHOD_NOT_ALLOWED,
+    HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE
 )
 
+from app.api.schemas.job_schema import JobResponse
 from app.api.schemas.recording_schema import (
     RecordingSendEmailInput,
     RecordingUploadInput,
     RecordingSendEmailResponse
 )
 from app.api.services.auth_service import AuthService
+from app.api.services.job_service import JobService
 from app.api.services.recording_service import RecordingService
 from app.config import current
+from app.utils.file_util import extract_meeting_id
+from app.utils.zip_util import iter_range, layout_etag, layout_size, parse_range
 
 logger = logging.getLogger(__name__)
 
@@ -75,25 +83,96 @@ async def upload_recording(
 @router.get(
     '/video/{url:path}:{meeting_name}/{email}',
     summary='Send email with link for download and upload into user drive',
-    status_code=HTTP_200_OK,
+    status_code=HTTP_202_ACCEPTED,
     response_model=RecordingSendEmailResponse
 )
 async def send_email_with_recording_links(
     url: str, meeting_name: str, email: str,
     x_bearer: Annotated[str, Header()],
-    recording_service: RecordingService = Depends(RecordingService),
+    audio_only: bool = False,
+    job_service: JobService = Depends(JobService),
     _: dict = Depends(AuthService.verify_access_token)
 ) -> RecordingSendEmailResponse:
     """
     Send email with links for download recording and the option of loading it to user drive.
 
+    With `audio_only`, only the audio of the recording is extracted and linked.
+
+    The recording is prepared in the background, the job returned can be followed with `GET /jobs/{id}`.
+
     ### NOTICE:
     - `x_bearer` must be in the format: `'{user: 'fake-user', token: 'fake-token'}'`
     """
-    await recording_service.send_email(
-        recording_send_email_input=RecordingSendEmailInput(
-            x_bearer_encrypted=x_bearer, url=url, meeting_name=meeting_name, email=email
-        )
+    recording_send_email_input = RecordingSendEmailInput(
+        x_bearer_encrypted=x_bearer, url=url, meeting_name=meeting_name, email=email, audio_only=audio_only
     )
+    # A url without meeting id is rejected right away
+    extract_meeting_id(url)
+
+    job = await job_service.submit('audio' if audio_only else 'video', recording_send_email_input.model_dump())
+    return RecordingSendEmailResponse(data=job)
+
+
+@router.get(
+    '/jobs/{job_id}',
+    summary='Return the stage, progress and error of a recording job',
+    status_code=HTTP_200_OK,
+    response_model=JobResponse
+)
+async def get_job(
+    job_id: str,
+    job_service: JobService = Depends(JobService),
+    _: dict = Depends(AuthService.verify_access_token)
+) -> JobResponse:
+    return JobResponse(data=job_service.get(job_id))
+
 
-    return RecordingSendEmailResponse()
+@router.api_route(
+    '/download/{meeting_dir}.zip',
+    methods=['GET', 'HEAD'],
+    summary='Download the recording as a zip',
+    status_code=HTTP_200_OK,
+    response_class=StreamingResponse
+)
+async def download_recording_archive(
+    meeting_dir: str,
+    request: Request,
+    range_header: Annotated[Optional[str], Header(alias='Range')] = None,
+    if_range: Annotated[Optional[str], Header()] = None,
+    recording_service: RecordingService = Depends(RecordingService)
+) -> Response:
+    """
+    Download the zip of a combined recording.
+
+    The zip stores the recording as is and is built while it is sent, a single byte range
+    can be requested to resume an interrupted download.
+    """
+    parts = await recording_service.get_archive(meeting_dir)
+    size = layout_size(parts)
+    etag = layout_etag(parts)
+    headers = {
+        'Accept-Ranges': 'bytes',
+        'ETag': etag,
+        'Content-Disposition': f"attachment; filename*=UTF-8''{parse.quote(meeting_dir)}.zip",
+    }
+
+    # A resumed download only gets the range while the archive is the one it started with
+    byte_range = None
+    if not if_range or if_range == etag:
+        try:
+            byte_range = parse_range(range_header, size)
+        except ValueError:
+            headers['Content-Range'] = f'bytes */{size}'
+            return Response(status_code=HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE, headers=headers)
+
+    start, end = byte_range or (0, size - 1)
+    headers['Content-Length'] = str(end - start + 1)
+    if byte_range:
+        headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+    status_code = HTTP_206_PARTIAL_CONTENT if byte_range else HTTP_200_OK
+
+    if request.method == 'HEAD':
+        return Response(status_code=status_code, headers=headers, media_type='application/zip')
+    return StreamingResponse(
+        iter_range(parts, start, end), status_code=status_code, headers=headers, media_type='application/zip'
+    )
@@ -10,9 +10,10 @@ from app.api.schemas.exception_schema import ApiExceptionResponse
 from app.api.services.auth_service import AuthService
 from app.api.schemas.utils_schema import (
     EncryptMessageSchema, EncryptMessageResponse, DecryptMessageSchema, DecryptMessageResponse, MessageInputSchema,
-    VersionSchema, VersionResponse
+    VersionSchema, VersionResponse, DownloadMetricsSchema, DownloadMetricsResponse
 )
 from app.config import current
+from app.utils.metrics_util import download_metrics
 from app.utils.rsa_util import encrypt, decrypt
 
 router = APIRouter(
@@ -36,6 +37,15 @@ async def get_version(_: dict = Depends(AuthService.verify_access_token)):
     return VersionResponse(data=VersionSchema(version=current.VERSION))
 
 
+@router.get(
+    '/metrics/downloads',
+    summary='Return aggregate download counters and histograms',
+    response_model=DownloadMetricsResponse
+)
+async def get_download_metrics(_: dict = Depends(AuthService.verify_access_token)) -> DownloadMetricsResponse:
+    return DownloadMetricsResponse(data=DownloadMetricsSchema(**download_metrics.snapshot()))
+
+
 @router.post(
     '/encrypt_message',
     summary='Encrypt test message',
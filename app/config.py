@@ -1,7 +1,9 @@
 import os
 import re
 from pathlib import Path
+from typing import Dict, Literal
 
+from pydantic import BaseModel
 from pydantic_settings import BaseSettings
 
 from app.constants import API_PREFIX, SWAGGER_DOC_PATH, OPENAPI_DOC_URL
@@ -46,15 +48,73 @@ class NextCloudSettings(EnvSettings):
         env_prefix = 'NEXT_CLOUD_'
 
 
+class EncodingProfile(BaseModel):
+    preset: str = 'medium'
+    crf: int = 23
+    maxrate_kbps: int = 0  # 0 = no cap
+    threads: int = 0  # 0 = chosen by the encoder
+
+
 class BBBSettings(EnvSettings):
     SERVER: str = 'nextcloud.local'
     METADATA_FILENAME: str = 'bbb-player-metadata.json'
     DOWNLOADED_MEETINGS_FOLDER: str = 'downloadedMeetings'
     DOWNLOADED_FULLY_FILENAME: str = 'rec_fully_downloaded.txt'
     DEFAULT_COMBINED_VIDEO_NAME: str = 'combine-output'
-    COMBINED_VIDEO_FORMAT: str = 'mkv'
+    COMBINED_VIDEO_FORMAT: str = 'mp4'
     INFO_VERSION: str = '1'
     PLAYBACK_VERSION: str = '3.1.1'
+    CONCURRENT_DOWNLOADS: bool = True
+    DOWNLOAD_CONCURRENCY: int = 3
+    DOWNLOAD_SEGMENTS: int = 4
+    DOWNLOAD_SEGMENT_MIN_BYTES: int = 64 * 1024 * 1024  # 64 MiB
+    DOWNLOAD_CHUNK_BYTES: int = 1024 * 1024  # 1 MiB
+    DOWNLOAD_CHECKPOINT_BYTES: int = 16 * 1024 * 1024  # 16 MiB
+    DOWNLOAD_RETRIES: int = 3
+    DOWNLOAD_TIMEOUT_SECONDS: int = 30
+    DOWNLOAD_MAX_TRANSFERS: int = 8
+    DOWNLOAD_MAX_TRANSFERS_PER_ORIGIN: int = 6
+    DOWNLOAD_BANDWIDTH_PER_ORIGIN: int = 0  # bytes/s, 0 = unlimited
+    DOWNLOAD_THREADS: int = 32  # threads of the transfers, apart from the default executor
+    VERIFY_SSL: bool = False
+    HTTP_POOL_CONNECTIONS: int = 4
+    HTTP_POOL_MAXSIZE: int = 16
+    REVALIDATE_CACHED: bool = True
+    STREAM_COMBINE: bool = False
+    PRESENTATION_ASSETS: bool = True
+    PRESENTATION_CONCURRENCY: int = 8
+    PRESENTATION_BATCH_SIZE: int = 50
+    CACHE_INDEX_FILENAME: str = '.cache-index.json'
+    OUTPUT_CACHE_INDEX_FILENAME: str = '.output-cache-index.json'
+    CACHE_MAX_BYTES: int = 0  # 0 = no quota
+    CACHE_MIN_FREE_BYTES: int = 0  # 0 = no free disk threshold
+    COMBINE_ENGINE: str = 'ffmpeg'  # ffmpeg or moviepy
+    TRANSCODE_WORKERS: int = 2
+    ENCODING_PROFILES: Dict[str, EncodingProfile] = {
+        'quality': EncodingProfile(preset='medium', crf=23),
+        'balanced': EncodingProfile(preset='veryfast', crf=24),
+        'fast': EncodingProfile(preset='ultrafast', crf=26, maxrate_kbps=4000),
+    }
+    # Backlog of transcoding jobs from which each profile is used, the highest threshold reached wins
+    ENCODING_PROFILE_BACKLOG: Dict[str, int] = {'quality': 0, 'balanced': 2, 'fast': 6}
+    ENCODING_PROFILE: str = ''  # always use this profile, empty = adaptive
+    SEGMENTED_ENCODING: bool = True  # also checkpoints the encode, a restarted job resumes after the last segment
+    ENCODE_SEGMENT_SECONDS: int = 300
+    ENCODE_SEGMENT_PARALLELISM: int = 4
+    IDLE_DETECTION: bool = True
+    IDLE_MIN_SECONDS: int = 10
+    IDLE_FRAME_SECONDS: int = 5  # one deskshare frame every 5 s while idle
+    IDLE_WEBCAMS_ONLY_RATIO: float = 0.95
+    # stream (zip built on download), stored, deflated or none (the video is linked)
+    ARCHIVE_MODE: Literal['stream', 'stored', 'deflated', 'none'] = 'stream'
+    HLS_ENABLED: bool = True
+    HLS_FOLDER: str = 'hls'
+    HLS_SEGMENT_SECONDS: int = 6
+    HLS_PLAYER_SCRIPT_URL: str = 'https://cdn.jsdelivr.net/npm/hls.js@1'
+    JOB_RETENTION_SECONDS: int = 7 * 24 * 3600  # finished jobs stay available for polling this long
+    JOB_STORE_FOLDER: str = 'jobs'  # under BASE_DIR unless absolute, never inside the served meetings folder
+    JOB_STORE_FILENAME: str = 'jobs.sqlite3'
+    JOB_MAX_ATTEMPTS: int = 3  # runs of a job interrupted by restarts before it is given up
 
     class Config:
         env_prefix = 'BBB_'
@@ -93,6 +153,7 @@ class EmailSettings(EnvSettings):
     SMTP_PORT: int = 587
     SENDER_EMAIL: str = ''
     SENDER_PASSWORD: str = ''
+    TIMEOUT_SECONDS: int = 30
 
     class Config:
         env_prefix = 'EMAIL_'
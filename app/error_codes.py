@@ -18,3 +18,7 @@ FOLDER_CREATION_FAILED = 'folder:creation-failed'
 
 RSA_ENCRYPT_PROCESS_FAIL = 'rsa:encrypt-process-fail'
 RSA_DECRYPT_PROCESS_FAIL = 'rsa:decrypt-process-fail'
+
+MEETING_NOT_FOUND = 'meeting:not-found'
+
+JOB_NOT_FOUND = 'job:not-found'
@@ -0,0 +1,130 @@
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+from app.config import current
+from app.utils import json_index_util
+
+logger = logging.getLogger(__name__)
+
+# Guards the index file, the cache is touched from the event loop and from worker threads
+_index_lock = threading.RLock()
+
+
+def _index_path() -> str:
+    return json_index_util.index_path(current.BBB.CACHE_INDEX_FILENAME)
+
+
+def folder_size(path: str) -> int:
+    """
+    Return the size in bytes of every file below `path`.
+    """
+    size = 0
+    for root, _, files in os.walk(path):
+        for file in files:
+            try:
+                size += os.lstat(os.path.join(root, file)).st_size
+            except OSError:
+                pass
+    return size
+
+
+def _scan_meetings() -> Dict[str, dict]:
+    """
+    Build index entries for meeting folders downloaded before the index existed.
+    """
+    index: Dict[str, dict] = {}
+    if not os.path.isdir(json_index_util.meetings_dir()):
+        return index
+
+    for entry in os.scandir(json_index_util.meetings_dir()):
+        if not entry.is_dir():
+            continue
+        try:
+            with open(os.path.join(entry.path, current.BBB.METADATA_FILENAME), 'r') as bjf:
+                meeting_id = json.load(bjf).get('meeting_id')
+        except (OSError, ValueError):
+            continue
+        if meeting_id:
+            index[meeting_id] = {
+                'folder': entry.name, 'size': folder_size(entry.path), 'last_access': entry.stat().st_mtime
+            }
+    return index
+
+
+def load_index() -> Dict[str, dict]:
+    with _index_lock:
+        return json_index_util.load_index(current.BBB.CACHE_INDEX_FILENAME, _scan_meetings)
+
+
+def _save_index(index: Dict[str, dict]) -> None:
+    json_index_util.save_index(current.BBB.CACHE_INDEX_FILENAME, index)
+
+
+def get_cached_folder(meeting_id: str) -> Optional[str]:
+    """
+    Return the folder already holding `meeting_id`, whatever meeting name it was requested with.
+    """
+    with _index_lock:
+        entry = load_index().get(meeting_id)
+        if entry and os.path.isdir(os.path.join(json_index_util.meetings_dir(), entry['folder'])):
+            return entry['folder']
+    return None
+
+
+def touch(meeting_id: str, folder_name: str) -> None:
+    """
+    Register an access to the meeting folder and refresh its size.
+    """
+    size = folder_size(os.path.join(json_index_util.meetings_dir(), folder_name))
+    with _index_lock:
+        index = load_index()
+        index[meeting_id] = {'folder': folder_name, 'size': size, 'last_access': time.time()}
+        _save_index(index)
+
+
+def _needs_eviction(total_size: int) -> bool:
+    if current.BBB.CACHE_MAX_BYTES > 0 and total_size > current.BBB.CACHE_MAX_BYTES:
+        return True
+    if current.BBB.CACHE_MIN_FREE_BYTES > 0:
+        return shutil.disk_usage(json_index_util.meetings_dir()).free < current.BBB.CACHE_MIN_FREE_BYTES
+    return False
+
+
+def evict(protected: Iterable[str] = ()) -> List[str]:
+    """
+    Remove least recently used meetings until the byte quota and free disk threshold are respected.
+
+    Meetings in `protected` (e.g. with an in-flight job) are never evicted.
+    Return the evicted meeting ids.
+    """
+    evicted: List[str] = []
+    if not os.path.isdir(json_index_util.meetings_dir()):
+        return evicted
+
+    protected = set(protected)
+    with _index_lock:
+        index = load_index()
+        total_size = sum(entry['size'] for entry in index.values())
+        candidates = sorted(
+            (meeting_id for meeting_id in index if meeting_id not in protected),
+            key=lambda meeting_id: index[meeting_id]['last_access']
+        )
+
+        for meeting_id in candidates:
+            if not _needs_eviction(total_size):
+                break
+
+            entry = index.pop(meeting_id)
+            logger.info(f'Evicting meeting {meeting_id} ({entry["size"]} bytes) from {entry["folder"]}')
+            shutil.rmtree(os.path.join(json_index_util.meetings_dir(), entry['folder']), ignore_errors=True)
+            total_size -= entry['size']
+            evicted.append(meeting_id)
+
+        if evicted or not os.path.isfile(_index_path()):
+            _save_index(index)
+    return evicted
@@ -0,0 +1,257 @@
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import math
+import os
+import time
+import threading
+from typing import Callable, List, Optional
+
+from requests import exceptions
+from starlette.status import HTTP_200_OK, HTTP_206_PARTIAL_CONTENT, HTTP_304_NOT_MODIFIED, HTTP_404_NOT_FOUND
+
+from app.config import current
+from app.utils.http_util import get_bbb_session
+from app.utils.metrics_util import TransferStats
+from app.utils.scheduler_util import download_scheduler
+
+logger = logging.getLogger(__name__)
+
+
+class RangeNotSupportedError(Exception):
+    """
+    The server answered a range request with something other than the requested bytes.
+    """
+
+
+def _validator(headers) -> Optional[str]:
+    """
+    Return the strongest validator for the remote file (ETag, else Last-Modified).
+    """
+    return headers.get('ETag') or headers.get('Last-Modified')
+
+
+def build_segments(size: int) -> List[List[int]]:
+    """
+    Split a file of `size` bytes in `[start, end, done]` byte ranges (inclusive `end`).
+    """
+    if size <= 0:
+        return [[0, -1, 0]]
+
+    segment_count = 1
+    if size >= current.BBB.DOWNLOAD_SEGMENT_MIN_BYTES:
+        segment_count = max(min(current.BBB.DOWNLOAD_SEGMENTS, size // current.BBB.DOWNLOAD_SEGMENT_MIN_BYTES), 1)
+
+    segment_size = math.ceil(size / segment_count)
+    return [
+        [start, min(start + segment_size, size) - 1, 0]
+        for start in range(0, size, segment_size)
+    ]
+
+
+def probe(url: str) -> dict:
+    """
+    Ask the server for size, range support and validator of the remote file.
+    """
+    response = get_bbb_session().head(url, allow_redirects=True, timeout=current.BBB.DOWNLOAD_TIMEOUT_SECONDS)
+    response.raise_for_status()
+
+    size = int(response.headers.get('Content-Length') or -1)
+    return {
+        'size': size,
+        'ranges': response.headers.get('Accept-Ranges', '').lower() == 'bytes' and size > 0,
+        'validator': _validator(response.headers),
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+    }
+
+
+def is_modified(url: str, validators: dict) -> bool:
+    """
+    Conditional HEAD request telling whether the remote file changed since `validators` were stored.
+
+    `validators` holds the `etag`, `last_modified` and `size` seen on the previous download
+    (empty when the file was missing back then).
+    """
+    headers = {}
+    if validators.get('etag'):
+        headers['If-None-Match'] = validators['etag']
+    if validators.get('last_modified'):
+        headers['If-Modified-Since'] = validators['last_modified']
+
+    response = get_bbb_session().head(
+        url, headers=headers, allow_redirects=True, timeout=current.BBB.DOWNLOAD_TIMEOUT_SECONDS
+    )
+    if response.status_code == HTTP_304_NOT_MODIFIED:
+        return False
+    if response.status_code == HTTP_404_NOT_FOUND:
+        # Keep the local copy of a file the server no longer has
+        return False
+    response.raise_for_status()
+
+    if not validators:
+        return True
+
+    # Servers ignoring conditional HEAD requests still let us compare the validators
+    current_validators = {
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+        'size': int(response.headers.get('Content-Length') or -1),
+    }
+    return any(
+        validators.get(key) not in [None, -1] and value not in [None, -1] and validators[key] != value
+        for key, value in current_validators.items()
+    )
+
+
+def _new_state(state: dict, remote: dict) -> None:
+    state.clear()
+    state.update(remote)
+    state['segments'] = build_segments(remote['size']) if remote['ranges'] else [[0, -1, 0]]
+
+
+def _can_resume(state: dict, remote: dict, part_path: str) -> bool:
+    return all([
+        bool(state.get('segments')),
+        state.get('ranges') is True,
+        remote['ranges'],
+        state.get('size') == remote['size'],
+        state.get('validator') == remote['validator'],
+        os.path.isfile(part_path),
+    ])
+
+
+def _download_segment(
+        url: str, part_path: str, segment: List[int], state: dict, checkpoint: Callable, job_id: str,
+        stats: TransferStats
+) -> None:
+    """
+    Download the missing bytes of one segment straight into its offset in the part file.
+    """
+    with download_scheduler.transfer(job_id, url):
+        _transfer_segment(url, part_path, segment, state, checkpoint, stats)
+
+
+def _transfer_segment(
+        url: str, part_path: str, segment: List[int], state: dict, checkpoint: Callable, stats: TransferStats
+) -> None:
+    start, end, _ = segment
+    headers = {}
+    ranged = state.get('ranges') is True
+    if ranged:
+        headers['Range'] = f'bytes={start + segment[2]}-{end}'
+        if state.get('validator'):
+            headers['If-Range'] = state['validator']
+    else:
+        # without range support a retry has to start again from byte zero
+        segment[2] = 0
+
+    with get_bbb_session().get(
+        url, headers=headers, stream=True, timeout=current.BBB.DOWNLOAD_TIMEOUT_SECONDS
+    ) as response:
+        # requests measures the time until the response headers arrived
+        stats.first_byte(response.elapsed.total_seconds())
+        response.raise_for_status()
+        if ranged and response.status_code != HTTP_206_PARTIAL_CONTENT:
+            raise RangeNotSupportedError(f'Expected 206 for {url}, got {response.status_code}')
+        if not ranged and response.status_code != HTTP_200_OK:
+            raise RangeNotSupportedError(f'Expected 200 for {url}, got {response.status_code}')
+
+        # Unbuffered: the checkpoint of any segment may persist this counter, the bytes it counts
+        # must already be in the file by then
+        with open(part_path, 'r+b' if ranged else 'wb', buffering=0) as part_file:
+            part_file.seek(start + segment[2])
+            unsaved = 0
+            for chunk in response.iter_content(chunk_size=current.BBB.DOWNLOAD_CHUNK_BYTES):
+                download_scheduler.throttle(url, len(chunk))
+                view = memoryview(chunk)
+                while view:
+                    view = view[part_file.write(view):]
+                segment[2] += len(chunk)
+                stats.add_bytes(len(chunk))
+                unsaved += len(chunk)
+
+                # Persist the progress from time to time
+                if unsaved >= current.BBB.DOWNLOAD_CHECKPOINT_BYTES:
+                    checkpoint()
+                    unsaved = 0
+
+    checkpoint()
+
+
+def _download_segment_with_retries(
+        url: str, part_path: str, segment: List[int], state: dict, checkpoint: Callable, job_id: str,
+        stats: TransferStats
+) -> None:
+    retries = max(current.BBB.DOWNLOAD_RETRIES, 0)
+    for attempt in range(retries + 1):
+        try:
+            _download_segment(url, part_path, segment, state, checkpoint, job_id, stats)
+            return
+        except (exceptions.ConnectionError, exceptions.Timeout, exceptions.ChunkedEncodingError) as ex:
+            if attempt == retries:
+                raise
+            stats.retry()
+            logger.warning(f'Download of {url} interrupted ({ex}), resuming at byte {segment[0] + segment[2]}')
+            time.sleep(2 ** attempt)
+
+
+def fetch_file(
+        url: str, save_path: str, state: dict, checkpoint: Callable[[], None], lock: threading.RLock,
+        job_id: str = '', stats: Optional[TransferStats] = None
+) -> None:
+    """
+    Resumable download of `url` into `save_path`, meant to run in a worker thread.
+
+    Bytes land in `{save_path}.part` and the per-segment progress is kept in `state`, which the
+    caller persists through `checkpoint` while holding `lock`. A later call with the same `state`
+    only requests the missing byte ranges, as long as the remote file did not change in the meantime.
+    Every transfer waits for a slot of the download scheduler, queued under `job_id`, and is
+    accounted in `stats`.
+    """
+    stats = stats or TransferStats()
+    part_path = f'{save_path}.part'
+    remote = probe(url)
+
+    if _can_resume(state, remote, part_path):
+        logger.info(f'Resuming {url} from {sum(segment[2] for segment in state["segments"])} bytes')
+    else:
+        with lock:
+            _new_state(state, remote)
+        with open(part_path, 'wb') as part_file:
+            if remote['ranges']:
+                part_file.truncate(remote['size'])
+    checkpoint()
+
+    try:
+        _download_pending_segments(url, part_path, state, checkpoint, job_id, stats)
+    except RangeNotSupportedError as ex:
+        # Fall back to a plain download from byte zero
+        logger.warning(f'{ex}. Downloading {url} again without ranges')
+        with lock:
+            _new_state(state, {**remote, 'ranges': False})
+        checkpoint()
+        _download_pending_segments(url, part_path, state, checkpoint, job_id, stats)
+
+    os.replace(part_path, save_path)
+    with lock:
+        state['complete'] = True
+    checkpoint()
+
+
+def _download_pending_segments(
+        url: str, part_path: str, state: dict, checkpoint: Callable[[], None], job_id: str, stats: TransferStats
+) -> None:
+    pending = [segment for segment in state['segments'] if segment[1] < 0 or segment[2] < segment[1] - segment[0] + 1]
+    if len(pending) > 1:
+        # Large files are fetched as parallel byte ranges
+        with ThreadPoolExecutor(max_workers=len(pending)) as executor:
+            futures = [
+                executor.submit(
+                    _download_segment_with_retries, url, part_path, segment, state, checkpoint, job_id, stats
+                )
+                for segment in pending
+            ]
+            for future in futures:
+                future.result()
+    elif pending:
+        _download_segment_with_retries(url, part_path, pending[0], state, checkpoint, job_id, stats)
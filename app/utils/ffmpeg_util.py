@@ -0,0 +1,402 @@
+import logging
+import os
+import re
+import subprocess
+from typing import List, Optional, Tuple
+
+from moviepy.config import get_setting
+
+logger = logging.getLogger(__name__)
+
+# Options letting ffmpeg read a video straight from the BBB server through dropped connections
+HTTP_INPUT_OPTIONS = ['-reconnect', '1', '-reconnect_streamed', '1', '-reconnect_delay_max', '30']
+
+
+# Containers whose index can be moved in front of the media data for fast start
+FASTSTART_FORMATS = ['mp4', 'mov', 'm4a']
+
+# Container taking each audio codec as is
+AUDIO_CONTAINERS = {'aac': 'm4a', 'alac': 'm4a', 'opus': 'opus', 'vorbis': 'ogg', 'mp3': 'mp3', 'flac': 'flac'}
+
+
+class FFmpegError(Exception):
+    """
+    ffmpeg exited with an error.
+    """
+
+
+def ffmpeg_binary() -> str:
+    """
+    Return the ffmpeg executable, the same one moviepy uses.
+    """
+    return get_setting('FFMPEG_BINARY')
+
+
+def is_url(source: str) -> bool:
+    return source.startswith(('http://', 'https://'))
+
+
+def input_options(source: str) -> List[str]:
+    """
+    Return the ffmpeg options reading `source`, a local path or an http(s) url.
+    """
+    if is_url(source):
+        return HTTP_INPUT_OPTIONS + ['-i', source]
+    return ['-i', source]
+
+
+def run_ffmpeg(args: List[str]) -> str:
+    """
+    Run ffmpeg with `args` and return its log, raise FFmpegError when it fails.
+    """
+    command = [ffmpeg_binary(), '-hide_banner', '-nostdin', '-y'] + args
+    logger.debug(f'Running {" ".join(command)}')
+    process = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    log = process.stderr.decode('utf-8', errors='replace')
+    if process.returncode != 0:
+        raise FFmpegError(f'ffmpeg exited with {process.returncode}: {log[-2000:]}')
+    return log
+
+
+def probe_media(source: str) -> dict:
+    """
+    Return duration, video size, frame rate, pixel format and codecs of `source`, read from the ffmpeg input log.
+    """
+    process = subprocess.run(
+        [ffmpeg_binary(), '-hide_banner', '-nostdin'] + input_options(source),
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+    )
+    log = process.stderr.decode('utf-8', errors='replace')
+
+    video = re.search(r'Stream #0:\d+.*?: Video: (\w+).*?, (\d{2,5})x(\d{2,5})', log)
+    if not video:
+        raise FFmpegError(f'No video stream found in {source}: {log[-2000:]}')
+    pix_fmt = re.search(r'Stream #0:\d+.*?: Video: \w+[^,]*, (\w+)', log)
+    audio = re.search(r'Stream #0:\d+.*?: Audio: (\w+)', log)
+    fps = re.search(r'([\d.]+) fps', log) or re.search(r'([\d.]+) tbr', log)
+    duration = re.search(r'Duration: (\d+):(\d+):([\d.]+)', log)
+
+    return {
+        'duration': _seconds(*duration.groups()) if duration else None,
+        'width': int(video.group(2)),
+        'height': int(video.group(3)),
+        'fps': float(fps.group(1)) if fps else None,
+        'video_codec': video.group(1),
+        'pix_fmt': pix_fmt.group(1) if pix_fmt else None,
+        'audio_codec': audio.group(1) if audio else None,
+    }
+
+
+def _seconds(hours: str, minutes: str, seconds: str) -> float:
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+def side_by_side_filter(
+        left: dict, right: dict, fps: Optional[float], hold: float = 0, left_idle: Optional[dict] = None
+) -> str:
+    """
+    Filter graph putting the `left` and `right` videos next to each other, like moviepy clips_array.
+
+    Both are centered vertically in a frame as high as the tallest one, on a black background.
+    Every size is rounded to even numbers as yuv420p and libx264 require. With `hold`, the last
+    frame of each video is repeated for that many seconds. With `left_idle`, the left video only
+    keeps one frame every `frame_seconds` during its `intervals` of inactivity.
+    """
+    height = _even(max(left['height'], right['height']))
+    rate = f',fps={fps}' if fps else ''
+    if hold:
+        rate += f',tpad=stop_mode=clone:stop_duration={hold}'
+
+    def cell(index: int, media: dict, idle: Optional[dict] = None) -> str:
+        # Scaling into the cell keeps the layout when the deskshare changes resolution midway
+        width = _even(media['width'])
+        ratio = f'min({width}/iw,{height}/ih)'
+        # Frames dropped while idle are not scaled, the frame rate filter repeats the kept ones afterwards
+        select = f"select='{idle_select_expression(idle)}'," if idle and idle['intervals'] else ''
+        return (
+            f"[{index}:v]{select}scale=w='trunc({ratio}*iw/2)*2':h='trunc({ratio}*ih/2)*2',format=yuv420p,"
+            f'pad={width}:{height}:(ow-iw)/2:(oh-ih)/2:black,setsar=1{rate}[v{index}]'
+        )
+
+    return ';'.join([cell(0, left, left_idle), cell(1, right), '[v0][v1]hstack=inputs=2[v]'])
+
+
+def idle_select_expression(idle: dict) -> str:
+    """
+    Expression of the select filter keeping every frame outside of the idle intervals, one every
+    `frame_seconds` inside. `offset` is the time of the input at which the frame timestamps start.
+    """
+    offset = idle.get('offset', 0)
+    idle_time = '+'.join(
+        f'between(t,{start - offset:.3f},{end - offset:.3f})' for start, end in idle['intervals']
+        if end > offset
+    ) or '0'
+    return f"not({idle_time})+isnan(prev_selected_t)+gte(t-prev_selected_t,{idle['frame_seconds']})"
+
+
+def _even(size: int) -> int:
+    return size + size % 2
+
+
+def video_encoder_options(profile: Optional[dict] = None) -> List[str]:
+    """
+    Return the H.264 encoder options, tuned by an encoding `profile` if any.
+    """
+    return ['-c:v', 'libx264', '-pix_fmt', 'yuv420p'] + profile_options(profile)
+
+
+def profile_options(profile: Optional[dict]) -> List[str]:
+    """
+    Return the libx264 options of an encoding `profile` (preset, crf, maxrate_kbps, threads).
+    """
+    if not profile:
+        return []
+
+    args = ['-preset', profile['preset'], '-crf', str(profile['crf'])]
+    if profile.get('maxrate_kbps'):
+        # Capped CRF, the buffer lets the rate vary over two seconds
+        args += ['-maxrate', f'{profile["maxrate_kbps"]}k', '-bufsize', f'{2 * profile["maxrate_kbps"]}k']
+    if profile.get('threads'):
+        args += ['-threads', str(profile['threads'])]
+    return args
+
+
+def combine_command(
+        left_source: str, right_source: str, output_path: str, profile: Optional[dict] = None,
+        left_idle: Optional[dict] = None
+) -> List[str]:
+    """
+    Return the ffmpeg arguments encoding `left_source` and `right_source` side by side into `output_path`.
+    """
+    left = probe_media(left_source)
+    right = probe_media(right_source)
+
+    audio_filter, audio_map = _audio_graph(left, right)
+    filter_graph = ';'.join(
+        [side_by_side_filter(left, right, _frame_rate(left, right), left_idle=left_idle)] + audio_filter
+    )
+
+    args = input_options(left_source) + input_options(right_source)
+    args += ['-filter_complex', filter_graph, '-map', '[v]'] + audio_map
+    args += video_encoder_options(profile) + ['-c:a', 'aac'] + output_options(output_path)
+    return args
+
+
+def _frame_rate(left: dict, right: dict) -> Optional[float]:
+    return max(left['fps'] or 0, right['fps'] or 0) or None
+
+
+def _audio_graph(left: dict, right: dict) -> Tuple[List[str], List[str]]:
+    """
+    Return the audio filters and the map options of a side by side output.
+    """
+    # The audio of both videos is mixed like moviepy does, usually only the webcams have some
+    if left['audio_codec'] and right['audio_codec']:
+        return ['[0:a][1:a]amix=inputs=2:duration=longest,volume=2[a]'], ['-map', '[a]']
+    if left['audio_codec']:
+        return [], ['-map', '0:a']
+    if right['audio_codec']:
+        return [], ['-map', '1:a']
+    return [], []
+
+
+def detect_idle(source: str, min_seconds: float) -> dict:
+    """
+    Return the duration of `source` and its intervals of at least `min_seconds` where the picture is frozen or black.
+
+    Two frames per second of a downscaled picture are enough to tell, the analysis costs little more than decoding.
+    """
+    duration = probe_media(source)['duration'] or 0
+    detect_filter = f'fps=2,scale=320:-2,freezedetect=d={min_seconds},blackdetect=d={min_seconds}'
+    log = run_ffmpeg(input_options(source) + ['-map', '0:v:0', '-vf', detect_filter, '-f', 'null', '-'])
+
+    intervals = []
+    freeze_start = None
+    for match in re.finditer(r'freeze_(start|end): ([\d.]+)|black_start:([\d.]+) black_end:([\d.]+)', log):
+        if match.group(1) == 'start':
+            freeze_start = float(match.group(2))
+        elif match.group(1) == 'end' and freeze_start is not None:
+            intervals.append([freeze_start, float(match.group(2))])
+            freeze_start = None
+        elif match.group(3):
+            intervals.append([float(match.group(3)), float(match.group(4))])
+    # A freeze lasting until the end is never closed
+    if freeze_start is not None:
+        intervals.append([freeze_start, duration])
+    return {'duration': duration, 'intervals': merge_intervals(intervals)}
+
+
+def merge_intervals(intervals: List[List[float]]) -> List[List[float]]:
+    merged: List[List[float]] = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def keyframe_times(source: str) -> List[float]:
+    """
+    Return the timestamps of the keyframes of `source`, only the keyframes are decoded.
+    """
+    log = run_ffmpeg(
+        ['-skip_frame', 'nokey'] + input_options(source) + ['-map', '0:v:0', '-vf', 'showinfo', '-f', 'null', '-']
+    )
+    return [float(time) for time in re.findall(r'pts_time:([\d.]+)', log)]
+
+
+def segment_boundaries(keyframes: List[float], duration: float, segment_seconds: float) -> List[Tuple[float, float]]:
+    """
+    Split `duration` seconds in `(start, length)` segments of about `segment_seconds`, starting on keyframes.
+
+    A keyframe too close to the end does not start a segment, the last one would be too short to pay off.
+    """
+    starts = [0.0]
+    for keyframe in keyframes:
+        if keyframe - starts[-1] >= segment_seconds and duration - keyframe >= segment_seconds / 2:
+            starts.append(keyframe)
+    return [(start, end - start) for start, end in zip(starts, starts[1:] + [duration])]
+
+
+def plan_segments(left_source: str, right_source: str, segment_seconds: float) -> dict:
+    """
+    Return the inputs and the segments of a side by side encode split in parallel jobs.
+
+    Segments start on keyframes of `left_source`, the deskshare, where seeking does not decode
+    anything to throw away, and are rounded to whole frames so they join without gap or overlap.
+    """
+    left = probe_media(left_source)
+    right = probe_media(right_source)
+    fps = _frame_rate(left, right)
+    duration = max(left['duration'] or 0, right['duration'] or 0)
+    if not fps or not duration:
+        raise FFmpegError(f'Frame rate or duration unknown, cannot split {left_source} and {right_source}')
+
+    segments = []
+    for start, length in segment_boundaries(keyframe_times(left_source), duration, segment_seconds):
+        first_frame = round(start * fps)
+        segments.append((first_frame / fps, round((start + length) * fps) - first_frame))
+    return {'left': left, 'right': right, 'fps': fps, 'segments': segments}
+
+
+def combine_segment(
+        left_source: str, right_source: str, plan: dict, index: int, output_path: str, profile: Optional[dict] = None
+) -> None:
+    """
+    Encode the video of segment `index` of `plan` side by side, without audio.
+    """
+    start, frames = plan['segments'][index]
+    args = []
+    seeks = []
+    for source, media in [(left_source, plan['left']), (right_source, plan['right'])]:
+        # A video ending before the segment shows its last frame, like in a single encode
+        seeks.append(min(start, max((media['duration'] or start) - 1, 0)))
+        args += ['-ss', f'{seeks[-1]:.6f}'] + input_options(source)
+
+    # The frame timestamps of the segment start at zero
+    left_idle = {**plan['left_idle'], 'offset': seeks[0]} if plan.get('left_idle') else None
+    hold = frames / plan['fps'] + 1
+    args += ['-filter_complex', side_by_side_filter(plan['left'], plan['right'], plan['fps'], hold, left_idle)]
+    args += ['-map', '[v]', '-an', '-frames:v', str(frames)] + video_encoder_options(profile) + [output_path]
+    run_ffmpeg(args)
+
+
+def combine_audio(left_source: str, right_source: str, plan: dict, output_path: str) -> bool:
+    """
+    Encode the audio of a side by side output in one piece, return False when there is none.
+    """
+    audio_filter, audio_map = _audio_graph(plan['left'], plan['right'])
+    if not audio_map:
+        return False
+
+    args = input_options(left_source) + input_options(right_source)
+    args += (['-filter_complex', ';'.join(audio_filter)] if audio_filter else []) + audio_map
+    run_ffmpeg(args + ['-vn', '-c:a', 'aac', output_path])
+    return True
+
+
+def concat_segments(segment_paths: List[str], audio_path: Optional[str], output_path: str) -> None:
+    """
+    Join the video segments and the audio in `output_path` without re-encoding.
+    """
+    list_path = f'{output_path}.segments.txt'
+    with open(list_path, 'w') as f:
+        f.writelines(f"file '{path}'\n" for path in segment_paths)
+
+    args = ['-f', 'concat', '-safe', '0', '-i', list_path] + (['-i', audio_path] if audio_path else [])
+    args += ['-map', '0:v'] + (['-map', '1:a'] if audio_path else []) + ['-c', 'copy']
+    try:
+        run_ffmpeg(args + output_options(output_path))
+    finally:
+        os.remove(list_path)
+
+
+def output_options(output_path: str) -> List[str]:
+    """
+    Return the muxer options for `output_path`, moving the index to the front of mp4 files.
+    """
+    if output_path.rsplit('.', 1)[-1].lower() in FASTSTART_FORMATS:
+        return ['-movflags', '+faststart', output_path]
+    return [output_path]
+
+
+def remux(source: str, output_path: str) -> None:
+    """
+    Rewrite `source` in the container of `output_path` without decoding a single frame.
+
+    Missing timestamps are generated and negative ones shifted to zero, so players start at the beginning.
+    """
+    args = ['-fflags', '+genpts'] + input_options(source)
+    args += ['-map', '0', '-c', 'copy', '-avoid_negative_ts', 'make_zero']
+    run_ffmpeg(args + output_options(output_path))
+
+
+def transcode(source: str, output_path: str, profile: Optional[dict] = None) -> None:
+    """
+    Re-encode `source` to H.264/AAC, for the codecs the container of `output_path` does not accept.
+    """
+    args = input_options(source) + video_encoder_options(profile) + ['-c:a', 'aac']
+    run_ffmpeg(args + output_options(output_path))
+
+
+def package_hls(source: str, output_dir: str, segment_seconds: int, playlist: str) -> None:
+    """
+    Cut `source` in fMP4 segments and an HLS playlist in `output_dir`, copying the streams as they are.
+
+    Segments are cut on the keyframes following every `segment_seconds`.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    args = input_options(source) + ['-map', '0:v:0', '-map', '0:a?', '-c', 'copy']
+    args += [
+        '-f', 'hls', '-hls_segment_type', 'fmp4', '-hls_time', str(segment_seconds), '-hls_playlist_type', 'vod',
+        '-hls_flags', 'independent_segments', '-hls_fmp4_init_filename', 'init.mp4',
+        '-hls_segment_filename', os.path.join(output_dir, 'segment_%05d.m4s'), os.path.join(output_dir, playlist)
+    ]
+    run_ffmpeg(args)
+
+
+def extract_audio(source: str, output_base: str) -> str:
+    """
+    Copy the audio track of `source` into `{output_base}.{extension}`, the container matching its codec.
+
+    Codecs without a matching container are encoded to AAC. Return the path of the audio file.
+    """
+    codec = probe_media(source)['audio_codec']
+    if not codec:
+        raise FFmpegError(f'No audio track in {source}')
+
+    output_path = f'{output_base}.{AUDIO_CONTAINERS.get(codec, "m4a")}'
+    audio_options = ['-c:a', 'copy'] if codec in AUDIO_CONTAINERS else ['-c:a', 'aac']
+    run_ffmpeg(input_options(source) + ['-map', '0:a:0', '-vn'] + audio_options + output_options(output_path))
+    return output_path
+
+
+def combine_videos(
+        left_source: str, right_source: str, output_path: str, profile: Optional[dict] = None,
+        left_idle: Optional[dict] = None
+) -> None:
+    """
+    Encode `left_source` and `right_source` side by side with a single native ffmpeg filter graph.
+    """
+    run_ffmpeg(combine_command(left_source, right_source, output_path, profile, left_idle))
@@ -1,14 +1,20 @@
-from datetime import timedelta, datetime
+import asyncio
+from datetime import datetime
 from distutils.dir_util import copy_tree
+import hashlib
 from http.client import responses
 import json
 import logging
 from moviepy.editor import VideoFileClip, clips_array
 import os
 import re
-from shutil import copytree, move
+from requests import exceptions
+import shutil
+from shutil import copytree
+import threading
 import time
-from urllib import error, parse, request
+from typing import List, Optional, Tuple
+from urllib import parse
 import xml.etree.ElementTree as ElementTree
 import zipfile
 
@@ -17,9 +23,17 @@ from starlette.status import (
     HTTP_409_CONFLICT
 )
 
+from app.api.resources.player.html_components import hls_player_page
 from app.exceptions import ApiException, raise_exception
-from app.error_codes import FOLDER_CREATION_FAILED, FILE_NOT_FOUND
+from app.error_codes import FOLDER_CREATION_FAILED, FILE_NOT_FOUND, MEETING_NOT_FOUND
 from app.config import current
+from app.utils import cache_util, ffmpeg_util, mp4_util, output_cache_util, zip_util
+from app.utils.download_util import fetch_file, is_modified, probe
+from app.utils.metrics_util import TransferStats, download_metrics, record_transfer
+from app.utils.presentation_util import PLAYBACK_FILES, build_manifest, fetch_asset
+from app.utils.progress_util import report_progress
+from app.utils.scheduler_util import run_download
+from app.utils.transcode_util import choose_encoding_profile, encode_job, run_transcode
 
 logger = logging.getLogger(__name__)
 
@@ -27,78 +41,219 @@ logger = logging.getLogger(__name__)
 # TODO: *** IMPORTANT ***
 # TODO: Refactor this util...
 
-# Check if pySmartDL library is available, otherwise use urllib
-try:
-    bar = None
-    from pySmartDL import SmartDL
-    smart_dl_enabled = True
-except ImportError:
-    SmartDL = None
-    logger.warning("pySmartDL not imported, using urllib instead")
-    smart_dl_enabled = False
-
-    # Try to import progressist for displaying a progress bar
-    try:
-        from progressist import ProgressBar
+# Files fetched from the BBB presentation server for every meeting
+RECORDING_FILES = ["metadata.xml", "video/webcams.mp4", "deskshare/deskshare.mp4"]
+VIDEO_FILES = ["video/webcams.mp4", "deskshare/deskshare.mp4"]
 
-        # Configure a progress bar with a specific template
-        bar = ProgressBar(
-            throttle=timedelta(seconds=1),
-            template="Download |{animation}|{tta}| {done:B}/{total:B} at {speed:B}/s"
-        )
-    except Exception:
-        # If progressist is not available, log a warning
-        logger.warning(
-            'progressist not imported. Progress bar will not be shown. Try running: pip3 install progressist'
-        )
+# Compression of the archive modes, H.264/AAC do not shrink any further so storing is enough
+ARCHIVE_COMPRESSION = {"stored": zipfile.ZIP_STORED, "deflated": zipfile.ZIP_DEFLATED}
 
+# Serializes writes of the metadata file, which download threads also checkpoint into
+_metadata_lock = threading.RLock()
 
-# TODO: Missing unit tests...
-async def combine(file_id_or_name, combine_boolean):
+
+def meeting_folder_path(file_id_or_name: str) -> str:
+    return os.path.join(current.BASE_DIR, current.BBB.DOWNLOADED_MEETINGS_FOLDER, file_id_or_name)
+
+
+def _downloaded_folder_path(file_id_or_name: str) -> str:
+    folder_path = meeting_folder_path(file_id_or_name)
     try:
         # Attempt to list items in the directory for the specified meeting
-        os.listdir(os.path.join(current.BASE_DIR, current.BBB.DOWNLOADED_MEETINGS_FOLDER, file_id_or_name))
-
-        # Change the current working directory to the meeting folder
-        os.chdir(os.path.join(current.BASE_DIR, current.BBB.DOWNLOADED_MEETINGS_FOLDER, file_id_or_name))
+        os.listdir(folder_path)
     except Exception as ex:
         # Handle the case where the meeting with the specified ID or name is not downloaded
         msg = f'{responses[HTTP_404_NOT_FOUND]}. ' \
               f'Meeting with ID {file_id_or_name} is not downloaded. Download it first using the --download command'
         logger.error(msg)
         raise_exception(ApiException(), HTTP_404_NOT_FOUND, msg, FILE_NOT_FOUND, ex)
+    return folder_path
+
 
+def output_base_name(file_id_or_name: str) -> str:
+    """
+    Return the name, without extension, of the outputs built in the meeting folder.
+    """
     # Check if the fileIdOrName looks like a BBB meeting ID
     matches_name = re.match(r"([0-9a-f]{40}-\d{13})", file_id_or_name, re.IGNORECASE)
     if matches_name:
         # if file id/name looks like bbb 54 char string use a simple predefined name
-        meeting_id = matches_name.group(0)
-        logger.info(f"Extracted meeting id: {meeting_id} from provided name")
-        logger.info(f"Setting output file name to {current.BBB.DEFAULT_COMBINED_VIDEO_NAME}")
-        file_name = current.BBB.DEFAULT_COMBINED_VIDEO_NAME
-    else:
-        # Otherwise, use the provided fileIdOrName as the file name
-        file_name = file_id_or_name
+        logger.debug(f"Extracted meeting id: {matches_name.group(0)} from provided name")
+        return current.BBB.DEFAULT_COMBINED_VIDEO_NAME
+    # Otherwise, use the provided fileIdOrName as the file name
+    return file_id_or_name
+
+
+def output_video_name(file_id_or_name: str) -> str:
+    return f'{output_base_name(file_id_or_name)}.{current.BBB.COMBINED_VIDEO_FORMAT}'
+
+
+def recording_outputs(file_id_or_name: str) -> List[str]:
+    """
+    Return the paths of the files combine builds for the meeting, the video and its archive.
+    """
+    folder_path = meeting_folder_path(file_id_or_name)
+    outputs = [os.path.join(folder_path, output_video_name(file_id_or_name))]
+    if current.BBB.ARCHIVE_MODE in ARCHIVE_COMPRESSION:
+        outputs.append(os.path.join(folder_path, f'{file_id_or_name}.zip'))
+    return outputs
+
 
+def archive_entries(file_id_or_name: str) -> List[zip_util.ZipEntry]:
+    """
+    Return the files of the meeting archive streamed on demand, meant to run in a worker thread.
+
+    Their CRCs are cached in the meeting metadata and only computed again when a file changed.
+    """
+    folder_path = _downloaded_folder_path(file_id_or_name)
+    video_path = os.path.join(folder_path, output_video_name(file_id_or_name))
+    if not os.path.isfile(video_path):
+        msg = f'{responses[HTTP_404_NOT_FOUND]}. Recording of {file_id_or_name} not found, it is not combined yet.'
+        logger.error(msg)
+        raise_exception(ApiException(), HTTP_404_NOT_FOUND, msg, FILE_NOT_FOUND)
+
+    cached = load_bbb_metadata(folder_path).get("archiveEntries", {})
+    entries = []
+    for path in [video_path]:
+        name = os.path.basename(path)
+        stat = os.stat(path)
+        known = cached.get(name, {})
+        unchanged = known.get("size") == stat.st_size and known.get("mtime") == stat.st_mtime
+        entries.append(zip_util.entry_from_file(path, name, known["crc"] if unchanged else None))
+
+    if any(cached.get(entry.name) != entry.model_dump(include={"size", "mtime", "crc"}) for entry in entries):
+        with _metadata_lock:
+            bbb_info = load_bbb_metadata(folder_path)
+            bbb_info["archiveEntries"] = {
+                entry.name: entry.model_dump(include={"size", "mtime", "crc"}) for entry in entries
+            }
+            write_bbb_metadata(folder_path, bbb_info)
+    return entries
+
+
+def has_deskshare(folder_path: str) -> bool:
+    """
+    Tell whether the meeting has a deskshare, downloaded or streamed.
+    """
+    return "deskshare/deskshare.mp4" in load_bbb_metadata(folder_path).get("streamSources", {}) or \
+        os.path.isfile(os.path.join(folder_path, "deskshare/deskshare.mp4"))
+
+
+async def extract_audio(file_id_or_name: str, webcams_source: Optional[str] = None) -> str:
+    """
+    Copy the audio of the webcams into a file of its own in the meeting folder, return its name.
+
+    `webcams_source` defaults to the downloaded webcams, or their url when they were streamed.
+    """
+    folder_path = _downloaded_folder_path(file_id_or_name)
+    report_progress('extracting_audio')
+    if webcams_source is None:
+        stream_sources = load_bbb_metadata(folder_path).get("streamSources", {})
+        webcams_source = _input_source(folder_path, "video/webcams.mp4", stream_sources)
+
+    audio_path = None
+    if webcams_source:
+        try:
+            audio_path = await run_transcode(
+                ffmpeg_util.extract_audio, webcams_source, os.path.join(folder_path, output_base_name(file_id_or_name))
+            )
+        except ffmpeg_util.FFmpegError as ex:
+            logger.warning(f"Could not extract the audio of {webcams_source}: {ex}")
+
+    if not audio_path:
+        msg = f'{responses[HTTP_404_NOT_FOUND]}. Audio not found, this meeting might not be supported.'
+        logger.error(msg)
+        raise_exception(ApiException(), HTTP_404_NOT_FOUND, msg, FILE_NOT_FOUND)
+    return os.path.basename(audio_path)  # type: ignore[arg-type]
+
+
+async def combine(file_id_or_name, combine_boolean):
+    folder_path = _downloaded_folder_path(file_id_or_name)
+
+    # Every output is written in the configured container
+    output_file_name = output_video_name(file_id_or_name)
+    output_path = os.path.join(folder_path, output_file_name)
+    zip_path = os.path.join(folder_path, file_id_or_name + ".zip")
+
+    report_progress('combining')
+
+    # The same inputs built with an accepted encoding before, under any meeting name, are not encoded again
+    fingerprint = output_cache_util.input_fingerprint(folder_path, load_bbb_metadata(folder_path), VIDEO_FILES)
+    cached = await asyncio.to_thread(
+        output_cache_util.lookup, output_cache_util.accepted_keys(fingerprint, combine_boolean)
+    )
+    if cached:
+        logger.info(f"Reusing {cached['path']} as {output_path}")
+        if cached['path'] != output_path:
+            output_cache_util.link_file(cached['path'], output_path)
+            cached_index_path = keyframe_index_path(cached['path'])
+            if os.path.isfile(cached_index_path):
+                shutil.copyfile(cached_index_path, keyframe_index_path(output_path))
+        await _save_encoding(folder_path, cached['encoding'])
+        output_key = cached['key']
+    else:
+        if os.path.isfile(output_path):
+            # Left by a previous run, or built from videos changed since then. It may also be the output
+            # of another meeting folder, a new file is written instead of overwriting the shared one
+            logger.warning(f'{output_path} already found, building it again.')
+            os.remove(output_path)
+        await _build_output(folder_path, output_path, combine_boolean)
+
+        # Playable while it downloads, and seekable with a single range request
+        await run_transcode(finalize_output, output_path)
+
+        encoding = load_bbb_metadata(folder_path).get("encodingProfile", {})
+        output_key = output_cache_util.output_key(fingerprint, combine_boolean, encoding)
+        await asyncio.to_thread(output_cache_util.register, output_key, output_path, encoding)
+
+    bbb_info = load_bbb_metadata(folder_path)
+    bbb_info["outputKey"] = output_key
+    await save_bbb_metadata(folder_path, bbb_info)
+    report_progress('packaging')
+
+    # Package the output for playback in the browser while it downloads
+    if current.BBB.HLS_ENABLED:
+        await package_hls(folder_path, output_path)
+
+    # Create a zip file containing the output video file, unless the video is linked directly
+    if current.BBB.ARCHIVE_MODE in ARCHIVE_COMPRESSION:
+        await run_transcode(zip_file, zip_path, output_path, ARCHIVE_COMPRESSION[current.BBB.ARCHIVE_MODE])
+    elif current.BBB.ARCHIVE_MODE == 'stream':
+        # The zip is streamed from the video, only its CRC is computed ahead of the first download
+        if os.path.isfile(zip_path):
+            os.remove(zip_path)
+        await asyncio.to_thread(archive_entries, file_id_or_name)
+
+
+async def _build_output(folder_path: str, output_path: str, combine_boolean: bool) -> None:
+    """
+    Encode the output of the meeting, or copy the webcams into it when there is nothing to combine.
+    """
     # Check if combining video files is enabled
     if combine_boolean:
-        # Check if the combined video file already exists
-        combine_video_name = current.BBB.DEFAULT_COMBINED_VIDEO_NAME
-        combine_video_format = current.BBB.COMBINED_VIDEO_FORMAT
-
-        if os.path.isfile(f'./{file_name}.{combine_video_format}'):
-            logger.warning(f'./{combine_video_name}.{combine_video_name} already found. Aborting.')
-            exit(1)
-        elif os.path.isfile('./deskshare/deskshare.mp4') and os.path.isfile('./video/webcams.mp4'):
-            # If both video files exist, combine them using the moviepyCombine function
+        # Inputs are read from disk, or straight from the BBB server when they were not downloaded
+        stream_sources = load_bbb_metadata(folder_path).get("streamSources", {})
+        deskshare_source = _input_source(folder_path, "deskshare/deskshare.mp4", stream_sources)
+        webcams_source = _input_source(folder_path, "video/webcams.mp4", stream_sources)
+
+        # Find where the deskshare is frozen or black, an unused deskshare is left out altogether
+        deskshare_idle = await _detect_deskshare_idle(folder_path, deskshare_source) if deskshare_source else None
+        if deskshare_idle and deskshare_idle['ratio'] >= current.BBB.IDLE_WEBCAMS_ONLY_RATIO:
+            logger.info(f"The deskshare is idle {deskshare_idle['ratio']:.0%} of the time, using the webcams only")
+            deskshare_source = None
+
+        if deskshare_source and webcams_source:
+            # If both video files exist, put them side by side in a worker process, faster when the pool is busy
             logger.info("The files exits")
-            file_name = file_name + ".mp4"
-            await moviepy_combine('./deskshare/deskshare.mp4', './video/webcams.mp4', file_name)
+            output_file_name = os.path.basename(output_path)
+            profile_name, profile = _resumed_encoding(folder_path, output_file_name) or choose_encoding_profile()
+            logger.info(f"Encoding {output_path} with the {profile_name} profile {profile}")
+            await _save_encoding(folder_path, {'name': profile_name, **profile})
+            with encode_job():
+                await encode_side_by_side(deskshare_source, webcams_source, output_path, profile, deskshare_idle)
 
-            # Create a zip file containing the combined video file
-            zip_file_name = file_id_or_name + ".zip"
-            with zipfile.ZipFile(zip_file_name, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                zipf.write(file_name)
+        elif webcams_source and deskshare_idle:
+            await _remux_webcams(folder_path, webcams_source, output_path)
 
         else:
             # Handle the case where video files are not found
@@ -107,14 +262,124 @@ async def combine(file_id_or_name, combine_boolean):
             raise_exception(ApiException(), HTTP_404_NOT_FOUND, msg, FILE_NOT_FOUND)
 
     else:
-        # If combining is not enabled, move the webcams.mp4 file to the specified file name
-        file_name = file_name + ".mp4"
-        zip_file_name = file_id_or_name + ".zip"
-        move('./video/webcams.mp4', file_name)
+        # If combining is not enabled, the webcams are the output
+        await _remux_webcams(folder_path, os.path.join(folder_path, "video/webcams.mp4"), output_path)
+
+
+def output_is_current(file_id_or_name: str, combine_boolean: bool) -> bool:
+    """
+    Tell whether the output of the meeting was built from its current inputs with an accepted encoding.
+
+    Outputs built before their key was recorded are kept as they are.
+    """
+    folder_path = meeting_folder_path(file_id_or_name)
+    bbb_info = load_bbb_metadata(folder_path)
+    if "outputKey" not in bbb_info:
+        return True
+    fingerprint = output_cache_util.input_fingerprint(folder_path, bbb_info, VIDEO_FILES)
+    return bbb_info["outputKey"] in output_cache_util.accepted_keys(fingerprint, combine_boolean)
+
+
+def playback_page_path(file_id_or_name: str) -> str:
+    return os.path.join(meeting_folder_path(file_id_or_name), current.BBB.HLS_FOLDER, 'index.html')
+
+
+async def package_hls(folder_path: str, output_path: str) -> None:
+    """
+    Cut the output in HLS fMP4 segments, without encoding it again, next to a page playing them.
+    """
+    hls_path = os.path.join(folder_path, current.BBB.HLS_FOLDER)
+    shutil.rmtree(hls_path, ignore_errors=True)
+    try:
+        await run_transcode(
+            ffmpeg_util.package_hls, output_path, hls_path, current.BBB.HLS_SEGMENT_SECONDS, 'playlist.m3u8'
+        )
+    except ffmpeg_util.FFmpegError as ex:
+        # The zip is still there, only the playback link is missing from the email
+        logger.warning(f"Could not package {output_path} as HLS: {ex}")
+        shutil.rmtree(hls_path, ignore_errors=True)
+        return
+
+    with open(os.path.join(hls_path, 'index.html'), 'w') as f:
+        f.write(hls_player_page(
+            os.path.basename(folder_path), 'playlist.m3u8', current.BBB.HLS_PLAYER_SCRIPT_URL
+        ))
+
+
+async def _remux_webcams(folder_path: str, webcams_source: str, output_path: str) -> None:
+    """
+    Make the webcams the output, only their container is rewritten.
+    """
+    profile_name, profile = choose_encoding_profile()
+    with encode_job():
+        remuxed = await run_transcode(remux_video, webcams_source, output_path, profile)
+    await _save_encoding(folder_path, {'name': 'copy'} if remuxed else {'name': profile_name, **profile})
+
+
+async def _detect_deskshare_idle(folder_path: str, deskshare_source: str) -> Optional[dict]:
+    """
+    Return the intervals where the deskshare is frozen or black and the share of its duration they cover.
+
+    The analysis is recorded in the meeting metadata. Return None when it is disabled or failed.
+    """
+    if not current.BBB.IDLE_DETECTION or current.BBB.COMBINE_ENGINE != 'ffmpeg':
+        return None
+    if ffmpeg_util.is_url(deskshare_source):
+        # The analysis would read the whole deskshare from the server once more before the encode does
+        logger.info(f"Not analysing {deskshare_source}, it is streamed from the server")
+        return None
+
+    try:
+        timeline = await run_transcode(ffmpeg_util.detect_idle, deskshare_source, current.BBB.IDLE_MIN_SECONDS)
+    except ffmpeg_util.FFmpegError as ex:
+        logger.warning(f"Could not analyse {deskshare_source}, encoding all of it: {ex}")
+        return None
+
+    idle_seconds = sum(end - start for start, end in timeline['intervals'])
+    deskshare_idle = {
+        **timeline,
+        'ratio': idle_seconds / timeline['duration'] if timeline['duration'] else 0,
+        'frame_seconds': current.BBB.IDLE_FRAME_SECONDS,
+    }
+    bbb_info = load_bbb_metadata(folder_path)
+    bbb_info["deskshareIdle"] = deskshare_idle
+    await save_bbb_metadata(folder_path, bbb_info)
+    return deskshare_idle
+
+
+def _resumed_encoding(folder_path: str, output_file_name: str) -> Optional[Tuple[str, dict]]:
+    """
+    Return the encoding profile of an interrupted encode of the output, it resumes with the same one.
+    """
+    bbb_info = load_bbb_metadata(folder_path)
+    encoding = dict(bbb_info.get("encodingProfile") or {})
+    if (bbb_info.get("combineProgress") or {}).get("output") != output_file_name or len(encoding) < 2:
+        return None
+    return encoding.pop("name"), encoding
+
+
+async def _save_encoding(folder_path: str, encoding_profile: dict) -> None:
+    """
+    Record the encoding profile of the output in the meeting metadata.
+    """
+    bbb_info = load_bbb_metadata(folder_path)
+    bbb_info["encodingProfile"] = encoding_profile
+    await save_bbb_metadata(folder_path, bbb_info)
+
+
+def zip_file(zip_path: str, file_path: str, compression: int = zipfile.ZIP_STORED) -> None:
+    # ZIP64 for the recordings over 4 GiB
+    with zipfile.ZipFile(zip_path, 'w', compression, allowZip64=True) as zipf:
+        zipf.write(file_path, arcname=os.path.basename(file_path))
 
-        # Create a zip file containing the moved video file
-        with zipfile.ZipFile(zip_file_name, 'w', zipfile.ZIP_DEFLATED) as zf:
-            zf.write(file_name)
+
+def _input_source(folder_path: str, file: str, stream_sources: dict) -> Optional[str]:
+    """
+    Return the local path of a downloaded video, else its url when it is streamed, else None.
+    """
+    if os.path.isfile(os.path.join(folder_path, file)):
+        return os.path.join(folder_path, file)
+    return stream_sources.get(file)
 
 
 # TODO: Missing unit tests...
@@ -157,115 +422,311 @@ def get_metadata_components(elem, path_to_metadata_file):
         return elem.text
 
 
+def write_bbb_metadata(folder_path: str, bbb_info: dict) -> None:
+    with _metadata_lock:
+        with open(os.path.join(folder_path, current.BBB.METADATA_FILENAME), 'w') as bjf:
+            json.dump(bbb_info, bjf)
+
+
+def load_bbb_metadata(folder_path: str) -> dict:
+    """
+    Return the metadata saved by a previous run in `folder_path`, or an empty dict.
+    """
+    try:
+        with open(os.path.join(folder_path, current.BBB.METADATA_FILENAME), 'r') as bjf:
+            return json.load(bjf)
+    except (OSError, ValueError):
+        return {}
+
+
 # TODO: Missing unit tests...
 async def save_bbb_metadata(folder_path: str, bbb_info: dict):
-    with open(os.path.join(folder_path, current.BBB.METADATA_FILENAME), 'w') as bjf:
-        json.dump(bbb_info, bjf)
+    write_bbb_metadata(folder_path, bbb_info)
 
 
 # TODO: Missing unit tests...
-async def download_files(base_url: str, base_path: str, bbb_info: dict):
+async def download_files(base_url: str, base_path: str, bbb_info: dict, files: Optional[List[str]] = None):
     # List of files to download
-    files_for_dl = ["metadata.xml", "video/webcams.mp4", "deskshare/deskshare.mp4"]
+    files_for_dl = files or RECORDING_FILES
 
     # Flag to determine whether to combine video files
     combine_boolean = True
 
-    # Initialize the downloadedFiles dictionary in bbb_info
-    bbb_info["downloadedFiles"] = {}
+    # Initialize the downloadedFiles dictionary in bbb_info, keeping the state of an interrupted run
+    downloaded_files = bbb_info.setdefault("downloadedFiles", {})
+    download_segments = bbb_info.setdefault("downloadSegments", {})
+    for file in files_for_dl:
+        downloaded_files.setdefault(file, False)
+    await save_bbb_metadata(base_path, bbb_info)
+
+    # The download threads checkpoint bbb_info while the files go on, every change to it from here on
+    # holds the metadata lock, json.dump fails on a dict that changes size while it is encoded
+
+    # In concurrent mode the files are fetched in parallel, otherwise one after another
+    concurrency = max(current.BBB.DOWNLOAD_CONCURRENCY, 1) if current.BBB.CONCURRENT_DOWNLOADS else 1
+    semaphore = asyncio.Semaphore(concurrency)
+
+    def checkpoint() -> None:
+        write_bbb_metadata(base_path, bbb_info)
+
+    def streamed(file: str) -> bool:
+        # webcams.mp4 alone is moved as the output, so it is only streamed into a combine
+        return current.BBB.STREAM_COMBINE and file in VIDEO_FILES and combine_boolean
+
+    async def download_file(i: int, file: str) -> None:
+        nonlocal combine_boolean
+
+        async with semaphore:
+            # Specify the save path for the downloaded file
+            save_path = os.path.join(base_path, file)
+            logger.debug(save_path)
+
+            # Skip files completed by a previous run
+            if downloaded_files[file] and os.path.isfile(save_path):
+                logger.info(f'[{i + 1}/{len(files_for_dl)}] {file} already downloaded')
+                return
+
+            logger.info(f'[{i + 1}/{len(files_for_dl)}] {"Checking" if streamed(file) else "Downloading"} {file}')
+
+            # Construct the download URL for the current file
+            download_url = base_url + file
+            logger.debug(download_url)
+
+            with _metadata_lock:
+                downloaded_files[file] = False
+            stats = TransferStats()
+            status = 'failed'
+            try:
+                # In streaming mode the videos are read from the server by the encoder, only check they exist
+                if streamed(file):
+                    state = await run_download(probe, download_url)
+                    # A local copy is read before the stream, one left by an earlier download is stale now
+                    for stale_path in [save_path, f'{save_path}.part']:
+                        if os.path.isfile(stale_path):
+                            os.remove(stale_path)
+                    with _metadata_lock:
+                        download_segments.pop(file, None)
+                        bbb_info.setdefault("streamSources", {})[file] = download_url
+                        bbb_info.setdefault("fileValidators", {})[file] = {
+                            'etag': state['etag'], 'last_modified': state['last_modified'], 'size': state['size']
+                        }
+                    await save_bbb_metadata(base_path, bbb_info)
+                    return
+
+                # Run the blocking download in a worker thread so the event loop stays responsive
+                with _metadata_lock:
+                    state = download_segments.setdefault(file, {})
+                job_id = bbb_info.get("meeting_id", '')
+                await run_download(
+                    fetch_file, download_url, save_path, state, checkpoint, _metadata_lock, job_id, stats
+                )
+                status = 'ok'
+
+                # Mark the file as downloaded in the downloadedFiles dictionary, with its validators for revalidation
+                with _metadata_lock:
+                    downloaded_files[file] = True
+                    bbb_info.setdefault("fileValidators", {})[file] = {
+                        'etag': state.get('etag'), 'last_modified': state.get('last_modified'),
+                        'size': state.get('size')
+                    }
+                await save_bbb_metadata(base_path, bbb_info)
+
+            except exceptions.HTTPError as e:
+                # Handle HTTP errors, log a warning for 404 errors
+                if e.response is not None and e.response.status_code == 404:
+                    if file == "deskshare/deskshare.mp4":
+                        combine_boolean = False
+                    logger.warning(f"Did not download {file} because of 404 error")
+                    status = 'not_found'
+                else:
+                    logger.exception(e)
+
+            except Exception as ex:
+                # Log exceptions and continue with the next file, the partial file is kept for a later resume
+                logger.exception(ex)
+
+            # Keep the statistics of the transfer with the meeting and in the aggregate metrics
+            stats.finish(status)
+            record_transfer(stats)
+            with _metadata_lock:
+                bbb_info.setdefault("transferStats", {})[file] = stats.as_dict()
+            await save_bbb_metadata(base_path, bbb_info)
 
-    # Iterate through each file to download
-    for i, file in enumerate(files_for_dl):
-        logger.info(f'[{i + 1}/{len(files_for_dl)}] Downloading {file}')
+    if current.BBB.STREAM_COMBINE and "deskshare/deskshare.mp4" in files_for_dl:
+        # Find out first whether there is a deskshare to combine with
+        await download_file(files_for_dl.index("deskshare/deskshare.mp4"), "deskshare/deskshare.mp4")
 
-        # Construct the download URL for the current file
-        download_url = base_url + file
-        logger.debug(download_url)
+    await asyncio.gather(*[
+        download_file(i, file) for i, file in enumerate(files_for_dl)
+        if not (current.BBB.STREAM_COMBINE and file == "deskshare/deskshare.mp4")
+    ])
 
-        # Specify the save path for the downloaded file
-        save_path = os.path.join(base_path, file)
-        logger.debug(save_path)
+    # Return updated bbb_info and combine_boolean
+    return bbb_info, combine_boolean
 
-        # Mark the file as not downloaded in the downloadedFiles dictionary
-        bbb_info["downloadedFiles"][file] = False
-        await save_bbb_metadata(base_path, bbb_info)
 
-        try:
-            # Download the file using pySmartDL if available, else use urllib
-            if smart_dl_enabled:
-                smart_dl = SmartDL(download_url, save_path, verify=False)
-                smart_dl.start()
-            else:
-                request.urlretrieve(download_url, save_path, reporthook=bar.on_urlretrieve if bar else None)
-
-            # Mark the file as downloaded in the downloadedFiles dictionary
-            bbb_info["downloadedFiles"][file] = True
-            await save_bbb_metadata(base_path, bbb_info)
+async def download_presentation_files(base_url: str, base_path: str, bbb_info: dict) -> None:
+    """
+    Fetch the slides, annotations, cursor, captions and chat used by the offline playback.
+    """
+    presentation_files = bbb_info.setdefault("presentationFiles", {})
+    semaphore = asyncio.Semaphore(max(current.BBB.PRESENTATION_CONCURRENCY, 1))
+    job_id = bbb_info.get("meeting_id", '')
+    stats = TransferStats()
 
-        except error.HTTPError as e:
-            # Handle HTTP errors, log a warning for 404 errors
-            if e.code == 404:
-                if file == "deskshare/deskshare.mp4":
-                    combine_boolean = False
-                logger.warning(f"Did not download {file} because of 404 error")
+    async def download_asset(file: str) -> None:
+        save_path = os.path.join(base_path, file)
 
-        except Exception as ex:
-            # Log exceptions and continue with the next file
-            logger.exception(ex)
+        # Skip the assets fetched by a previous run and the ones the server does not have
+        if presentation_files.get(file) is False or (presentation_files.get(file) and os.path.isfile(save_path)):
+            return
+
+        async with semaphore:
+            try:
+                presentation_files[file] = await run_download(
+                    fetch_asset, base_url + file, save_path, job_id, stats
+                )
+            except Exception as ex:
+                stats.fail()
+                logger.warning(f"Did not download {file}: {ex}")
+
+    async def download_assets(files: List[str]) -> None:
+        # Small files go in batches, the progress is saved after each one
+        batch_size = max(current.BBB.PRESENTATION_BATCH_SIZE, 1)
+        for start in range(0, len(files), batch_size):
+            await asyncio.gather(*[download_asset(file) for file in files[start:start + batch_size]])
+            await save_bbb_metadata(base_path, bbb_info)
 
-    # Return updated bbb_info and combine_boolean
-    return bbb_info, combine_boolean
+    # The playback files first, they reference the rest of the assets
+    await download_assets(PLAYBACK_FILES)
 
+    manifest = await asyncio.to_thread(build_manifest, base_path, bbb_info.get("meeting_id", ''))
+    logger.info(f"Downloading {len(manifest)} presentation assets")
+    await download_assets(manifest)
 
-# TODO: Missing unit tests...
-async def download_script(input_url: str, meeting_name_wanted: str):
-    # Initialize bbbInfo dictionary with metadata
-    bbb_info = {
-        'bbb_info_version': current.BBB.INFO_VERSION,
-        'all_done': False,
-        'input_url': input_url,
-        'meeting_name_wanted': meeting_name_wanted
-    }
+    # The assets are accounted as a whole
+    stats.finish('ok')
+    record_transfer(stats)
+    bbb_info.setdefault("transferStats", {})["presentation"] = stats.as_dict()
+    await save_bbb_metadata(base_path, bbb_info)
 
-    # Append the last 5 characters of the inputURL to meeting_name_wanted
-    meeting_name_wanted = meeting_name_wanted + "-" + input_url[-5:]
 
+def extract_meeting_id(input_url: str) -> Tuple[str, str]:
+    """
+    Return the BBB version and meeting id found in a playback url.
+    """
     # get meeting id from url https://regex101.com/r/UjqGeo/3
     matches_url = re.search(r"/?(\d+\.\d+)/.*?([0-9a-f]{40}-\d{13})/?", input_url, re.IGNORECASE)
-    meeting_id = ''
 
-    if matches_url and len(matches_url.groups()) == 2:
-        bbb_version = matches_url.group(1)
-        meeting_id = matches_url.group(2)
-        logger.info(f"Detected bbb version:\t{bbb_version}")
-        logger.info(f"Detected meeting id:\t{meeting_id}")
+    if not matches_url or len(matches_url.groups()) != 2:
+        msg = f'{responses[HTTP_404_NOT_FOUND]}. Meeting ID could not be found in the url.'
+        raise_exception(ApiException(), HTTP_404_NOT_FOUND, msg, MEETING_NOT_FOUND)
 
-        bbb_info["detected_bbb_version"] = bbb_version
-        bbb_info["meeting_id"] = meeting_id
-    else:
-        logger.error("Meeting ID could not be found in the url.")
-        # TODO:  throw 404 here, meeting_id not found...
-        exit(1)
+    return matches_url.group(1), matches_url.group(2)  # type: ignore[union-attr]
+
+
+async def revalidate_files(base_url: str, bbb_info: dict) -> List[str]:
+    """
+    Return the files changed on the BBB server since they were downloaded.
+    """
+    validators = bbb_info.get("fileValidators", {})
+
+    async def is_file_modified(file: str) -> bool:
+        try:
+            return await run_download(is_modified, base_url + file, validators.get(file, {}))
+        except Exception as ex:
+            # Serve the cached copy when the server cannot be asked
+            logger.warning(f"Could not revalidate {file}: {ex}")
+            return False
+
+    modified = await asyncio.gather(*[is_file_modified(file) for file in RECORDING_FILES])
+    return [file for file, file_modified in zip(RECORDING_FILES, modified) if file_modified]
+
+
+async def _locate_meeting(input_url: str, meeting_name_wanted: str) -> Tuple[str, str, str, str]:
+    """
+    Return the BBB version and meeting id of a playback url, the url of its files and its local folder.
+    """
+    # Append the last 5 characters of the inputURL to meeting_name_wanted
+    meeting_name_wanted = meeting_name_wanted + "-" + input_url[-5:]
+
+    bbb_version, meeting_id = extract_meeting_id(input_url)
 
     # Construct the base URL for downloading files
     base_url = f'{parse.urlparse(input_url).scheme}://{current.BBB.SERVER}/presentation/{meeting_id}/'
     logger.debug(f'Base url: {base_url}')
 
-    bbb_info["base_url"] = base_url
-
-    # Construct the folder path for the downloaded meeting files
-    meeting_name = meeting_name_wanted if meeting_name_wanted else meeting_id
+    # Construct the folder path for the downloaded meeting files, reusing the cached copy of the meeting if any
+    meeting_name = await asyncio.to_thread(cache_util.get_cached_folder, meeting_id)
+    if meeting_name:
+        logger.info(f"Meeting {meeting_id} found in cache as {meeting_name}")
+    else:
+        meeting_name = meeting_name_wanted if meeting_name_wanted else meeting_id
     folder_path = os.path.join(current.BASE_DIR, current.BBB.DOWNLOADED_MEETINGS_FOLDER, meeting_name)
 
     logger.debug("Folder path: {}".format(folder_path))
+    return bbb_version, meeting_id, base_url, folder_path
+
+
+async def locate_audio_source(input_url: str, meeting_name_wanted: str) -> Tuple[str, str]:
+    """
+    Return the meeting folder name and the webcams to extract the audio of, without downloading the recording.
+
+    A meeting downloaded before is read from its folder, any other one straight from the BBB server. Only its
+    metadata.xml is fetched then, the email tells when the meeting started.
+    """
+    _, meeting_id, base_url, folder_path = await _locate_meeting(input_url, meeting_name_wanted)
+    webcams_source = None
+    if os.path.isfile(os.path.join(folder_path, current.BBB.DOWNLOADED_FULLY_FILENAME)):
+        stream_sources = load_bbb_metadata(folder_path).get("streamSources", {})
+        webcams_source = _input_source(folder_path, "video/webcams.mp4", stream_sources)
+    else:
+        if not os.path.exists(folder_path):
+            await create_folder(folder_path)
+        metadata_path = os.path.join(folder_path, "metadata.xml")
+        if not os.path.isfile(metadata_path) and not await run_download(
+                fetch_asset, base_url + "metadata.xml", metadata_path, meeting_id, TransferStats()
+        ):
+            msg = f'{responses[HTTP_404_NOT_FOUND]}. Recording not found on the BBB server.'
+            raise_exception(ApiException(), HTTP_404_NOT_FOUND, msg, FILE_NOT_FOUND)
+    return os.path.basename(folder_path), webcams_source or base_url + "video/webcams.mp4"
+
+
+# TODO: Missing unit tests...
+async def download_script(input_url: str, meeting_name_wanted: str):
+    # Initialize bbbInfo dictionary with metadata
+    bbb_info = {
+        'bbb_info_version': current.BBB.INFO_VERSION,
+        'all_done': False,
+        'input_url': input_url,
+        'meeting_name_wanted': meeting_name_wanted
+    }
+
+    bbb_version, meeting_id, base_url, folder_path = await _locate_meeting(input_url, meeting_name_wanted)
+    logger.info(f"Detected bbb version:\t{bbb_version}")
+    logger.info(f"Detected meeting id:\t{meeting_id}")
+
+    bbb_info["detected_bbb_version"] = bbb_version
+    bbb_info["meeting_id"] = meeting_id
+    bbb_info["base_url"] = base_url
 
     # Check if the download is complete based on the existence of the DOWNLOADED_FULLY_FILENAME file
     if os.path.isfile(os.path.join(folder_path, current.BBB.DOWNLOADED_FULLY_FILENAME)):
         folder_exist = True
         combine_boolean = None
+
+        if current.BBB.REVALIDATE_CACHED:
+            folder_exist, combine_boolean = await _refresh_cached_files(base_url, folder_path)
     else:
         folder_exist = False
 
+        # Pick up the download state of an interrupted run for the same meeting
+        previous_bbb_info = load_bbb_metadata(folder_path)
+        if previous_bbb_info.get("meeting_id") == meeting_id:
+            for key in ["downloadedFiles", "downloadSegments", "presentationFiles"]:
+                if key in previous_bbb_info:
+                    bbb_info[key] = previous_bbb_info[key]
+
         # Initialize downloadCompleted flag and start download time in bbbInfo
         bbb_info["download_completed"] = False
 
@@ -278,13 +739,21 @@ async def download_script(input_url: str, meeting_name_wanted: str):
 
         bbb_info["download_start_time"] = time.time()
         await save_bbb_metadata(folder_path, bbb_info)
+        await asyncio.to_thread(cache_util.touch, meeting_id, os.path.basename(folder_path))
 
         # Download files and update bbb_info and combine_boolean
         bbb_info, combine_boolean = await download_files(base_url, folder_path, bbb_info)
 
+        # Download slides and the rest of the assets of the offline playback
+        if current.BBB.PRESENTATION_ASSETS:
+            await download_presentation_files(base_url, folder_path, bbb_info)
+
         # Update download end time and set downloadCompleted flag to True
         bbb_info["download_end_time"] = time.time()
         bbb_info["download_completed"] = True
+        download_stats = _job_stats(bbb_info)
+        bbb_info["downloadStats"] = download_stats
+        download_metrics.observe('job_duration_seconds', download_stats["duration_seconds"])
         await save_bbb_metadata(folder_path, bbb_info)
 
         # Copy contents of the "player3" folder to the downloaded meeting folder
@@ -302,14 +771,239 @@ async def download_script(input_url: str, meeting_name_wanted: str):
     return combine_boolean, os.path.basename(folder_path), folder_exist
 
 
+def _job_stats(bbb_info: dict) -> dict:
+    """
+    Aggregate the transfer statistics of a meeting download.
+    """
+    transfer_stats = bbb_info.get("transferStats", {})
+    duration = bbb_info["download_end_time"] - bbb_info["download_start_time"]
+    total_bytes = sum(stats['bytes'] for stats in transfer_stats.values())
+    return {
+        'bytes': total_bytes,
+        'duration_seconds': round(duration, 3),
+        'average_bytes_per_second': round(total_bytes / duration) if duration > 0 else 0,
+        'peak_bytes_per_second': max([stats['peak_bytes_per_second'] for stats in transfer_stats.values()], default=0),
+        'retries': sum(stats['retries'] for stats in transfer_stats.values()),
+        'failed_files': [file for file, stats in transfer_stats.items() if stats['status'] == 'failed'],
+    }
+
+
+async def _refresh_cached_files(base_url: str, folder_path: str) -> Tuple[bool, Optional[bool]]:
+    """
+    Re-fetch the cached files changed on the server, return the folder_exist and combine_boolean flags.
+    """
+    bbb_info = load_bbb_metadata(folder_path)
+    modified_files = await revalidate_files(base_url, bbb_info)
+    if not modified_files:
+        return True, None
+
+    logger.info(f"Files changed on the server since download: {modified_files}")
+    for file in modified_files:
+        bbb_info.setdefault("downloadedFiles", {})[file] = False
+        bbb_info.setdefault("downloadSegments", {})[file] = {}
+
+    bbb_info, _ = await download_files(base_url, folder_path, bbb_info, modified_files)
+    bbb_info["revalidated_time"] = time.time()
+    await save_bbb_metadata(folder_path, bbb_info)
+
+    # The outputs only have to be built again when a video changed
+    if not set(modified_files) & set(VIDEO_FILES):
+        return True, None
+    return False, has_deskshare(folder_path)
+
+
+async def encode_side_by_side(
+        deskshare_source: str, webcams_source: str, output_path: str, profile: dict,
+        deskshare_idle: Optional[dict] = None
+) -> None:
+    """
+    Encode the deskshare and the webcams side by side in the transcoding pool, long recordings in parallel segments.
+
+    Sources streamed from the server are encoded in one piece, in a single read.
+    While the deskshare is idle, only one of its frames every few seconds is processed.
+    """
+    # Planning the segments and encoding the audio apart read streamed sources from the server several
+    # times, and no part of the encode could start while they are still downloading
+    streamed = ffmpeg_util.is_url(deskshare_source) or ffmpeg_util.is_url(webcams_source)
+    if current.BBB.SEGMENTED_ENCODING and current.BBB.COMBINE_ENGINE == 'ffmpeg' and not streamed:
+        try:
+            await segmented_combine(deskshare_source, webcams_source, output_path, profile, deskshare_idle)
+            return
+        except ffmpeg_util.FFmpegError as ex:
+            logger.warning(f"Segmented encode failed, encoding {output_path} in one piece: {ex}")
+
+    await run_transcode(combine_videos, deskshare_source, webcams_source, output_path, profile, deskshare_idle)
+
+
+async def segmented_combine(
+        deskshare_source: str, webcams_source: str, output_path: str, profile: dict,
+        deskshare_idle: Optional[dict] = None
+) -> None:
+    """
+    Split the timeline at keyframes, encode the segments in parallel worker processes and join them losslessly.
+
+    The audio is encoded once for the whole recording, AAC segments would click at every joint.
+    """
+    plan = await run_transcode(
+        ffmpeg_util.plan_segments, deskshare_source, webcams_source, current.BBB.ENCODE_SEGMENT_SECONDS
+    )
+    if len(plan['segments']) < 2:
+        await run_transcode(combine_videos, deskshare_source, webcams_source, output_path, profile, deskshare_idle)
+        return
+    plan['left_idle'] = deskshare_idle
+
+    # The segments already encoded by an interrupted run of the same encode are kept
+    folder_path = os.path.dirname(output_path)
+    segments_path = f'{output_path}.segments'
+    key = hashlib.sha1(json.dumps([plan, profile], sort_keys=True).encode()).hexdigest()
+    progress = load_bbb_metadata(folder_path).get("combineProgress") or {}
+    if progress.get("key") == key and os.path.isdir(segments_path):
+        logger.info(f"Resuming {output_path} after {len(progress['segments'])} of {len(plan['segments'])} segments")
+    else:
+        logger.info(f"Encoding {output_path} in {len(plan['segments'])} segments")
+        shutil.rmtree(segments_path, ignore_errors=True)
+        progress = {
+            "output": os.path.basename(output_path), "key": key, "total": len(plan['segments']), "segments": [],
+            "audio": None,
+        }
+        _save_combine_progress(folder_path, progress)
+    os.makedirs(segments_path, exist_ok=True)
+    semaphore = asyncio.Semaphore(max(current.BBB.ENCODE_SEGMENT_PARALLELISM, 1))
+
+    async def encode_segment(index: int) -> str:
+        segment_path = os.path.join(segments_path, f'{index:05d}.mp4')
+        if index in progress["segments"] and os.path.isfile(segment_path):
+            return segment_path
+        async with semaphore:
+            await run_transcode(
+                ffmpeg_util.combine_segment, deskshare_source, webcams_source, plan, index, segment_path, profile
+            )
+        # Checkpoint, a half written segment is encoded again
+        progress["segments"] = sorted(progress["segments"] + [index])
+        _save_combine_progress(folder_path, progress)
+        report_progress('combining', len(progress["segments"]) / progress["total"])
+        return segment_path
+
+    audio_path = os.path.join(segments_path, 'audio.m4a')
+
+    async def encode_audio() -> bool:
+        if progress["audio"] is False or (progress["audio"] and os.path.isfile(audio_path)):
+            return progress["audio"]
+        progress["audio"] = await run_transcode(
+            ffmpeg_util.combine_audio, deskshare_source, webcams_source, plan, audio_path
+        )
+        _save_combine_progress(folder_path, progress)
+        return progress["audio"]
+
+    try:
+        *segment_paths, has_audio = await asyncio.gather(
+            *[encode_segment(index) for index in range(len(plan['segments']))], encode_audio()
+        )
+        await run_transcode(
+            ffmpeg_util.concat_segments, segment_paths, audio_path if has_audio else None, output_path
+        )
+    except ffmpeg_util.FFmpegError:
+        # Resuming would fail the same way, the next attempt starts over
+        shutil.rmtree(segments_path, ignore_errors=True)
+        _save_combine_progress(folder_path, None)
+        raise
+    shutil.rmtree(segments_path, ignore_errors=True)
+    _save_combine_progress(folder_path, None)
+
+
+def _save_combine_progress(folder_path: str, progress: Optional[dict]) -> None:
+    """
+    Record the segments of the output encoded so far in the meeting metadata, None once it is done.
+    """
+    with _metadata_lock:
+        bbb_info = load_bbb_metadata(folder_path)
+        if progress is None:
+            bbb_info.pop("combineProgress", None)
+        else:
+            bbb_info["combineProgress"] = progress
+        write_bbb_metadata(folder_path, bbb_info)
+
+
+def keyframe_index_path(output_path: str) -> str:
+    return f'{os.path.splitext(output_path)[0]}.keyframes.json'
+
+
+def finalize_output(output_path: str) -> None:
+    """
+    Write the keyframe index of an MP4 output next to it.
+
+    Runs in the transcoding pool. ffmpeg writes the outputs with their index in front of the media data,
+    one that still has it behind is remuxed first. Other containers are left as they are.
+    """
+    if os.path.splitext(output_path)[1][1:].lower() not in ffmpeg_util.FASTSTART_FORMATS:
+        return
+
+    try:
+        index = mp4_util.keyframe_index(output_path)
+    except mp4_util.Mp4Error as ex:
+        logger.warning(f"Could not index the keyframes of {output_path}: {ex}")
+        index = None
+    if index and index['keyframes'] and index['moov'][0] > index['keyframes'][0][1]:
+        logger.info(f"Moving the index of {output_path} to its start")
+        base, extension = os.path.splitext(output_path)
+        remuxed_path = f'{base}.faststart{extension}'
+        ffmpeg_util.remux(output_path, remuxed_path)
+        os.replace(remuxed_path, output_path)
+        index = mp4_util.keyframe_index(output_path)
+
+    index_path = keyframe_index_path(output_path)
+    if index is None:
+        if os.path.isfile(index_path):
+            os.remove(index_path)
+        return
+    with open(index_path, 'w') as f:
+        json.dump(index, f)
+
+
+def combine_videos(
+        deskshare_source: str, webcams_source: str, output_path: str, profile: Optional[dict] = None,
+        deskshare_idle: Optional[dict] = None
+) -> None:
+    """
+    Encode the deskshare and the webcams side by side with the configured engine, runs in the transcoding pool.
+    """
+    if current.BBB.COMBINE_ENGINE == 'ffmpeg':
+        try:
+            ffmpeg_util.combine_videos(deskshare_source, webcams_source, output_path, profile, deskshare_idle)
+            return
+        except ffmpeg_util.FFmpegError as ex:
+            logger.warning(f"ffmpeg combine failed, falling back to moviepy: {ex}")
+
+    moviepy_combine(deskshare_source, webcams_source, output_path, profile)
+
+
+def remux_video(source: str, output_path: str, profile: Optional[dict] = None) -> bool:
+    """
+    Copy the streams of `source` into the container of `output_path`, re-encoding only if they do not fit.
+
+    Return False when the video had to be encoded.
+    """
+    try:
+        ffmpeg_util.remux(source, output_path)
+        return True
+    except ffmpeg_util.FFmpegError as ex:
+        logger.warning(f"Could not remux {source}, encoding it: {ex}")
+        ffmpeg_util.transcode(source, output_path, profile)
+        return False
+
+
 # TODO: Missing unit tests...
-async def moviepy_combine(video_path1, video_path2, output_path):
+def moviepy_combine(video_path1, video_path2, output_path, profile: Optional[dict] = None):
     clip1 = VideoFileClip(video_path1)
     clip2 = VideoFileClip(video_path2)
 
     final_clip = clips_array([[clip1, clip2]])
 
-    final_clip.write_videofile(output_path, codec="libx264", audio_codec="aac")
+    # moviepy passes the output path last, after the muxer options
+    final_clip.write_videofile(
+        output_path, codec="libx264", audio_codec="aac",
+        ffmpeg_params=ffmpeg_util.profile_options(profile) + ffmpeg_util.output_options(output_path)[:-1]
+    )
 
     clip1.close()
     clip2.close()
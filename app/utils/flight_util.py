@@ -0,0 +1,59 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from app.utils.progress_util import ProgressListener, current_listener, progress_listener
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """
+    In-process registry that runs at most one coroutine per key at a time.
+
+    Callers asking for a key that is already in flight await the running task
+    instead of starting a new one, and all of them receive its result (or exception)
+    and its progress reports.
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Task] = {}
+        self._listeners: Dict[str, List[ProgressListener]] = {}
+        self._last_report: Dict[str, Tuple[str, Optional[float]]] = {}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        listener = current_listener()
+        task = self._calls.get(key)
+        if task is None:
+            listeners = self._listeners[key] = [listener] if listener else []
+
+            def broadcast(stage: str, progress: Optional[float]) -> None:
+                self._last_report[key] = (stage, progress)
+                for caller_listener in list(listeners):
+                    caller_listener(stage, progress)
+
+            with progress_listener(broadcast):
+                task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._done(key))
+        else:
+            logger.info(f'Joining in-flight job for {key}')
+            if listener:
+                self._listeners[key].append(listener)
+                if key in self._last_report:
+                    listener(*self._last_report[key])
+
+        # Shield the shared task, a caller going away must not cancel the work of the others
+        return await asyncio.shield(task)
+
+    def _done(self, key: str) -> None:
+        self._calls.pop(key, None)
+        self._listeners.pop(key, None)
+        self._last_report.pop(key, None)
+
+    def in_flight(self) -> Set[str]:
+        return set(self._calls)
+
+
+# Download and combine pipelines, keyed by BBB meeting id
+recording_flight = SingleFlight()
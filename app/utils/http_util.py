@@ -0,0 +1,58 @@
+import logging
+import threading
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from app.config import current
+
+logger = logging.getLogger(__name__)
+
+# Process-wide session for the BBB presentation server, shared by every download thread
+_bbb_session: Optional[requests.Session] = None
+_bbb_session_lock = threading.Lock()
+
+
+def _create_bbb_session() -> requests.Session:
+    """
+    Build a keep-alive session with a bounded connection pool.
+
+    With `pool_block` the threads wait for a free pooled connection instead of opening
+    (and later throwing away) extra ones, so the number of sockets towards the BBB server
+    never exceeds `HTTP_POOL_MAXSIZE` per host.
+    """
+    adapter = HTTPAdapter(
+        pool_connections=current.BBB.HTTP_POOL_CONNECTIONS,
+        pool_maxsize=current.BBB.HTTP_POOL_MAXSIZE,
+        pool_block=True,
+    )
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.verify = current.BBB.VERIFY_SSL
+    session.headers.update({'Connection': 'keep-alive'})
+    return session
+
+
+def get_bbb_session() -> requests.Session:
+    """
+    Return the shared session, creating it on first use.
+    """
+    global _bbb_session
+    if _bbb_session is None:
+        with _bbb_session_lock:
+            if _bbb_session is None:
+                _bbb_session = _create_bbb_session()
+    return _bbb_session
+
+
+def close_bbb_session() -> None:
+    """
+    Close the pooled connections, e.g. on application shutdown.
+    """
+    global _bbb_session
+    with _bbb_session_lock:
+        if _bbb_session is not None:
+            _bbb_session.close()
+            _bbb_session = None
@@ -0,0 +1,147 @@
+from contextlib import closing, contextmanager
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Iterator, List, Optional, Set
+
+from app.config import current
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    params TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    progress REAL,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 1,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_stage ON jobs (stage);
+CREATE TABLE IF NOT EXISTS job_stages (
+    job_id TEXT NOT NULL REFERENCES jobs (id) ON DELETE CASCADE,
+    stage TEXT NOT NULL,
+    at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS job_stages_job ON job_stages (job_id);
+"""
+
+# Stages after which a job does not run anymore
+FINAL_STAGES = ['done', 'failed']
+
+# Store files whose tables were created by this process
+_initialized: Set[str] = set()
+_initialized_lock = threading.Lock()
+
+
+def store_path() -> str:
+    # Out of the downloaded meetings, the download server publishes them and the jobs hold credentials
+    return os.path.join(current.BASE_DIR, current.BBB.JOB_STORE_FOLDER, current.BBB.JOB_STORE_FILENAME)
+
+
+@contextmanager
+def _connect() -> Iterator[sqlite3.Connection]:
+    """
+    Open the store in a transaction, committed when the block exits without error.
+
+    A connection per call keeps the store usable from the event loop and from worker threads alike.
+    """
+    path = store_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with closing(sqlite3.connect(path, timeout=30)) as connection, connection:
+        connection.row_factory = sqlite3.Row
+        connection.execute('PRAGMA foreign_keys = ON')
+        # Progress is reported often, with WAL a commit only syncs at checkpoints
+        connection.execute('PRAGMA synchronous = NORMAL')
+        with _initialized_lock:
+            if path not in _initialized:
+                connection.execute('PRAGMA journal_mode = WAL')
+                connection.executescript(SCHEMA)
+                _initialized.add(path)
+        yield connection
+
+
+def _job(row: sqlite3.Row) -> dict:
+    return {**dict(row), 'params': json.loads(row['params'])}
+
+
+def insert_job(job_id: str, kind: str, params: dict, stage: str) -> dict:
+    now = time.time()
+    with _connect() as connection:
+        connection.execute(
+            'INSERT INTO jobs (id, kind, params, stage, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)',
+            (job_id, kind, json.dumps(params), stage, now, now)
+        )
+        connection.execute('INSERT INTO job_stages (job_id, stage, at) VALUES (?, ?, ?)', (job_id, stage, now))
+    return get_job(job_id)  # type: ignore[return-value]
+
+
+def update_job(
+        job_id: str, stage: str, progress: Optional[float] = None, error: Optional[str] = None,
+        attempts: Optional[int] = None
+) -> bool:
+    """
+    Move a running job to `stage`, return False when it is unknown or already finished.
+
+    Only the changes of stage are recorded in its history, not every progress report.
+    """
+    now = time.time()
+    with _connect() as connection:
+        row = connection.execute('SELECT stage FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None or row['stage'] in FINAL_STAGES:
+            return False
+        connection.execute(
+            'UPDATE jobs SET stage = ?, progress = ?, error = ?, attempts = COALESCE(?, attempts), updated_at = ? '
+            'WHERE id = ?',
+            (stage, progress, error, attempts, now, job_id)
+        )
+        if row['stage'] != stage:
+            connection.execute('INSERT INTO job_stages (job_id, stage, at) VALUES (?, ?, ?)', (job_id, stage, now))
+    return True
+
+
+def get_job(job_id: str) -> Optional[dict]:
+    if not os.path.isfile(store_path()):
+        return None
+    with _connect() as connection:
+        row = connection.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+    return _job(row) if row else None
+
+
+def job_stages(job_id: str) -> List[str]:
+    if not os.path.isfile(store_path()):
+        return []
+    with _connect() as connection:
+        rows = connection.execute('SELECT stage FROM job_stages WHERE job_id = ? ORDER BY rowid', (job_id,))
+        return [row['stage'] for row in rows]
+
+
+def unfinished_jobs() -> List[dict]:
+    """
+    Return the jobs a previous run of the service did not finish, oldest first.
+    """
+    if not os.path.isfile(store_path()):
+        return []
+    with _connect() as connection:
+        rows = connection.execute(
+            f'SELECT * FROM jobs WHERE stage NOT IN ({",".join("?" * len(FINAL_STAGES))}) ORDER BY created_at',
+            FINAL_STAGES
+        ).fetchall()
+    return [_job(row) for row in rows]
+
+
+def delete_finished_before(timestamp: float) -> int:
+    if not os.path.isfile(store_path()):
+        return 0
+    with _connect() as connection:
+        cursor = connection.execute(
+            f'DELETE FROM jobs WHERE stage IN ({",".join("?" * len(FINAL_STAGES))}) AND updated_at < ?',
+            FINAL_STAGES + [timestamp]
+        )
+        return cursor.rowcount
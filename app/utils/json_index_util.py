@@ -0,0 +1,43 @@
+import json
+import logging
+import os
+from typing import Callable, Dict
+
+from app.config import current
+
+logger = logging.getLogger(__name__)
+
+
+def meetings_dir() -> str:
+    return os.path.join(current.BASE_DIR, current.BBB.DOWNLOADED_MEETINGS_FOLDER)
+
+
+def index_path(filename: str) -> str:
+    return os.path.join(meetings_dir(), filename)
+
+
+def load_index(filename: str, rebuild: Callable[[], Dict[str, dict]]) -> Dict[str, dict]:
+    """
+    Read the index `filename` of the downloaded meetings, built with `rebuild` when it is missing or unreadable.
+
+    The callers hold their own lock, the index is read and written from the event loop and from worker threads.
+    """
+    try:
+        with open(index_path(filename), 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return rebuild()
+    except (OSError, ValueError) as ex:
+        logger.warning(f'Index {filename} unreadable ({ex}), rebuilding it')
+        return rebuild()
+
+
+def save_index(filename: str, index: Dict[str, dict]) -> None:
+    """
+    Replace the index `filename` at once, a reader never sees it half written.
+    """
+    os.makedirs(meetings_dir(), exist_ok=True)
+    tmp_path = f'{index_path(filename)}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(index, f)
+    os.replace(tmp_path, index_path(filename))
@@ -0,0 +1,151 @@
+from bisect import bisect_left
+import threading
+import time
+from typing import Dict, List, Optional, Sequence
+
+# Bucket upper bounds of the download histograms
+TTFB_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+THROUGHPUT_BUCKETS = [2 ** 16, 2 ** 18, 2 ** 20, 2 ** 22, 2 ** 24, 2 ** 26, 2 ** 28]  # bytes/s, 64 KiB/s to 256 MiB/s
+DURATION_BUCKETS = [1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600]
+
+
+class Histogram:
+    """
+    Cumulative histogram with fixed bucket upper bounds.
+    """
+
+    def __init__(self, buckets: Sequence[float]):
+        self._buckets: List[float] = sorted(buckets)
+        self._counts = [0] * (len(self._buckets) + 1)
+        self._count = 0
+        self._sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self._counts[bisect_left(self._buckets, value)] += 1
+        self._count += 1
+        self._sum += value
+
+    def as_dict(self) -> dict:
+        cumulative = 0
+        buckets = {}
+        for bound, count in zip(self._buckets + [float('inf')], self._counts):
+            cumulative += count
+            buckets['+Inf' if bound == float('inf') else str(bound)] = cumulative
+        return {'buckets': buckets, 'count': self._count, 'sum': self._sum}
+
+
+class MetricsRegistry:
+    """
+    Thread-safe, in-process counters and histograms.
+    """
+
+    def __init__(self, histograms: Dict[str, Sequence[float]]):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, float] = {}
+        self._histograms = {name: Histogram(buckets) for name, buckets in histograms.items()}
+
+    def inc(self, name: str, value: float = 1) -> None:
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def observe(self, name: str, value: float) -> None:
+        with self._lock:
+            self._histograms[name].observe(value)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                'counters': dict(self._counters),
+                'histograms': {name: histogram.as_dict() for name, histogram in self._histograms.items()},
+            }
+
+
+class TransferStats:
+    """
+    Statistics of one file transfer, possibly made of several parallel range requests and retries.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        self._window_started = self._started
+        self._window_bytes = 0
+        self.bytes = 0
+        self.ttfb: Optional[float] = None
+        self.peak_throughput = 0.0
+        self.retries = 0
+        # Files of the transfer given up, for transfers made of many small files
+        self.failures = 0
+        self.duration = 0.0
+        self.status = 'running'
+
+    def first_byte(self, seconds: float) -> None:
+        with self._lock:
+            self.ttfb = seconds if self.ttfb is None else min(self.ttfb, seconds)
+
+    def add_bytes(self, amount: int) -> None:
+        with self._lock:
+            self.bytes += amount
+            self._window_bytes += amount
+
+            # Peak throughput over windows of at least one second
+            now = time.monotonic()
+            if now - self._window_started >= 1:
+                self.peak_throughput = max(self.peak_throughput, self._window_bytes / (now - self._window_started))
+                self._window_started = now
+                self._window_bytes = 0
+
+    def retry(self) -> None:
+        with self._lock:
+            self.retries += 1
+
+    def fail(self) -> None:
+        with self._lock:
+            self.failures += 1
+
+    @property
+    def average_throughput(self) -> float:
+        return self.bytes / self.duration if self.duration > 0 else 0.0
+
+    def finish(self, status: str) -> None:
+        with self._lock:
+            self.duration = time.monotonic() - self._started
+            self.status = status
+            # Transfers shorter than one window peak at their average
+            if self.peak_throughput == 0 and self.duration > 0:
+                self.peak_throughput = self.bytes / self.duration
+
+    def as_dict(self) -> dict:
+        return {
+            'bytes': self.bytes,
+            'ttfb_seconds': self.ttfb,
+            'duration_seconds': round(self.duration, 3),
+            'average_bytes_per_second': round(self.average_throughput),
+            'peak_bytes_per_second': round(self.peak_throughput),
+            'retries': self.retries,
+            'failures': self.failures,
+            'status': self.status,
+        }
+
+
+download_metrics = MetricsRegistry(histograms={
+    'transfer_ttfb_seconds': TTFB_BUCKETS,
+    'transfer_bytes_per_second': THROUGHPUT_BUCKETS,
+    'transfer_duration_seconds': DURATION_BUCKETS,
+    'job_duration_seconds': DURATION_BUCKETS,
+})
+
+
+def record_transfer(stats: TransferStats) -> None:
+    """
+    Add a finished transfer to the aggregate download metrics.
+    """
+    download_metrics.inc(f'transfers_{stats.status}_total')
+    download_metrics.inc('transfer_bytes_total', stats.bytes)
+    download_metrics.inc('transfer_retries_total', stats.retries)
+    download_metrics.inc('transfer_failures_total', stats.failures)
+    if stats.ttfb is not None:
+        download_metrics.observe('transfer_ttfb_seconds', stats.ttfb)
+    if stats.bytes:
+        download_metrics.observe('transfer_bytes_per_second', stats.average_throughput)
+    download_metrics.observe('transfer_duration_seconds', stats.duration)
@@ -0,0 +1,201 @@
+import os
+import struct
+from typing import BinaryIO, Iterator, List, Optional, Tuple
+
+# (type, offset, header size, size) of an MP4 box, the offset is relative to the buffer or file it was read from
+Box = Tuple[bytes, int, int, int]
+
+
+class Mp4Error(Exception):
+    """
+    The file is not an MP4 this util can handle.
+    """
+
+
+def _box_header(header: bytes, offset: int, end: int) -> Box:
+    size, box_type = struct.unpack_from('>I4s', header)
+    header_size = 8
+    if size == 1:
+        if len(header) < 16:
+            raise Mp4Error(f'Truncated box {box_type!r} at {offset}')
+        size = struct.unpack_from('>Q', header, 8)[0]
+        header_size = 16
+    elif size == 0:
+        # The box runs to the end of its parent
+        size = end - offset
+    if size < header_size or offset + size > end:
+        raise Mp4Error(f'Invalid size {size} of box {box_type!r} at {offset}')
+    return box_type, offset, header_size, size
+
+
+def file_boxes(f: BinaryIO) -> List[Box]:
+    """
+    Return the top level boxes of an open MP4 file.
+    """
+    end = f.seek(0, os.SEEK_END)
+    boxes = []
+    offset = 0
+    while offset + 8 <= end:
+        f.seek(offset)
+        box = _box_header(f.read(16), offset, end)
+        boxes.append(box)
+        offset += box[3]
+    return boxes
+
+
+def children(data: bytes, parent: Box) -> Iterator[Box]:
+    _, offset, header_size, size = parent
+    position, end = offset + header_size, offset + size
+    while position + 8 <= end:
+        box = _box_header(data[position:position + 16], position, end)
+        yield box
+        position += box[3]
+
+
+def child(data: bytes, parent: Box, *path: bytes) -> Optional[Box]:
+    """
+    Return the first box at `path` below `parent`, None when there is none.
+    """
+    box: Optional[Box] = parent
+    for box_type in path:
+        box = next((found for found in children(data, box) if found[0] == box_type), None)  # type: ignore[arg-type]
+        if box is None:
+            return None
+    return box
+
+
+def _payload(data: bytes, box: Box) -> memoryview:
+    return memoryview(data)[box[1] + box[2]:box[1] + box[3]]
+
+
+def _read_moov(f: BinaryIO, boxes: List[Box]) -> Tuple[bytes, Box]:
+    moov = next((box for box in boxes if box[0] == b'moov'), None)
+    if moov is None:
+        raise Mp4Error('No moov box, the file might be fragmented or truncated')
+    f.seek(moov[1])
+    data = f.read(moov[3])
+    return data, (moov[0], 0, moov[2], moov[3])
+
+
+def _table(data: bytes, box: Optional[Box], fields: int, header_fields: int = 1) -> List[Tuple[int, ...]]:
+    """
+    Return the entries of a full box holding `fields` 32 bit values each, after an entry count.
+    """
+    if box is None:
+        return []
+    payload = _payload(data, box)
+    count = struct.unpack_from('>I', payload, 4 * header_fields)[0]
+    values = struct.unpack_from(f'>{count * fields}I', payload, 4 * (header_fields + 1))
+    return [values[i:i + fields] for i in range(0, len(values), fields)]
+
+
+def _sample_sizes(data: bytes, stsz: Box) -> List[int]:
+    payload = _payload(data, stsz)
+    sample_size, count = struct.unpack_from('>II', payload, 4)
+    if sample_size:
+        return [sample_size] * count
+    return list(struct.unpack_from(f'>{count}I', payload, 12))
+
+
+def _chunk_offsets(data: bytes, stbl: Box) -> List[int]:
+    stco = child(data, stbl, b'stco') or child(data, stbl, b'co64')
+    if stco is None:
+        raise Mp4Error('No chunk offsets')
+    payload = _payload(data, stco)
+    count = struct.unpack_from('>I', payload, 4)[0]
+    return list(struct.unpack_from(f'>{count}{"Q" if stco[0] == b"co64" else "I"}', payload, 8))
+
+
+def _timescale(data: bytes, mdhd: Box) -> int:
+    payload = _payload(data, mdhd)
+    return struct.unpack_from('>I', payload, 20 if payload[0] == 1 else 12)[0]
+
+
+def _edit_start(data: bytes, trak: Box) -> Tuple[int, int]:
+    """
+    Return the media time the edit list starts playing from and the empty time before it, in the movie timescale.
+
+    B-frames delay the media start by a few frames, a track starting later than the others (e.g. after
+    shifting the audio priming to zero) begins with an empty edit.
+    """
+    elst = child(data, trak, b'edts', b'elst')
+    if elst is None:
+        return 0, 0
+    payload = _payload(data, elst)
+    count = struct.unpack_from('>I', payload, 4)[0]
+    entry_format, entry_size = ('>Qq', 20) if payload[0] == 1 else ('>Ii', 12)
+    empty = 0
+    for position in range(8, 8 + count * entry_size, entry_size):
+        # Empty edits have a media time of -1
+        duration, media_time = struct.unpack_from(entry_format, payload, position)
+        if media_time >= 0:
+            return media_time, empty
+        empty += duration
+    return 0, empty
+
+
+def keyframe_index(path: str) -> Optional[dict]:
+    """
+    Return the presentation time and byte offset of every keyframe of the video track of `path`.
+
+    A player seeking to a keyframe only needs the moov range and one range request from its offset.
+    Return None when the file has no video track.
+    """
+    with open(path, 'rb') as f:
+        boxes = file_boxes(f)
+        data, moov = _read_moov(f, boxes)
+    top_moov = next(box for box in boxes if box[0] == b'moov')
+    mvhd = child(data, moov, b'mvhd')
+    if mvhd is None:
+        raise Mp4Error('No movie header')
+    movie_timescale = _timescale(data, mvhd)
+
+    for trak in children(data, moov):
+        hdlr = child(data, trak, b'mdia', b'hdlr') if trak[0] == b'trak' else None
+        if hdlr is None or bytes(_payload(data, hdlr)[8:12]) != b'vide':
+            continue
+        mdhd = child(data, trak, b'mdia', b'mdhd')
+        stbl = child(data, trak, b'mdia', b'minf', b'stbl')
+        stsz = child(data, stbl, b'stsz') if stbl else None
+        if mdhd is None or stbl is None or stsz is None:
+            raise Mp4Error('Incomplete video track')
+
+        timescale = _timescale(data, mdhd)
+        sizes = _sample_sizes(data, stsz)
+        # Every sample is a keyframe when there is no stss
+        stss = child(data, stbl, b'stss')
+        keyframes = {number - 1 for number, in _table(data, stss, 1)} if stss else set(range(len(sizes)))
+        composition = [offset for count, offset in _table(data, child(data, stbl, b'ctts'), 2) for _ in range(count)]
+        decode_times = [delta for count, delta in _table(data, child(data, stbl, b'stts'), 2) for _ in range(count)]
+        chunk_runs = _table(data, child(data, stbl, b'stsc'), 3)
+        chunk_offsets = _chunk_offsets(data, stbl)
+        start, empty = _edit_start(data, trak)
+        delay = empty / movie_timescale if movie_timescale else 0
+
+        index = []
+        sample, decode_time = 0, 0
+        for run, (first_chunk, samples_per_chunk, _) in enumerate(chunk_runs):
+            last_chunk = chunk_runs[run + 1][0] - 1 if run + 1 < len(chunk_runs) else len(chunk_offsets)
+            for chunk in range(first_chunk - 1, last_chunk):
+                offset = chunk_offsets[chunk]
+                for _ in range(samples_per_chunk):
+                    if sample >= len(sizes):
+                        break
+                    if sample in keyframes:
+                        # ctts offsets are signed from version 1 on
+                        shift = composition[sample] if sample < len(composition) else 0
+                        shift = shift - (1 << 32) if shift >= 1 << 31 else shift
+                        time = (decode_time + shift - start) / timescale + delay
+                        index.append([round(max(time, 0), 3), offset, sizes[sample]])
+                    offset += sizes[sample]
+                    decode_time += decode_times[sample] if sample < len(decode_times) else 0
+                    sample += 1
+
+        return {
+            'timescale': timescale,
+            'duration': round(decode_time / timescale, 3),
+            'moov': [top_moov[1], top_moov[3]],
+            # [time in seconds, byte offset, size in bytes] of every keyframe
+            'keyframes': index,
+        }
+    return None
@@ -0,0 +1,127 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+from typing import Dict, Iterable, List, Optional
+
+from app.config import current
+from app.utils import json_index_util
+
+logger = logging.getLogger(__name__)
+
+# Bumped when the way outputs are built changes, every cached output is built again then
+OUTPUT_CACHE_VERSION = 1
+
+# Guards the index file, it is read and written from the event loop and from worker threads
+_index_lock = threading.RLock()
+
+
+def input_fingerprint(folder_path: str, bbb_info: dict, files: Iterable[str]) -> Dict[str, Optional[dict]]:
+    """
+    Identify the inputs of an output: url and validators sent by the server, else size and date of the local file.
+    """
+    fingerprint: Dict[str, Optional[dict]] = {}
+    base_url = bbb_info.get("base_url", "")
+    for file in files:
+        validators = bbb_info.get("fileValidators", {}).get(file) or {}
+        path = os.path.join(folder_path, file)
+        if validators.get("etag") or validators.get("last_modified"):
+            fingerprint[file] = {"url": base_url + file, **validators}
+        elif os.path.isfile(path):
+            stat = os.stat(path)
+            fingerprint[file] = {"url": base_url + file, "size": stat.st_size, "mtime": stat.st_mtime}
+        else:
+            fingerprint[file] = None
+    return fingerprint
+
+
+def output_key(fingerprint: Dict[str, Optional[dict]], combine_boolean: bool, encoding: dict) -> str:
+    """
+    Return the key of the output built from the inputs of `fingerprint` with `encoding` and the current settings.
+    """
+    params = {
+        "version": OUTPUT_CACHE_VERSION,
+        "inputs": fingerprint,
+        "combine": bool(combine_boolean),
+        "encoding": encoding,
+        "format": current.BBB.COMBINED_VIDEO_FORMAT,
+        "engine": current.BBB.COMBINE_ENGINE,
+        "idle": [
+            current.BBB.IDLE_DETECTION, current.BBB.IDLE_MIN_SECONDS, current.BBB.IDLE_FRAME_SECONDS,
+            current.BBB.IDLE_WEBCAMS_ONLY_RATIO,
+        ],
+    }
+    return hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()
+
+
+def accepted_encodings() -> List[dict]:
+    """
+    Return the encodings an output may have been built with to be reused.
+
+    Copied streams always qualify, any configured profile does unless one is forced.
+    """
+    profiles = current.BBB.ENCODING_PROFILES
+    names = [current.BBB.ENCODING_PROFILE] if current.BBB.ENCODING_PROFILE in profiles else list(profiles)
+    return [{"name": "copy"}] + [{"name": name, **profiles[name].model_dump()} for name in names]
+
+
+def accepted_keys(fingerprint: Dict[str, Optional[dict]], combine_boolean: bool) -> List[str]:
+    return [output_key(fingerprint, combine_boolean, encoding) for encoding in accepted_encodings()]
+
+
+def load_index() -> Dict[str, dict]:
+    with _index_lock:
+        return json_index_util.load_index(current.BBB.OUTPUT_CACHE_INDEX_FILENAME, dict)
+
+
+def _save_index(index: Dict[str, dict]) -> None:
+    json_index_util.save_index(current.BBB.OUTPUT_CACHE_INDEX_FILENAME, index)
+
+
+def lookup(keys: Iterable[str]) -> Optional[dict]:
+    """
+    Return the entry, with its key and path, of an output stored under one of `keys`, None when there is none.
+
+    Entries whose file was evicted or rewritten since are dropped.
+    """
+    with _index_lock:
+        index = load_index()
+        for key in keys:
+            entry = index.get(key)
+            if not entry:
+                continue
+            path = os.path.join(json_index_util.meetings_dir(), entry['folder'], entry['file'])
+            if os.path.isfile(path) and os.path.getsize(path) == entry['size']:
+                return {**entry, 'key': key, 'path': path}
+            index.pop(key)
+            _save_index(index)
+    return None
+
+
+def register(key: str, output_path: str, encoding: dict) -> None:
+    """
+    Store the output built under `key` with `encoding`, where it is in the downloaded meetings.
+    """
+    with _index_lock:
+        index = load_index()
+        index[key] = {
+            'folder': os.path.basename(os.path.dirname(output_path)),
+            'file': os.path.basename(output_path),
+            'size': os.path.getsize(output_path),
+            'encoding': encoding,
+        }
+        _save_index(index)
+
+
+def link_file(source: str, destination: str) -> None:
+    """
+    Make `destination` a hard link of `source`, a copy when the file system has none.
+    """
+    if os.path.exists(destination):
+        os.remove(destination)
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
@@ -0,0 +1,125 @@
+import json
+import logging
+import os
+from typing import List, Optional
+from urllib import parse
+import xml.etree.ElementTree as ElementTree
+
+from starlette.status import HTTP_404_NOT_FOUND
+
+from app.config import current
+from app.utils.http_util import get_bbb_session
+from app.utils.metrics_util import TransferStats
+from app.utils.scheduler_util import download_scheduler
+
+logger = logging.getLogger(__name__)
+
+# Files of the BBB presentation format read by the playback, most of them are optional
+PLAYBACK_FILES = [
+    "shapes.svg", "panzooms.xml", "cursor.xml", "deskshare.xml", "captions.json", "slides_new.xml",
+    "presentation_text.json", "notes.xml", "polls.json", "external_videos.json", "tldraw.json",
+]
+
+XLINK_HREF = '{http://www.w3.org/1999/xlink}href'
+
+
+def safe_relative_path(path: str) -> Optional[str]:
+    """
+    Return `path` normalized, or None when it would land outside of the meeting folder.
+    """
+    path = os.path.normpath(parse.unquote(path)).replace(os.sep, '/')
+    if not path or path == '.' or path.startswith('../') or path == '..' or os.path.isabs(path):
+        return None
+    return path
+
+
+def _relative_to_meeting(url: str, meeting_id: str) -> Optional[str]:
+    """
+    Turn an absolute asset url of the meeting into a path relative to its folder.
+    """
+    marker = f'/presentation/{meeting_id}/'
+    path = parse.urlparse(url).path
+    if marker not in path:
+        return None
+    return path.split(marker, 1)[1]
+
+
+def slide_assets(shapes_svg_path: str) -> List[str]:
+    """
+    Return the slide images referenced by shapes.svg.
+    """
+    assets = []
+    for _, elem in ElementTree.iterparse(shapes_svg_path):
+        if elem.tag.endswith('image'):
+            href = elem.get(XLINK_HREF) or elem.get('href')
+            if href:
+                assets.append(href)
+        elem.clear()
+    return assets
+
+
+def thumbnail_assets(metadata_xml_path: str, meeting_id: str) -> List[str]:
+    """
+    Return the slide thumbnails listed in metadata.xml.
+    """
+    assets = []
+    root = ElementTree.parse(metadata_xml_path).getroot()
+    for image in root.iter('image'):
+        path = _relative_to_meeting((image.text or '').strip(), meeting_id)
+        if path:
+            assets.append(path)
+    return assets
+
+
+def caption_assets(captions_json_path: str) -> List[str]:
+    """
+    Return the caption tracks listed in captions.json.
+    """
+    with open(captions_json_path, 'r') as f:
+        captions = json.load(f)
+    return [f'caption_{caption["locale"]}.vtt' for caption in captions if caption.get('locale')]
+
+
+def build_manifest(base_path: str, meeting_id: str) -> List[str]:
+    """
+    Return the assets referenced by the playback files already downloaded in `base_path`.
+    """
+    manifest: List[str] = []
+    parsers = [
+        ('shapes.svg', slide_assets),
+        ('metadata.xml', lambda path: thumbnail_assets(path, meeting_id)),
+        ('captions.json', caption_assets),
+    ]
+    for file, parser in parsers:
+        path = os.path.join(base_path, file)
+        if not os.path.isfile(path):
+            continue
+        try:
+            manifest.extend(parser(path))
+        except (ElementTree.ParseError, ValueError, KeyError, TypeError) as ex:
+            logger.warning(f'Could not read the assets of {file}: {ex}')
+
+    # Keep the order, drop duplicates and anything pointing outside of the meeting folder
+    safe_paths = [safe_relative_path(asset) for asset in manifest]
+    return list(dict.fromkeys(path for path in safe_paths if path))
+
+
+def fetch_asset(url: str, save_path: str, job_id: str, stats: TransferStats) -> bool:
+    """
+    Download a small file with a single GET over the shared session, return False if it does not exist.
+    """
+    with download_scheduler.transfer(job_id, url):
+        response = get_bbb_session().get(url, timeout=current.BBB.DOWNLOAD_TIMEOUT_SECONDS)
+    stats.first_byte(response.elapsed.total_seconds())
+    if response.status_code == HTTP_404_NOT_FOUND:
+        return False
+    response.raise_for_status()
+
+    download_scheduler.throttle(url, len(response.content))
+    stats.add_bytes(len(response.content))
+    os.makedirs(os.path.dirname(save_path), exist_ok=True)
+    tmp_path = f'{save_path}.part'
+    with open(tmp_path, 'wb') as f:
+        f.write(response.content)
+    os.replace(tmp_path, save_path)
+    return True
@@ -0,0 +1,41 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+import logging
+from typing import Callable, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+# Receives the (stage, progress) reports of the pipeline running in the current context
+ProgressListener = Callable[[str, Optional[float]], None]
+
+_listener: ContextVar[Optional[ProgressListener]] = ContextVar('progress_listener', default=None)
+
+
+def report_progress(stage: str, progress: Optional[float] = None) -> None:
+    """
+    Tell the job running the current pipeline which stage it reached, with the share of it done when known.
+    """
+    listener = _listener.get()
+    if listener is None:
+        return
+    try:
+        listener(stage, progress)
+    except Exception as ex:
+        # Reporting never breaks the pipeline
+        logger.warning(f'Could not report the {stage} stage: {ex}')
+
+
+def current_listener() -> Optional[ProgressListener]:
+    return _listener.get()
+
+
+@contextmanager
+def progress_listener(listener: Optional[ProgressListener]) -> Iterator[None]:
+    """
+    Send the reports of the code run in this context, and of the tasks it starts, to `listener`.
+    """
+    token = _listener.set(listener)
+    try:
+        yield
+    finally:
+        _listener.reset(token)
@@ -30,18 +30,24 @@ def send_email(email_input: EmailInput):
     download_meeting_dir = email_input.download_meeting_dir
     download_link = email_input.download_link
     upload_link = email_input.upload_link
+    playback_link = email_input.playback_link
     smtp_server = email_input.smtp_server
     smtp_port = email_input.smtp_port
 
-    # Create a MIME object
-    def email_already_sent(directory):
-        # Construct the full file path
-        file_path = os.path.join(directory, "EMAIL_SENT.txt")
+    meeting_dir = os.path.join(current.BASE_DIR, current.BBB.DOWNLOADED_MEETINGS_FOLDER, download_meeting_dir)
+    email_sent_file = os.path.join(meeting_dir, "EMAIL_SENT.txt")
 
-        # Check if the file exists
-        return os.path.isfile(file_path)
+    # Create a MIME object
+    def email_already_sent():
+        # Check if the recipient got this link, several users and deliverables can share the same recording
+        if not os.path.isfile(email_sent_file):
+            return False
+        with open(email_sent_file, 'r') as f:
+            sent = f.read().splitlines()
+        # Files written before the links were listed only hold the recipients
+        return f"{to_email} {download_link}" in sent or to_email in sent
 
-    if email_already_sent(os.getcwd()):
+    if email_already_sent():
         print("email was already sent")
     else:
         msg: MIMEMultipart = MIMEMultipart()
@@ -49,15 +55,13 @@ def send_email(email_input: EmailInput):
         msg['To'] = to_email
         msg['Subject'] = "Dirección de descarga de la grabación " + room_name
 
-        metadata_xml_file = os.path.join(
-            current.BASE_DIR, current.BBB.DOWNLOADED_MEETINGS_FOLDER, download_meeting_dir, 'metadata.xml'
-        )
+        metadata_xml_file = os.path.join(meeting_dir, 'metadata.xml')
         time = str(format_time(int(get_metadata_components('start_time', metadata_xml_file))))
-        html_content = record_ready_email(time, download_link, upload_link)
+        html_content = record_ready_email(time, download_link, upload_link, playback_link)
         msg.attach(MIMEText(html_content, 'html'))
 
         # Establish a connection to the SMTP server
-        with smtplib.SMTP(smtp_server, smtp_port) as server:
+        with smtplib.SMTP(smtp_server, smtp_port, timeout=current.EMAIL.TIMEOUT_SECONDS) as server:
             server.connect(smtp_server, smtp_port)
             # Use TLS for secure connection
             server.starttls()
@@ -68,5 +72,5 @@ def send_email(email_input: EmailInput):
             # Send the email
             server.sendmail(sender_email, to_email, msg.as_string())
         print(f"Email sent successfully to {to_email}")
-    with open("EMAIL_SENT.txt", 'w') as f:
-        f.write("")
+        with open(email_sent_file, 'a') as f:
+            f.write(f"{to_email} {download_link}\n")
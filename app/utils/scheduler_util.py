@@ -0,0 +1,193 @@
+import asyncio
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import contextvars
+import functools
+import logging
+import threading
+import time
+from typing import Any, Callable, Deque, Dict, Iterator, Optional
+from urllib import parse
+
+from app.config import current
+
+logger = logging.getLogger(__name__)
+
+# Threads of the blocking transfers. Most of the time they wait for a slot of the scheduler, in the
+# default executor they would hold up the unrelated work handed to asyncio.to_thread meanwhile
+_download_executor: Optional[ThreadPoolExecutor] = None
+_download_executor_lock = threading.Lock()
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket, `rate` bytes per second with one second of burst.
+
+    Consumers may go into debt and then sleep it off, so chunks larger than the
+    bucket never block forever and concurrent consumers share the rate evenly.
+    """
+
+    def __init__(self, rate: int):
+        self._rate = rate
+        self._tokens = float(rate)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, amount: int) -> None:
+        if self._rate <= 0:
+            return
+
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(float(self._rate), self._tokens + (now - self._last) * self._rate)
+            self._last = now
+            self._tokens -= amount
+            wait = -self._tokens / self._rate if self._tokens < 0 else 0
+
+        if wait:
+            time.sleep(wait)
+
+
+class _Ticket:
+    def __init__(self, origin: str):
+        self.origin = origin
+        self.granted = False
+
+
+class DownloadScheduler:
+    """
+    Central gate for every transfer from the BBB server(s).
+
+    - At most `max_transfers` transfers run at once, and `max_transfers_per_origin` per origin.
+    - Free slots are handed out round-robin between jobs, FIFO within a job, so a job
+      with many files or segments cannot starve the jobs queued after it.
+    - The bytes of every origin go through a token bucket of `bandwidth_per_origin` bytes/s.
+    """
+
+    def __init__(self, max_transfers: int, max_transfers_per_origin: int, bandwidth_per_origin: int):
+        self._max_transfers = max(max_transfers, 1)
+        self._max_transfers_per_origin = max(max_transfers_per_origin, 1)
+        self._bandwidth_per_origin = bandwidth_per_origin
+
+        self._condition = threading.Condition()
+        self._queues: 'OrderedDict[str, Deque[_Ticket]]' = OrderedDict()
+        self._active: Counter = Counter()
+        self._buckets: Dict[str, TokenBucket] = {}
+
+    @staticmethod
+    def origin(url: str) -> str:
+        parsed_url = parse.urlparse(url)
+        return f'{parsed_url.scheme}://{parsed_url.netloc}'
+
+    @property
+    def active_transfers(self) -> int:
+        with self._condition:
+            return sum(self._active.values())
+
+    def _dispatch(self) -> None:
+        """
+        Grant free slots to the queued tickets, the caller holds the condition.
+        """
+        granted = False
+        while self._queues and sum(self._active.values()) < self._max_transfers:
+            for job_id, queue in self._queues.items():
+                ticket = queue[0]
+                if self._active[ticket.origin] < self._max_transfers_per_origin:
+                    break
+            else:
+                break
+
+            queue.popleft()
+            ticket.granted = True
+            self._active[ticket.origin] += 1
+            granted = True
+
+            # The job goes back to the end of the line
+            if queue:
+                self._queues.move_to_end(job_id)
+            else:
+                del self._queues[job_id]
+
+        if granted:
+            self._condition.notify_all()
+
+    def acquire(self, job_id: str, url: str) -> str:
+        ticket = _Ticket(self.origin(url))
+        with self._condition:
+            self._queues.setdefault(job_id, deque()).append(ticket)
+            self._dispatch()
+            while not ticket.granted:
+                self._condition.wait()
+        return ticket.origin
+
+    def release(self, origin: str) -> None:
+        with self._condition:
+            self._active[origin] -= 1
+            if self._active[origin] <= 0:
+                del self._active[origin]
+            self._dispatch()
+
+    @contextmanager
+    def transfer(self, job_id: str, url: str) -> Iterator[None]:
+        """
+        Hold a transfer slot for `job_id` while downloading `url`.
+        """
+        origin = self.acquire(job_id, url)
+        try:
+            yield
+        finally:
+            self.release(origin)
+
+    def throttle(self, url: str, amount: int) -> None:
+        """
+        Account `amount` bytes received from `url`, sleeping when its origin is over the bandwidth limit.
+        """
+        if self._bandwidth_per_origin <= 0:
+            return
+
+        origin = self.origin(url)
+        with self._condition:
+            bucket = self._buckets.setdefault(origin, TokenBucket(self._bandwidth_per_origin))
+        bucket.consume(amount)
+
+
+download_scheduler = DownloadScheduler(
+    max_transfers=current.BBB.DOWNLOAD_MAX_TRANSFERS,
+    max_transfers_per_origin=current.BBB.DOWNLOAD_MAX_TRANSFERS_PER_ORIGIN,
+    bandwidth_per_origin=current.BBB.DOWNLOAD_BANDWIDTH_PER_ORIGIN,
+)
+
+
+def get_download_executor() -> ThreadPoolExecutor:
+    """
+    Return the shared pool of `DOWNLOAD_THREADS` threads running the transfers, creating it on first use.
+    """
+    global _download_executor
+    if _download_executor is None:
+        with _download_executor_lock:
+            if _download_executor is None:
+                _download_executor = ThreadPoolExecutor(
+                    max_workers=max(current.BBB.DOWNLOAD_THREADS, 1), thread_name_prefix='download'
+                )
+    return _download_executor
+
+
+async def run_download(fn: Callable[..., Any], *args: Any) -> Any:
+    """
+    Run the blocking transfer `fn` in a download thread and await its result, like `asyncio.to_thread`.
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(get_download_executor(), functools.partial(context.run, fn, *args))
+
+
+def shutdown_download_executor() -> None:
+    """
+    Stop the download threads, e.g. on application shutdown.
+    """
+    global _download_executor
+    with _download_executor_lock:
+        if _download_executor is not None:
+            _download_executor.shutdown(wait=False, cancel_futures=True)
+            _download_executor = None
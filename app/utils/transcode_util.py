@@ -0,0 +1,92 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+import functools
+import logging
+import multiprocessing
+import threading
+from typing import Any, Callable, Iterator, Optional, Tuple
+
+from app.config import current
+
+logger = logging.getLogger(__name__)
+
+# Process-wide pool running the encodes, the remuxes and the zips outside of the event loop
+_transcode_pool: Optional[ProcessPoolExecutor] = None
+_transcode_pool_lock = threading.Lock()
+
+# Encodes of meeting outputs started and not finished yet, running or queued. Not the pool tasks:
+# one segmented encode alone submits a task per segment, plus the audio, the probes and the packaging
+_backlog = 0
+
+
+def get_transcode_pool() -> ProcessPoolExecutor:
+    """
+    Return the shared pool of `TRANSCODE_WORKERS` processes, creating it on first use.
+
+    The workers are spawned rather than forked, a fork would copy the locks held by the
+    download threads at that moment.
+    """
+    global _transcode_pool
+    if _transcode_pool is None:
+        with _transcode_pool_lock:
+            if _transcode_pool is None:
+                _transcode_pool = ProcessPoolExecutor(
+                    max_workers=max(current.BBB.TRANSCODE_WORKERS, 1),
+                    mp_context=multiprocessing.get_context('spawn'),
+                )
+    return _transcode_pool
+
+
+async def run_transcode(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """
+    Run `fn`, a picklable module-level function, in the transcoding pool and await its result.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_transcode_pool(), functools.partial(fn, *args, **kwargs))
+
+
+@contextmanager
+def encode_job() -> Iterator[None]:
+    """
+    Count the encode of one meeting output in the backlog while the block runs.
+    """
+    global _backlog
+    _backlog += 1
+    try:
+        yield
+    finally:
+        _backlog -= 1
+
+
+def transcode_backlog() -> int:
+    return _backlog
+
+
+def choose_encoding_profile() -> Tuple[str, dict]:
+    """
+    Return the name and settings of the encoding profile for a new job.
+
+    Unless `ENCODING_PROFILE` forces one, the profile follows the encodes already in progress: the
+    faster presets take over when they pile up, and the quality ones come back once they drained.
+    """
+    profiles = current.BBB.ENCODING_PROFILES
+    name = current.BBB.ENCODING_PROFILE
+    if name not in profiles:
+        reached = [
+            (threshold, profile_name) for profile_name, threshold in current.BBB.ENCODING_PROFILE_BACKLOG.items()
+            if profile_name in profiles and threshold <= _backlog
+        ]
+        name = max(reached)[1] if reached else next(iter(profiles))
+    return name, profiles[name].model_dump()
+
+
+def shutdown_transcode_pool() -> None:
+    """
+    Stop the worker processes, e.g. on application shutdown.
+    """
+    global _transcode_pool
+    with _transcode_pool_lock:
+        if _transcode_pool is not None:
+            _transcode_pool.shutdown(wait=False, cancel_futures=True)
+            _transcode_pool = None
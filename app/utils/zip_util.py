@@ -0,0 +1,175 @@
+import os
+import struct
+import time
+from typing import Iterator, List, Optional, Tuple, Union
+import zlib
+from zipfile import ZIP_STORED
+
+from pydantic import BaseModel
+
+# Sizes and offsets from this value on are written in ZIP64 extra fields
+ZIP64_LIMIT = 0xFFFFFFFF
+# Written in place of those values in the regular fields
+ZIP64_MARKER = 0xFFFFFFFF
+ZIP64_VERSION = 45
+ZIP_VERSION = 20
+UTF8_FLAG = 0x0800
+READ_CHUNK_BYTES = 1024 * 1024
+
+
+class ZipEntry(BaseModel):
+    name: str
+    path: str
+    size: int
+    mtime: float
+    crc: int
+
+
+class FilePart(BaseModel):
+    path: str
+    length: int
+
+
+# A stored zip is a sequence of headers built in memory and of file contents read from disk
+ZipPart = Union[bytes, FilePart]
+
+
+def file_crc(path: str) -> int:
+    crc = 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(READ_CHUNK_BYTES), b''):
+            crc = zlib.crc32(chunk, crc)
+    return crc
+
+
+def _dos_time(mtime: float) -> Tuple[int, int]:
+    t = time.localtime(mtime)
+    year = min(max(t.tm_year, 1980), 2107)
+    return (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2), ((year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+
+
+def _zip64_extra(*values: int) -> bytes:
+    return struct.pack(f'<HH{len(values)}Q', 0x0001, 8 * len(values), *values) if values else b''
+
+
+def build_layout(entries: List[ZipEntry]) -> List[ZipPart]:
+    """
+    Return the parts of a zip storing `entries` as they are, central directory included.
+
+    The CRC of every entry is known in advance, so the size of the archive is too and any
+    byte range of it can be served without building it.
+    """
+    parts: List[ZipPart] = []
+    central_directory = b''
+    offset = 0
+
+    for entry in entries:
+        name = entry.name.encode('utf-8')
+        dos_time, dos_date = _dos_time(entry.mtime)
+        large_file = entry.size >= ZIP64_LIMIT
+        version = ZIP64_VERSION if large_file or offset >= ZIP64_LIMIT else ZIP_VERSION
+        size_field = ZIP64_MARKER if large_file else entry.size
+
+        # The local header only has room for the sizes
+        local_extra = _zip64_extra(entry.size, entry.size) if large_file else b''
+        local_header = struct.pack(
+            '<IHHHHHIIIHH', 0x04034b50, version, UTF8_FLAG, ZIP_STORED, dos_time, dos_date,
+            entry.crc, size_field, size_field, len(name), len(local_extra)
+        ) + name + local_extra
+        parts += [local_header, FilePart(path=entry.path, length=entry.size)]
+
+        central_values = ([entry.size, entry.size] if large_file else []) + ([offset] if offset >= ZIP64_LIMIT else [])
+        central_extra = _zip64_extra(*central_values)
+        central_directory += struct.pack(
+            '<IHHHHHHIIIHHHHHII', 0x02014b50, (3 << 8) | version, version, UTF8_FLAG, ZIP_STORED, dos_time,
+            dos_date, entry.crc, size_field, size_field, len(name), len(central_extra), 0, 0, 0, 0o100644 << 16,
+            ZIP64_MARKER if offset >= ZIP64_LIMIT else offset
+        ) + name + central_extra
+        offset += len(local_header) + entry.size
+
+    parts.append(central_directory + _end_of_central_directory(len(entries), len(central_directory), offset))
+    return parts
+
+
+def _end_of_central_directory(count: int, size: int, offset: int) -> bytes:
+    end = b''
+    if count >= 0xFFFF or size >= ZIP64_LIMIT or offset >= ZIP64_LIMIT:
+        # ZIP64 end of central directory record and its locator
+        end += struct.pack(
+            '<IQHHIIQQQQ', 0x06064b50, 44, (3 << 8) | ZIP64_VERSION, ZIP64_VERSION, 0, 0, count, count, size, offset
+        )
+        end += struct.pack('<IIQI', 0x07064b50, 0, offset + size, 1)
+        count, size, offset = min(count, 0xFFFF), ZIP64_MARKER, ZIP64_MARKER
+    return end + struct.pack('<IHHHHIIH', 0x06054b50, 0, 0, count, count, size, offset, 0)
+
+
+def layout_size(parts: List[ZipPart]) -> int:
+    return sum(part.length if isinstance(part, FilePart) else len(part) for part in parts)
+
+
+def layout_etag(parts: List[ZipPart]) -> str:
+    """
+    Return a strong ETag of the archive, its central directory holds the names, dates, sizes and CRCs.
+    """
+    central_directory = parts[-1]
+    assert isinstance(central_directory, bytes)
+    return f'"{zlib.crc32(central_directory):08x}-{layout_size(parts):x}"'
+
+
+def iter_range(parts: List[ZipPart], start: int, end: int) -> Iterator[bytes]:
+    """
+    Yield the bytes `start` to `end` (inclusive) of the archive described by `parts`.
+    """
+    position = 0
+    for part in parts:
+        length = part.length if isinstance(part, FilePart) else len(part)
+        part_start, part_end = max(start - position, 0), min(end - position + 1, length)
+        position += length
+        if part_start >= part_end:
+            continue
+
+        if isinstance(part, bytes):
+            yield part[part_start:part_end]
+            continue
+
+        with open(part.path, 'rb') as f:
+            f.seek(part_start)
+            remaining = part_end - part_start
+            while remaining > 0:
+                chunk = f.read(min(READ_CHUNK_BYTES, remaining))
+                if not chunk:
+                    raise OSError(f'{part.path} is shorter than its zip entry')
+                remaining -= len(chunk)
+                yield chunk
+
+
+def parse_range(range_header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Return the inclusive byte range asked by a single range `Range` header, None for the whole file.
+
+    Raise ValueError when the range cannot be satisfied.
+    """
+    if not range_header or not range_header.startswith('bytes=') or ',' in range_header:
+        return None
+
+    first, _, last = range_header[len('bytes='):].strip().partition('-')
+    if not first:
+        # Suffix range, the last bytes of the file
+        if not last.isdigit() or int(last) == 0:
+            raise ValueError(range_header)
+        return max(size - int(last), 0), size - 1
+    if not first.isdigit() or (last and not last.isdigit()):
+        return None
+    if last and int(last) < int(first):
+        # An invalid range is ignored, the whole file is sent
+        return None
+    if int(first) >= size:
+        raise ValueError(range_header)
+    return int(first), min(int(last), size - 1) if last else size - 1
+
+
+def entry_from_file(path: str, name: str, crc: Optional[int] = None) -> ZipEntry:
+    stat = os.stat(path)
+    return ZipEntry(
+        name=name, path=path, size=stat.st_size, mtime=stat.st_mtime, crc=file_crc(path) if crc is None else crc
+    )
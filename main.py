@@ -1,10 +1,14 @@
 from fastapi import FastAPI
 import uvicorn
 
+from app.api.services.job_service import JobService
 from app.api.v1.api import api_v1
 from app.api.v1.metadata import (
     API_GENERAL_TAGS, API_ROUTES_PREFIX
 )
+from app.utils.http_util import close_bbb_session
+from app.utils.scheduler_util import shutdown_download_executor
+from app.utils.transcode_util import shutdown_transcode_pool
 
 # init app...
 app = FastAPI(openapi_tags=[API_GENERAL_TAGS])
@@ -12,5 +16,18 @@ app = FastAPI(openapi_tags=[API_GENERAL_TAGS])
 # mount the versions
 app.mount(API_ROUTES_PREFIX, api_v1)
 
+
+@app.on_event('startup')
+async def startup() -> None:
+    await JobService.recover()
+
+
+@app.on_event('shutdown')
+async def shutdown() -> None:
+    close_bbb_session()
+    shutdown_download_executor()
+    shutdown_transcode_pool()
+
+
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
@@ -1,8 +1,11 @@
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives import serialization
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
 from jose import jwt
 from typing import Any, Dict, Generator, Optional
 import os
+import re
+import threading
 
 from fastapi.testclient import TestClient
 import pytest
@@ -64,3 +67,88 @@ def get_fake_private_key():
             password=current.RSA.PRIVATE_KEY_PASSWORD.encode('utf-8'),
             backend=default_backend()
         )
+
+
+class RangeRequestHandler(SimpleHTTPRequestHandler):
+    """
+    Static file handler with single byte-range support, enough to emulate the BBB presentation server.
+    """
+    requests_log: list = []
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+    def send_head(self):
+        self.requests_log.append((self.command, self.path, self.headers.get('Range')))
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return None
+
+        size = os.path.getsize(path)
+        etag = f'"{size}-{int(os.path.getmtime(path))}"'
+        match = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        if_range = self.headers.get('If-Range')
+        file = open(path, 'rb')
+        if match and (if_range is None or if_range == etag):
+            start = int(match.group(1))
+            end = int(match.group(2)) if match.group(2) else size - 1
+            file.seek(start)
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+            length = end - start + 1
+        else:
+            self.send_response(200)
+            length = size
+        self.send_header('Content-Length', str(length))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', etag)
+        self.end_headers()
+        self._remaining = length
+        return file
+
+    def copyfile(self, source, outputfile):
+        outputfile.write(source.read(self._remaining))
+
+
+@pytest.fixture()
+def range_server(tmp_path) -> Generator:
+    """
+    Serve `tmp_path / 'remote'` over HTTP and yield `(base_url, remote_dir, requests_log)`.
+    """
+    remote_dir = tmp_path / 'remote'
+    remote_dir.mkdir()
+    requests_log: list = []
+    handler = type('Handler', (RangeRequestHandler,), {'requests_log': requests_log})
+    server = ThreadingHTTPServer(
+        ('127.0.0.1', 0), lambda *args: handler(*args, directory=str(remote_dir))  # type: ignore[misc]
+    )
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_address[1]}/', remote_dir, requests_log
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture()
+def make_video(tmp_path):
+    """
+    Factory of small test videos generated by ffmpeg, `make_video(name, width, height, audio=True)`.
+    """
+    from app.utils.ffmpeg_util import run_ffmpeg
+
+    def make(
+            name: str, width: int, height: int, audio: bool = True, duration: float = 2, fps: int = 15, gop: int = 0
+    ) -> str:
+        path = str(tmp_path / name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        args = ['-f', 'lavfi', '-i', f'testsrc=size={width}x{height}:rate={fps}:duration={duration}']
+        if audio:
+            args += ['-f', 'lavfi', '-i', f'sine=frequency=440:duration={duration}']
+        args += ['-c:v', 'libx264', '-pix_fmt', 'yuv444p', '-preset', 'ultrafast']
+        args += ['-c:a', 'aac'] if audio else []
+        args += ['-g', str(gop)] if gop else []
+        run_ffmpeg(args + [path])
+        return path
+
+    return make
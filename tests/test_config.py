@@ -1,8 +1,12 @@
 import os
 import re
 from pathlib import Path
+from unittest.mock import patch
 
-from app.config import current
+from pydantic import ValidationError
+import pytest
+
+from app.config import BBBSettings, current
 
 
 def test_get_version():
@@ -47,3 +51,11 @@ def test_current_config():
     assert current.EMAIL.SMTP_PORT == int(os.getenv('EMAIL_SMTP_PORT'))
     assert current.EMAIL.SENDER_EMAIL == os.getenv('EMAIL_SENDER_EMAIL')
     assert current.EMAIL.SENDER_PASSWORD == os.getenv('EMAIL_SENDER_PASSWORD')
+
+
+def test_archive_mode_is_validated():
+    with patch.dict(os.environ, {'BBB_ARCHIVE_MODE': 'deflated'}):
+        assert BBBSettings().ARCHIVE_MODE == 'deflated'
+    # A typo would skip the archive while the emails link it
+    with patch.dict(os.environ, {'BBB_ARCHIVE_MODE': 'store'}), pytest.raises(ValidationError):
+        BBBSettings()
@@ -1,10 +1,39 @@
+import asyncio
+import io
+import json
 import pytest
 from unittest.mock import patch
+from requests import exceptions, Response
+import os
+import threading
+import time
+import zipfile
+import zlib
 
+from app.api.resources.player.html_components import hls_player_page
+from app.config import current
 from app.exceptions import ApiException
+from app.utils import cache_util
+from app.utils.ffmpeg_util import detect_idle, keyframe_times, probe_media, run_ffmpeg, segment_boundaries
+from app.utils.download_util import build_segments, fetch_file, is_modified
+from app.utils.flight_util import SingleFlight
+from app.utils.http_util import close_bbb_session, get_bbb_session
+from app.utils.metrics_util import Histogram, TransferStats
+from app.utils.mp4_util import keyframe_index
+from app.utils.output_cache_util import accepted_keys, output_key
+from app.utils.presentation_util import build_manifest
+from app.utils.progress_util import current_listener, progress_listener, report_progress
+from app.utils.scheduler_util import DownloadScheduler, TokenBucket, run_download
+from app.utils.transcode_util import choose_encoding_profile, encode_job, run_transcode, transcode_backlog
 from app.utils.recording_util import get_full_folder_path
-from app.utils.file_util import create_folder
+from app.utils.file_util import (
+    _detect_deskshare_idle, _refresh_cached_files, archive_entries, combine, combine_videos, create_folder,
+    download_files, download_presentation_files, encode_side_by_side, extract_audio, finalize_output,
+    keyframe_index_path, load_bbb_metadata, locate_audio_source, output_is_current, recording_outputs,
+    segmented_combine, write_bbb_metadata
+)
 from app.utils.rsa_util import decrypt, encrypt
+from app.utils.zip_util import build_layout, entry_from_file, iter_range, layout_size, parse_range
 
 
 @pytest.mark.asyncio
@@ -137,3 +166,811 @@ async def test_rsa_decrypt_message_fail_incorrect_message(_get_private_key_mock,
     assert ex.value.message == 'Bad Request. Decrypt process failed'
     assert ex.value.type == 'ErrorResponse'
     assert ex.value.subtype == 'rsa:decrypt-process-fail'
+
+
+@pytest.mark.asyncio
+@patch('app.utils.file_util.fetch_file')
+async def test_download_files_deskshare_404(fetch_file_mock, tmp_path):
+    def fetch_file(download_url, *args):
+        if download_url.endswith('deskshare/deskshare.mp4'):
+            response = Response()
+            response.status_code = 404
+            raise exceptions.HTTPError(response=response)
+
+    fetch_file_mock.side_effect = fetch_file
+
+    bbb_info, combine_boolean = await download_files('https://bbb.example.com/', str(tmp_path), {})
+
+    assert combine_boolean is False
+    assert fetch_file_mock.call_count == 3
+    assert bbb_info['downloadedFiles'] == {
+        'metadata.xml': True, 'video/webcams.mp4': True, 'deskshare/deskshare.mp4': False
+    }
+
+
+@pytest.mark.parametrize('size, segments', [
+    (0, [[0, -1, 0]]),
+    (10, [[0, 9, 0]]),
+    (100, [[0, 24, 0], [25, 49, 0], [50, 74, 0], [75, 99, 0]]),
+    (50, [[0, 24, 0], [25, 49, 0]]),
+])
+def test_build_segments(size, segments):
+    with patch.object(current.BBB, 'DOWNLOAD_SEGMENT_MIN_BYTES', 20), \
+            patch.object(current.BBB, 'DOWNLOAD_SEGMENTS', 4):
+        assert build_segments(size) == segments
+
+
+def test_fetch_file_resumes_partial_download(range_server, tmp_path):
+    base_url, remote_dir, requests_log = range_server
+    content = bytes(range(256)) * 40
+    (remote_dir / 'webcams.mp4').write_bytes(content)
+    save_path = str(tmp_path / 'webcams.mp4')
+
+    with patch.object(current.BBB, 'DOWNLOAD_SEGMENT_MIN_BYTES', 4096), \
+            patch.object(current.BBB, 'DOWNLOAD_SEGMENTS', 2):
+        state: dict = {}
+        # First run stops after the first segment was fetched
+        with patch('app.utils.download_util._download_pending_segments', side_effect=RuntimeError('killed')):
+            with pytest.raises(RuntimeError):
+                fetch_file(base_url + 'webcams.mp4', save_path, state, lambda: None, threading.RLock())
+        with open(save_path + '.part', 'r+b') as part_file:
+            part_file.write(content[:5120])
+        state['segments'][0][2] = 5120
+
+        requests_log.clear()
+        stats = TransferStats()
+        fetch_file(base_url + 'webcams.mp4', save_path, state, lambda: None, threading.RLock(), 'job', stats)
+        stats.finish('ok')
+
+    with open(save_path, 'rb') as f:
+        assert f.read() == content
+    assert state['complete'] is True
+    assert stats.as_dict()['bytes'] == 5120
+    assert stats.ttfb is not None
+    assert ('GET', '/webcams.mp4', 'bytes=5120-10239') in requests_log
+    assert not any(log[2] and log[2].startswith('bytes=0-') for log in requests_log)
+
+
+def test_get_bbb_session_is_shared():
+    close_bbb_session()
+    session = get_bbb_session()
+
+    assert get_bbb_session() is session
+    adapter = session.get_adapter('https://bbb-server.example.com/')
+    assert adapter._pool_maxsize == current.BBB.HTTP_POOL_MAXSIZE  # type: ignore[attr-defined]
+    assert adapter._pool_block is True  # type: ignore[attr-defined]
+
+    close_bbb_session()
+    assert get_bbb_session() is not session
+
+
+@pytest.mark.asyncio
+async def test_single_flight_shares_in_flight_call():
+    single_flight = SingleFlight()
+    calls = []
+
+    async def job():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return 'meeting-folder'
+
+    results = await asyncio.gather(*[single_flight.do('meeting-id', job) for _ in range(5)])
+
+    assert results == ['meeting-folder'] * 5
+    assert len(calls) == 1
+    assert single_flight.in_flight() == set()
+
+    # Once finished, the next caller starts a new job
+    assert await single_flight.do('meeting-id', job) == 'meeting-folder'
+    assert len(calls) == 2
+
+
+@pytest.mark.asyncio
+async def test_single_flight_reports_progress_to_every_caller():
+    single_flight = SingleFlight()
+    reports: dict = {'first': [], 'second': []}
+
+    async def job():
+        report_progress('downloading')
+        await asyncio.sleep(0.02)
+        report_progress('combining', 0.5)
+
+    async def caller(name: str, delay: float):
+        await asyncio.sleep(delay)
+        with progress_listener(lambda stage, progress: reports[name].append((stage, progress))):
+            await single_flight.do('meeting-id', job)
+
+    await asyncio.gather(caller('first', 0), caller('second', 0.01))
+
+    # The caller joining late gets the stage reached so far first
+    assert reports['first'] == reports['second'] == [('downloading', None), ('combining', 0.5)]
+
+
+@pytest.mark.asyncio
+async def test_single_flight_propagates_exception():
+    single_flight = SingleFlight()
+
+    async def job():
+        await asyncio.sleep(0.01)
+        raise ApiException(404)
+
+    results = await asyncio.gather(
+        single_flight.do('meeting-id', job), single_flight.do('meeting-id', job), return_exceptions=True
+    )
+
+    assert all(isinstance(result, ApiException) and result.code == 404 for result in results)
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    with patch.object(current, 'BASE_DIR', str(tmp_path)), \
+            patch.object(current.BBB, 'CACHE_MAX_BYTES', 250), \
+            patch.object(current.BBB, 'CACHE_MIN_FREE_BYTES', 0):
+        meetings_dir = tmp_path / current.BBB.DOWNLOADED_MEETINGS_FOLDER
+        for meeting_id in ['in-flight', 'least-recent', 'most-recent']:
+            (meetings_dir / f'{meeting_id}-folder').mkdir(parents=True)
+            (meetings_dir / f'{meeting_id}-folder' / 'video.mp4').write_bytes(b'0' * 100)
+            cache_util.touch(meeting_id, f'{meeting_id}-folder')
+
+        assert cache_util.get_cached_folder('least-recent') == 'least-recent-folder'
+
+        # in-flight is the oldest entry but it is protected
+        evicted = cache_util.evict(protected={'in-flight'})
+
+        assert evicted == ['least-recent']
+        assert not (meetings_dir / 'least-recent-folder').exists()
+        assert cache_util.get_cached_folder('least-recent') is None
+        assert set(cache_util.load_index()) == {'in-flight', 'most-recent'}
+
+
+def test_is_modified(range_server, tmp_path):
+    base_url, remote_dir, _ = range_server
+    (remote_dir / 'metadata.xml').write_bytes(b'<recording/>')
+    state: dict = {}
+    fetch_file(base_url + 'metadata.xml', str(tmp_path / 'metadata.xml'), state, lambda: None, threading.RLock())
+    validators = {'etag': state['etag'], 'last_modified': state['last_modified'], 'size': state['size']}
+
+    assert is_modified(base_url + 'metadata.xml', validators) is False
+    # A file missing on the first download that now exists
+    assert is_modified(base_url + 'metadata.xml', {}) is True
+    # A file the server does not have (anymore)
+    assert is_modified(base_url + 'deskshare.mp4', {}) is False
+
+    (remote_dir / 'metadata.xml').write_bytes(b'<recording republished="true"/>')
+    assert is_modified(base_url + 'metadata.xml', validators) is True
+
+
+@pytest.mark.asyncio
+async def test_refresh_cached_files_fetches_only_changed_files(range_server, tmp_path):
+    base_url, remote_dir, requests_log = range_server
+    for file in ['metadata.xml', 'video/webcams.mp4', 'deskshare/deskshare.mp4']:
+        (remote_dir / file).parent.mkdir(exist_ok=True)
+        (remote_dir / file).write_bytes(b'first-version')
+    meeting_dir = tmp_path / 'meeting'
+    for folder in ['video', 'deskshare']:
+        (meeting_dir / folder).mkdir(parents=True)
+    with patch.object(current.BBB, 'STREAM_COMBINE', False):
+        await download_files(base_url, str(meeting_dir), {})
+
+    def fetched() -> list:
+        return sorted({path for command, path, _ in requests_log if command == 'GET'})
+
+    # Nothing changed on the server, nothing is fetched nor built again
+    requests_log.clear()
+    assert await _refresh_cached_files(base_url, str(meeting_dir)) == (True, None)
+    assert fetched() == []
+
+    # A new metadata.xml is fetched, the combined video stays
+    (remote_dir / 'metadata.xml').write_bytes(b'<recording republished="true"/>')
+    requests_log.clear()
+    assert await _refresh_cached_files(base_url, str(meeting_dir)) == (True, None)
+    assert fetched() == ['/metadata.xml']
+    assert (meeting_dir / 'metadata.xml').read_bytes() == b'<recording republished="true"/>'
+
+    # A new webcams.mp4 is fetched and the output has to be combined again
+    (remote_dir / 'video/webcams.mp4').write_bytes(b'second-version')
+    requests_log.clear()
+    assert await _refresh_cached_files(base_url, str(meeting_dir)) == (False, True)
+    assert fetched() == ['/video/webcams.mp4']
+    assert (meeting_dir / 'video/webcams.mp4').read_bytes() == b'second-version'
+    assert (meeting_dir / 'deskshare/deskshare.mp4').read_bytes() == b'first-version'
+
+
+@pytest.mark.asyncio
+async def test_refresh_cached_files_streams_changed_video_instead_of_stale_copy(range_server, tmp_path):
+    base_url, remote_dir, _ = range_server
+    for file in ['metadata.xml', 'video/webcams.mp4', 'deskshare/deskshare.mp4']:
+        (remote_dir / file).parent.mkdir(exist_ok=True)
+        (remote_dir / file).write_bytes(b'first-version')
+    meeting_dir = tmp_path / 'meeting'
+    for folder in ['video', 'deskshare']:
+        (meeting_dir / folder).mkdir(parents=True)
+    with patch.object(current.BBB, 'STREAM_COMBINE', False):
+        await download_files(base_url, str(meeting_dir), {})
+
+    (remote_dir / 'video/webcams.mp4').write_bytes(b'second-version')
+    with patch.object(current.BBB, 'STREAM_COMBINE', True):
+        assert await _refresh_cached_files(base_url, str(meeting_dir)) == (False, True)
+
+    # The encoder reads the new webcams from the server, not the copy of the first version
+    assert not (meeting_dir / 'video/webcams.mp4').exists()
+    bbb_info = load_bbb_metadata(str(meeting_dir))
+    assert bbb_info['streamSources']['video/webcams.mp4'] == base_url + 'video/webcams.mp4'
+    assert bbb_info['fileValidators']['video/webcams.mp4']['size'] == len(b'second-version')
+
+
+def test_download_scheduler_round_robin_between_jobs():
+    scheduler = DownloadScheduler(max_transfers=1, max_transfers_per_origin=1, bandwidth_per_origin=0)
+    url = 'https://bbb-server.example.com/presentation/'
+    order = []
+
+    # job-a holds the only slot while job-a and job-b queue up behind it
+    origin = scheduler.acquire('job-a', url)
+    threads = []
+    for job_id, file in [('job-a', 'a1'), ('job-a', 'a2'), ('job-a', 'a3'), ('job-b', 'b1')]:
+        def transfer(job_id=job_id, file=file):
+            with scheduler.transfer(job_id, url + file):
+                order.append(file)
+        thread = threading.Thread(target=transfer)
+        thread.start()
+        threads.append(thread)
+        while sum(len(queue) for queue in scheduler._queues.values()) < len(threads):
+            time.sleep(0.001)
+
+    scheduler.release(origin)
+    for thread in threads:
+        thread.join(timeout=5)
+
+    assert order == ['a1', 'b1', 'a2', 'a3']
+    assert scheduler.active_transfers == 0
+
+
+@pytest.mark.asyncio
+async def test_run_download_keeps_transfers_out_of_the_default_executor():
+    # Transfers waiting for a slot must not hold up the threads of asyncio.to_thread
+    assert (await run_download(lambda: threading.current_thread().name)).startswith('download')
+    with progress_listener(lambda stage, progress: None):
+        assert await run_download(current_listener) is not None
+
+
+def test_token_bucket_limits_rate():
+    bucket = TokenBucket(rate=1000)
+    start = time.monotonic()
+    bucket.consume(1000)
+    bucket.consume(500)
+
+    # The first second is burst, the next 500 bytes have to wait for half a second
+    assert time.monotonic() - start >= 0.45
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('has_deskshare', [True, False])
+async def test_download_files_stream_combine(range_server, tmp_path, has_deskshare):
+    base_url, remote_dir, _ = range_server
+    for file in ['metadata.xml', 'video/webcams.mp4'] + (['deskshare/deskshare.mp4'] if has_deskshare else []):
+        (remote_dir / file).parent.mkdir(exist_ok=True)
+        (remote_dir / file).write_bytes(b'fake-content')
+    meeting_dir = tmp_path / 'meeting'
+    for folder in ['video', 'deskshare']:
+        (meeting_dir / folder).mkdir(parents=True)
+
+    with patch.object(current.BBB, 'STREAM_COMBINE', True):
+        bbb_info, combine_boolean = await download_files(base_url, str(meeting_dir), {})
+
+    assert combine_boolean is has_deskshare
+    assert (meeting_dir / 'metadata.xml').is_file()
+    assert not (meeting_dir / 'deskshare/deskshare.mp4').exists()
+    if has_deskshare:
+        # Both videos are left on the server for the encoder to read
+        assert not (meeting_dir / 'video/webcams.mp4').exists()
+        assert bbb_info['streamSources'] == {
+            'video/webcams.mp4': base_url + 'video/webcams.mp4',
+            'deskshare/deskshare.mp4': base_url + 'deskshare/deskshare.mp4',
+        }
+    else:
+        # Without deskshare webcams.mp4 becomes the output, so it is downloaded
+        assert (meeting_dir / 'video/webcams.mp4').read_bytes() == b'fake-content'
+        assert 'streamSources' not in bbb_info
+
+
+MEETING_ID = '0123456789abcdef0123456789abcdef01234567-1700000000000'
+SHAPES_SVG = """<svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink">
+<image id="image1" xlink:href="presentation/deskshare.png"/>
+<image id="image2" xlink:href="presentation/d2b1/slide-1.png"/>
+<image id="image3" xlink:href="presentation/d2b1/slide-2.png"/>
+<image id="image4" xlink:href="presentation/d2b1/slide-1.png"/>
+<image id="image5" xlink:href="../../etc/passwd"/>
+</svg>"""
+METADATA_XML = f"""<recording><playback><extensions><preview><images>
+<image>https://bbb.example.com/presentation/{MEETING_ID}/presentation/d2b1/thumbnails/thumb-1.png</image>
+</images></preview></extensions></playback></recording>"""
+
+
+def test_build_manifest(tmp_path):
+    (tmp_path / 'shapes.svg').write_text(SHAPES_SVG)
+    (tmp_path / 'metadata.xml').write_text(METADATA_XML)
+    (tmp_path / 'captions.json').write_text('[{"locale": "es", "localeName": "Spanish"}]')
+
+    assert build_manifest(str(tmp_path), MEETING_ID) == [
+        'presentation/deskshare.png',
+        'presentation/d2b1/slide-1.png',
+        'presentation/d2b1/slide-2.png',
+        'presentation/d2b1/thumbnails/thumb-1.png',
+        'caption_es.vtt',
+    ]
+
+
+@pytest.mark.asyncio
+async def test_download_presentation_files(range_server, tmp_path):
+    base_url, remote_dir, _ = range_server
+    (remote_dir / 'shapes.svg').write_text(SHAPES_SVG)
+    (remote_dir / 'cursor.xml').write_text('<recording/>')
+    (remote_dir / 'presentation/d2b1').mkdir(parents=True)
+    for slide in ['slide-1.png', 'slide-2.png']:
+        (remote_dir / 'presentation/d2b1' / slide).write_bytes(b'png')
+    meeting_dir = tmp_path / 'meeting'
+    meeting_dir.mkdir()
+
+    bbb_info: dict = {'meeting_id': MEETING_ID}
+    await download_presentation_files(base_url, str(meeting_dir), bbb_info)
+
+    assert (meeting_dir / 'presentation/d2b1/slide-2.png').read_bytes() == b'png'
+    assert bbb_info['presentationFiles']['cursor.xml'] is True
+    assert bbb_info['presentationFiles']['presentation/d2b1/slide-1.png'] is True
+    assert bbb_info['presentationFiles']['panzooms.xml'] is False
+    assert bbb_info['presentationFiles']['presentation/deskshare.png'] is False
+    assert bbb_info['transferStats']['presentation']['retries'] == 0
+
+
+@pytest.mark.asyncio
+async def test_download_presentation_files_counts_failures(tmp_path):
+    bbb_info: dict = {'meeting_id': MEETING_ID}
+    with patch('app.utils.file_util.fetch_asset', side_effect=exceptions.ConnectionError('refused')):
+        await download_presentation_files('https://bbb.example.com/', str(tmp_path), bbb_info)
+
+    stats = bbb_info['transferStats']['presentation']
+    assert stats['failures'] > 0
+    assert stats['retries'] == 0
+
+
+@pytest.mark.asyncio
+async def test_streamed_sources_are_encoded_in_one_read(tmp_path):
+    deskshare, webcams = 'https://bbb.example.com/deskshare.mp4', 'https://bbb.example.com/webcams.mp4'
+
+    with patch('app.utils.file_util.run_transcode') as run_transcode_mock:
+        assert await _detect_deskshare_idle(str(tmp_path), deskshare) is None
+        await encode_side_by_side(deskshare, webcams, str(tmp_path / 'out.mp4'), {})
+
+    # Neither the idle analysis nor the segment plan read the sources before the encode
+    assert [call.args[0] for call in run_transcode_mock.call_args_list] == [combine_videos]
+
+
+def test_hls_player_page_escapes_names():
+    page = hls_player_page('<script>alert(1)</script>-12345', "x';alert(1)//</script>.m3u8", 'https://cdn/hls.js')
+
+    assert '<script>alert' not in page
+    assert '&lt;script&gt;alert(1)&lt;/script&gt;-12345' in page
+    assert 'hls.loadSource("x\';alert(1)//\\u003c/script>.m3u8");' in page
+
+
+def test_histogram_is_cumulative():
+    histogram = Histogram([1, 5])
+    for value in [0.5, 1, 3, 10]:
+        histogram.observe(value)
+
+    assert histogram.as_dict() == {'buckets': {'1': 2, '5': 3, '+Inf': 4}, 'count': 4, 'sum': 14.5}
+
+
+def test_combine_videos_side_by_side(make_video, tmp_path):
+    deskshare = make_video('deskshare/deskshare.mp4', 320, 180, audio=False)
+    webcams = make_video('video/webcams.mp4', 161, 121)
+    output = str(tmp_path / 'combined.mp4')
+
+    with patch.object(current.BBB, 'COMBINE_ENGINE', 'ffmpeg'), \
+            patch('app.utils.file_util.moviepy_combine') as moviepy_combine_mock:
+        combine_videos(deskshare, webcams, output)
+
+    moviepy_combine_mock.assert_not_called()
+    combined = probe_media(output)
+    # Both videos next to each other, as high as the tallest one, rounded up to even sizes
+    assert (combined['width'], combined['height']) == (482, 180)
+    assert combined['audio_codec'] == 'aac'
+    assert combined['duration'] == pytest.approx(2, abs=0.2)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('video_format', ['mp4', 'mkv'])
+async def test_combine_webcams_only_is_remuxed(make_video, tmp_path, video_format):
+    make_video(f'{current.BBB.DOWNLOADED_MEETINGS_FOLDER}/my-meeting-12345/video/webcams.mp4', 160, 120)
+    meeting_dir = tmp_path / current.BBB.DOWNLOADED_MEETINGS_FOLDER / 'my-meeting-12345'
+
+    with patch.object(current, 'BASE_DIR', str(tmp_path)), \
+            patch.object(current.BBB, 'COMBINED_VIDEO_FORMAT', video_format), \
+            patch.object(current.BBB, 'ARCHIVE_MODE', 'stored'):
+        # The remux and the zip run in the transcoding pool
+        await combine('my-meeting-12345', False)
+
+    output = probe_media(str(meeting_dir / f'my-meeting-12345.{video_format}'))
+    assert (output['width'], output['height'], output['video_codec']) == (160, 120, 'h264')
+    assert output['audio_codec'] == 'aac'
+    # The streams are copied, an encode would have gone to yuv420p
+    assert output['pix_fmt'] == 'yuv444p'
+    # The playback still has its webcams
+    assert (meeting_dir / 'video/webcams.mp4').is_file()
+    with zipfile.ZipFile(meeting_dir / 'my-meeting-12345.zip') as zipf:
+        # Stored as is, deflating the video would not make it any smaller
+        assert [(info.filename, info.compress_type) for info in zipf.infolist()] == [
+            (f'my-meeting-12345.{video_format}', zipfile.ZIP_STORED)
+        ]
+    assert load_bbb_metadata(str(meeting_dir))['encodingProfile'] == {'name': 'copy'}
+    # Only the mp4 gets a keyframe index
+    assert (meeting_dir / 'my-meeting-12345.keyframes.json').is_file() == (video_format == 'mp4')
+    # Packaged for the browser as well
+    playlist = (meeting_dir / 'hls/playlist.m3u8').read_text()
+    assert '#EXT-X-MAP:URI="init.mp4"' in playlist and 'segment_00000.m4s' in playlist
+    assert 'playlist.m3u8' in (meeting_dir / 'hls/index.html').read_text()
+
+
+@pytest.mark.asyncio
+async def test_run_transcode_runs_in_another_process():
+    assert await run_transcode(os.getpid) != os.getpid()
+
+
+@pytest.mark.parametrize('backlog, forced, profile_name', [
+    (0, '', 'quality'),
+    (3, '', 'balanced'),
+    (10, '', 'fast'),
+    (10, 'quality', 'quality'),
+])
+def test_choose_encoding_profile(backlog, forced, profile_name):
+    with patch('app.utils.transcode_util._backlog', backlog), \
+            patch.object(current.BBB, 'ENCODING_PROFILE', forced):
+        name, profile = choose_encoding_profile()
+
+    assert name == profile_name
+    assert profile == current.BBB.ENCODING_PROFILES[profile_name].model_dump()
+
+
+@pytest.mark.asyncio
+async def test_transcode_backlog_counts_encodes_only():
+    # The tasks of the pool, like the probes of a job, do not count
+    task = asyncio.ensure_future(run_transcode(time.sleep, 0.2))
+    await asyncio.sleep(0.05)
+    assert transcode_backlog() == 0
+    await task
+
+    with encode_job():
+        assert transcode_backlog() == 1
+        assert choose_encoding_profile()[0] == 'quality'
+    assert transcode_backlog() == 0
+
+
+@pytest.mark.asyncio
+async def test_combine_records_encoding_profile(make_video, tmp_path):
+    meeting_dir = tmp_path / current.BBB.DOWNLOADED_MEETINGS_FOLDER / 'my-meeting-12345'
+    make_video(f'{meeting_dir}/deskshare/deskshare.mp4', 320, 180, audio=False)
+    make_video(f'{meeting_dir}/video/webcams.mp4', 160, 120)
+
+    with patch.object(current, 'BASE_DIR', str(tmp_path)):
+        await combine('my-meeting-12345', True)
+
+    assert probe_media(str(meeting_dir / 'my-meeting-12345.mp4'))['width'] == 480
+    assert load_bbb_metadata(str(meeting_dir))['encodingProfile'] == {
+        'name': 'quality', 'preset': 'medium', 'crf': 23, 'maxrate_kbps': 0, 'threads': 0
+    }
+
+
+@pytest.mark.parametrize('keyframes, segments', [
+    ([0, 4, 9, 12, 18], [(0, 9), (9, 11)]),
+    ([0, 10, 19], [(0, 10), (10, 10)]),
+    ([0], [(0, 20)]),
+])
+def test_segment_boundaries(keyframes, segments):
+    assert segment_boundaries(keyframes, 20, 8) == segments
+
+
+@pytest.mark.asyncio
+async def test_segmented_combine(make_video, tmp_path):
+    deskshare = make_video('deskshare/deskshare.mp4', 320, 180, audio=False, duration=6, gop=15)
+    webcams = make_video('video/webcams.mp4', 160, 120, duration=6)
+    output = str(tmp_path / 'combined.mp4')
+
+    with patch.object(current.BBB, 'ENCODE_SEGMENT_SECONDS', 2), \
+            patch('app.utils.file_util.run_transcode', wraps=run_transcode) as run_transcode_mock:
+        await segmented_combine(deskshare, webcams, output, current.BBB.ENCODING_PROFILES['fast'].model_dump())
+
+    functions = [call.args[0].__name__ for call in run_transcode_mock.call_args_list]
+    assert functions.count('combine_segment') == 3
+    combined = probe_media(output)
+    assert (combined['width'], combined['height'], combined['audio_codec']) == (480, 180, 'aac')
+    assert combined['duration'] == pytest.approx(6, abs=0.2)
+    assert not os.path.exists(output + '.segments')
+
+
+@pytest.mark.asyncio
+async def test_segmented_combine_resumes_after_crash(make_video, tmp_path):
+    deskshare = make_video('deskshare/deskshare.mp4', 320, 180, audio=False, duration=6, gop=15)
+    webcams = make_video('video/webcams.mp4', 160, 120, duration=6)
+    output = str(tmp_path / 'combined.mp4')
+    profile = current.BBB.ENCODING_PROFILES['fast'].model_dump()
+
+    async def crash_on_concat(fn, *args):
+        if fn.__name__ == 'concat_segments':
+            raise RuntimeError('worker restarted')
+        return await run_transcode(fn, *args)
+
+    with patch.object(current.BBB, 'ENCODE_SEGMENT_SECONDS', 2):
+        with patch('app.utils.file_util.run_transcode', side_effect=crash_on_concat), \
+                pytest.raises(RuntimeError):
+            await segmented_combine(deskshare, webcams, output, profile)
+
+        progress = load_bbb_metadata(str(tmp_path))['combineProgress']
+        assert (progress['output'], progress['total'], progress['segments'], progress['audio']) == \
+            ('combined.mp4', 3, [0, 1, 2], True)
+
+        with patch('app.utils.file_util.run_transcode', wraps=run_transcode) as run_transcode_mock:
+            await segmented_combine(deskshare, webcams, output, profile)
+
+    # Only the joint is left to do
+    functions = [call.args[0].__name__ for call in run_transcode_mock.call_args_list]
+    assert functions == ['plan_segments', 'concat_segments']
+    assert probe_media(output)['duration'] == pytest.approx(6, abs=0.2)
+    assert 'combineProgress' not in load_bbb_metadata(str(tmp_path))
+    assert not os.path.exists(output + '.segments')
+
+
+@pytest.fixture()
+def idle_deskshare(tmp_path):
+    """
+    Deskshare black for 4 s, moving for 3 s, then frozen on red for 4 s.
+    """
+    path = str(tmp_path / 'deskshare/deskshare.mp4')
+    os.makedirs(os.path.dirname(path))
+    run_ffmpeg([
+        '-f', 'lavfi', '-i', 'color=black:s=320x180:r=15:d=4', '-f', 'lavfi', '-i', 'testsrc=s=320x180:r=15:d=3',
+        '-f', 'lavfi', '-i', 'color=red:s=320x180:r=15:d=4',
+        '-filter_complex', '[0:v][1:v][2:v]concat=n=3,format=yuv420p[v]', '-map', '[v]', '-c:v', 'libx264', path
+    ])
+    return path
+
+
+def test_detect_idle(idle_deskshare):
+    timeline = detect_idle(idle_deskshare, 2)
+
+    assert timeline['duration'] == pytest.approx(11, abs=0.1)
+    assert [[round(start), round(end)] for start, end in timeline['intervals']] == [[0, 4], [7, 11]]
+
+
+def test_combine_videos_holds_idle_deskshare(idle_deskshare, make_video, tmp_path):
+    webcams = make_video('video/webcams.mp4', 160, 120, duration=11)
+    output = str(tmp_path / 'combined.mp4')
+    deskshare_idle = {'intervals': [[0, 4], [7, 11]], 'frame_seconds': 5}
+
+    combine_videos(idle_deskshare, webcams, output, None, deskshare_idle)
+
+    combined = probe_media(output)
+    assert (combined['width'], combined['height']) == (480, 180)
+    assert combined['duration'] == pytest.approx(11, abs=0.2)
+
+
+@pytest.mark.asyncio
+async def test_combine_idle_deskshare_uses_webcams_only(idle_deskshare, make_video, tmp_path):
+    meeting_dir = tmp_path / current.BBB.DOWNLOADED_MEETINGS_FOLDER / 'my-meeting-12345'
+    os.makedirs(meeting_dir / 'deskshare')
+    os.replace(idle_deskshare, meeting_dir / 'deskshare/deskshare.mp4')
+    make_video(f'{meeting_dir}/video/webcams.mp4', 160, 120, duration=11)
+
+    with patch.object(current, 'BASE_DIR', str(tmp_path)), \
+            patch.object(current.BBB, 'IDLE_MIN_SECONDS', 2), \
+            patch.object(current.BBB, 'IDLE_WEBCAMS_ONLY_RATIO', 0.7):
+        await combine('my-meeting-12345', True)
+
+    assert probe_media(str(meeting_dir / 'my-meeting-12345.mp4'))['width'] == 160
+    bbb_info = load_bbb_metadata(str(meeting_dir))
+    assert bbb_info['deskshareIdle']['ratio'] == pytest.approx(8 / 11, abs=0.05)
+    assert bbb_info['encodingProfile'] == {'name': 'copy'}
+
+
+@pytest.mark.asyncio
+async def test_extract_audio_copies_the_webcams_audio(make_video, tmp_path):
+    meeting_dir = tmp_path / current.BBB.DOWNLOADED_MEETINGS_FOLDER / 'my-meeting-12345'
+    make_video(f'{meeting_dir}/video/webcams.mp4', 160, 120)
+
+    with patch.object(current, 'BASE_DIR', str(tmp_path)):
+        audio_file = await extract_audio('my-meeting-12345')
+
+    assert audio_file == 'my-meeting-12345.m4a'
+    log = run_ffmpeg(['-i', str(meeting_dir / audio_file), '-f', 'null', '-'])
+    assert 'Audio: aac' in log and 'Video:' not in log
+
+
+@pytest.mark.asyncio
+async def test_extract_audio_reads_only_the_remote_webcams(range_server, make_video, tmp_path):
+    base_url, remote_dir, requests_log = range_server
+    make_video(f'remote/presentation/{MEETING_ID}/video/webcams.mp4', 160, 120)
+    (remote_dir / f'presentation/{MEETING_ID}/metadata.xml').write_text(METADATA_XML)
+    url = f'http://bbb.example.com/playback/presentation/2.3/{MEETING_ID}'
+
+    with patch.object(current, 'BASE_DIR', str(tmp_path)), \
+            patch.object(current.BBB, 'SERVER', base_url.split('/')[2]):
+        folder_name, webcams_source = await locate_audio_source(url, 'my-meeting')
+        audio_file = await extract_audio(folder_name, webcams_source)
+
+    assert webcams_source == f'{base_url}presentation/{MEETING_ID}/video/webcams.mp4'
+    assert (tmp_path / current.BBB.DOWNLOADED_MEETINGS_FOLDER / folder_name / audio_file).is_file()
+    assert (tmp_path / current.BBB.DOWNLOADED_MEETINGS_FOLDER / folder_name / 'metadata.xml').is_file()
+    # Neither the deskshare nor the presentation were downloaded
+    assert {path for _, path, _ in requests_log} == {
+        f'/presentation/{MEETING_ID}/metadata.xml', f'/presentation/{MEETING_ID}/video/webcams.mp4'
+    }
+
+
+@pytest.mark.asyncio
+async def test_extract_audio_without_audio_404(make_video, tmp_path):
+    make_video(f'{current.BBB.DOWNLOADED_MEETINGS_FOLDER}/my-meeting-12345/video/webcams.mp4', 160, 120, audio=False)
+
+    with patch.object(current, 'BASE_DIR', str(tmp_path)), pytest.raises(ApiException) as ex:
+        await extract_audio('my-meeting-12345')
+
+    assert ex.value.code == 404  # pylint: disable=E1101
+
+
+@pytest.mark.asyncio
+async def test_combine_without_archive(make_video, tmp_path):
+    meeting_dir = tmp_path / current.BBB.DOWNLOADED_MEETINGS_FOLDER / 'my-meeting-12345'
+    make_video(f'{meeting_dir}/video/webcams.mp4', 160, 120)
+
+    with patch.object(current, 'BASE_DIR', str(tmp_path)), \
+            patch.object(current.BBB, 'ARCHIVE_MODE', 'none'), \
+            patch.object(current.BBB, 'HLS_ENABLED', False):
+        await combine('my-meeting-12345', False)
+        assert recording_outputs('my-meeting-12345') == [str(meeting_dir / 'my-meeting-12345.mp4')]
+
+    assert sorted(os.listdir(meeting_dir)) == [
+        current.BBB.METADATA_FILENAME, 'my-meeting-12345.keyframes.json', 'my-meeting-12345.mp4', 'video'
+    ]
+
+
+@pytest.mark.parametrize('zip64_limit', [0xFFFFFFFF, 100])
+def test_streamed_zip_is_valid(tmp_path, zip64_limit):
+    (tmp_path / 'recording.mp4').write_bytes(os.urandom(3000))
+    (tmp_path / 'notes.txt').write_text('Notas de la reunión')
+    entries = [
+        entry_from_file(str(tmp_path / 'recording.mp4'), 'recording.mp4'),
+        entry_from_file(str(tmp_path / 'notes.txt'), 'notas/reunión.txt'),
+    ]
+
+    # A low limit writes the ZIP64 fields of the recordings over 4 GiB
+    with patch('app.utils.zip_util.ZIP64_LIMIT', zip64_limit):
+        parts = build_layout(entries)
+    archive = b''.join(iter_range(parts, 0, layout_size(parts) - 1))
+
+    assert len(archive) == layout_size(parts)
+    with zipfile.ZipFile(io.BytesIO(archive)) as zipf:
+        assert zipf.testzip() is None
+        assert [(info.filename, info.compress_type) for info in zipf.infolist()] == [
+            ('recording.mp4', zipfile.ZIP_STORED), ('notas/reunión.txt', zipfile.ZIP_STORED)
+        ]
+        assert zipf.read('recording.mp4') == (tmp_path / 'recording.mp4').read_bytes()
+    # Any range of the archive can be served on its own
+    assert b''.join(iter_range(parts, 10, 3100)) == archive[10:3101]
+
+
+@pytest.mark.parametrize('range_header, result', [
+    (None, None),
+    ('bytes=0-', (0, 999)),
+    ('bytes=100-199', (100, 199)),
+    ('bytes=900-5000', (900, 999)),
+    ('bytes=-100', (900, 999)),
+    ('bytes=0-1,5-6', None),
+    ('bytes=500-100', None),
+    ('items=0-1', None),
+])
+def test_parse_range(range_header, result):
+    assert parse_range(range_header, 1000) == result
+
+
+@pytest.mark.parametrize('range_header', ['bytes=1000-', 'bytes=-0'])
+def test_parse_range_not_satisfiable(range_header):
+    with pytest.raises(ValueError):
+        parse_range(range_header, 1000)
+
+
+@pytest.mark.asyncio
+async def test_combine_streamed_archive_caches_crc(make_video, tmp_path):
+    meeting_dir = tmp_path / current.BBB.DOWNLOADED_MEETINGS_FOLDER / 'my-meeting-12345'
+    make_video(f'{meeting_dir}/video/webcams.mp4', 160, 120)
+    (meeting_dir / 'my-meeting-12345.zip').write_bytes(b'left by the stored mode')
+
+    with patch.object(current, 'BASE_DIR', str(tmp_path)), \
+            patch.object(current.BBB, 'ARCHIVE_MODE', 'stream'), \
+            patch.object(current.BBB, 'HLS_ENABLED', False):
+        await combine('my-meeting-12345', False)
+        assert recording_outputs('my-meeting-12345') == [str(meeting_dir / 'my-meeting-12345.mp4')]
+
+        # The CRC computed after the combine is reused by the downloads
+        with patch('app.utils.zip_util.file_crc') as file_crc_mock:
+            entries = archive_entries('my-meeting-12345')
+        file_crc_mock.assert_not_called()
+
+    assert not (meeting_dir / 'my-meeting-12345.zip').exists()
+    crc = zlib.crc32((meeting_dir / 'my-meeting-12345.mp4').read_bytes())
+    assert [(entry.name, entry.crc) for entry in entries] == [('my-meeting-12345.mp4', crc)]
+    assert load_bbb_metadata(str(meeting_dir))['archiveEntries']['my-meeting-12345.mp4']['crc'] == crc
+
+
+def test_finalize_output_indexes_keyframes(make_video):
+    # Written by a plain ffmpeg run, the moov comes after the media data
+    output = make_video('combined.mp4', 160, 120, duration=6, fps=10, gop=20)
+
+    def keyframe_bytes(index: dict) -> list:
+        with open(output, 'rb') as f:
+            return [(f.seek(offset), f.read(size))[1] for _, offset, size in index['keyframes']]
+
+    index_before = keyframe_index(output)
+    assert index_before is not None and index_before['moov'][0] > index_before['keyframes'][0][1]
+    before = keyframe_bytes(index_before)
+    finalize_output(output)
+
+    with open(keyframe_index_path(output)) as f:
+        index = json.load(f)
+    # The remux shifted the audio priming to zero, the video starts a little later
+    assert [time for time, _, _ in index['keyframes']] == pytest.approx(keyframe_times(output), abs=0.001)
+    assert keyframe_times(output) == pytest.approx([0, 2, 4], abs=0.05)
+    assert index['duration'] == pytest.approx(6, abs=0.1)
+    assert index['moov'][0] < index['keyframes'][0][1]
+    # The offsets follow the media data that moved behind the moov
+    assert keyframe_bytes(index) == before
+    assert probe_media(output)['duration'] == pytest.approx(6, abs=0.1)
+
+
+@pytest.mark.asyncio
+async def test_combine_reuses_output_of_identical_inputs(make_video, tmp_path):
+    meetings_dir = tmp_path / current.BBB.DOWNLOADED_MEETINGS_FOLDER
+    bbb_info = {
+        'meeting_id': '0123456789abcdef0123456789abcdef01234567-1700000000000',
+        'base_url': 'https://bbb.example.com/presentation/0123456789abcdef0123456789abcdef01234567-1700000000000/',
+        'fileValidators': {'video/webcams.mp4': {'etag': '"abc"', 'last_modified': None, 'size': 1000}},
+    }
+    for name in ['lecture-00000', 'clase-00000']:
+        make_video(f'{meetings_dir / name}/video/webcams.mp4', 160, 120)
+        write_bbb_metadata(str(meetings_dir / name), bbb_info)
+
+    with patch.object(current, 'BASE_DIR', str(tmp_path)), \
+            patch.object(current.BBB, 'HLS_ENABLED', False):
+        await combine('lecture-00000', False)
+        # The same recording asked with another meeting name
+        with patch('app.utils.file_util.run_transcode', wraps=run_transcode) as run_transcode_mock:
+            await combine('clase-00000', False)
+
+        functions = [call.args[0].__name__ for call in run_transcode_mock.call_args_list]
+        assert 'remux_video' not in functions and 'finalize_output' not in functions
+        assert os.path.samefile(
+            meetings_dir / 'lecture-00000/lecture-00000.mp4', meetings_dir / 'clase-00000/clase-00000.mp4'
+        )
+        assert (meetings_dir / 'clase-00000/clase-00000.keyframes.json').is_file()
+        assert load_bbb_metadata(str(meetings_dir / 'clase-00000'))['encodingProfile'] == {'name': 'copy'}
+        assert output_is_current('clase-00000', False)
+
+        # A new version of the webcams on the server invalidates the output
+        bbb_info['fileValidators']['video/webcams.mp4']['etag'] = '"def"'
+        write_bbb_metadata(str(meetings_dir / 'clase-00000'), {
+            **bbb_info, 'outputKey': load_bbb_metadata(str(meetings_dir / 'clase-00000'))['outputKey']
+        })
+        assert not output_is_current('clase-00000', False)
+
+
+def test_output_key_changes_with_encoding_profile():
+    fingerprint = {'video/webcams.mp4': {'url': 'https://bbb.example.com/webcams.mp4', 'etag': '"abc"'}}
+    fast = {'name': 'fast', **current.BBB.ENCODING_PROFILES['fast'].model_dump()}
+    key = output_key(fingerprint, True, fast)
+    assert key in accepted_keys(fingerprint, True)
+
+    # Once the profile is tuned, the outputs encoded with its former settings are built again
+    profiles = {**current.BBB.ENCODING_PROFILES, 'fast': current.BBB.ENCODING_PROFILES['fast'].model_copy(
+        update={'crf': 30}
+    )}
+    with patch.object(current.BBB, 'ENCODING_PROFILES', profiles):
+        assert key not in accepted_keys(fingerprint, True)
+    # So are the outputs of other profiles when one is forced
+    with patch.object(current.BBB, 'ENCODING_PROFILE', 'quality'):
+        assert key not in accepted_keys(fingerprint, True)
@@ -0,0 +1,181 @@
+import io
+import os
+import time
+from unittest.mock import patch
+import zipfile
+
+import pytest
+
+from app.api.services.job_service import JobService
+from app.api.v1.metadata import API_ROUTES_PREFIX
+from app.config import current
+from app.exceptions import ApiException
+from app.utils import job_store_util
+from app.utils.progress_util import report_progress
+from main import app
+from tests.conftest import TestClient
+
+MEETING_URL = 'https://bbb.example.com/playback/presentation/2.3/' \
+              '0123456789abcdef0123456789abcdef01234567-1700000000000'
+
+
+@pytest.fixture()
+def combined_recording(tmp_path):
+    meeting_dir = tmp_path / current.BBB.DOWNLOADED_MEETINGS_FOLDER / 'lecture-00000'
+    meeting_dir.mkdir(parents=True)
+    (meeting_dir / 'lecture-00000.mp4').write_bytes(os.urandom(5000))
+    with patch.object(current, 'BASE_DIR', str(tmp_path)):
+        yield meeting_dir
+
+
+@pytest.mark.asyncio
+async def test_download_recording_archive_200(client: TestClient, combined_recording) -> None:
+    response = client.get(f'{API_ROUTES_PREFIX}/download/lecture-00000.zip')
+
+    assert response.status_code == 200
+    assert response.headers['Accept-Ranges'] == 'bytes'
+    assert int(response.headers['Content-Length']) == len(response.content)
+    with zipfile.ZipFile(io.BytesIO(response.content)) as zipf:
+        assert zipf.read('lecture-00000.mp4') == (combined_recording / 'lecture-00000.mp4').read_bytes()
+
+
+@pytest.mark.asyncio
+async def test_download_recording_archive_resumes(client: TestClient, combined_recording) -> None:
+    full = client.get(f'{API_ROUTES_PREFIX}/download/lecture-00000.zip')
+    etag = full.headers['ETag']
+
+    response = client.get(
+        f'{API_ROUTES_PREFIX}/download/lecture-00000.zip', headers={'Range': 'bytes=1000-', 'If-Range': etag}
+    )
+    assert response.status_code == 206
+    assert response.headers['Content-Range'] == f'bytes 1000-{len(full.content) - 1}/{len(full.content)}'
+    assert response.content == full.content[1000:]
+
+    # The archive changed since the download started, it is sent again from the start
+    (combined_recording / 'lecture-00000.mp4').write_bytes(os.urandom(5000))
+    response = client.get(
+        f'{API_ROUTES_PREFIX}/download/lecture-00000.zip', headers={'Range': 'bytes=1000-', 'If-Range': etag}
+    )
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+
+@pytest.mark.asyncio
+async def test_download_recording_archive_416(client: TestClient, combined_recording) -> None:
+    response = client.get(f'{API_ROUTES_PREFIX}/download/lecture-00000.zip', headers={'Range': 'bytes=999999-'})
+
+    assert response.status_code == 416
+    assert response.headers['Content-Range'].startswith('bytes */')
+
+
+@pytest.mark.asyncio
+async def test_download_recording_archive_ignores_inverted_range(client: TestClient, combined_recording) -> None:
+    full = client.get(f'{API_ROUTES_PREFIX}/download/lecture-00000.zip')
+    response = client.get(f'{API_ROUTES_PREFIX}/download/lecture-00000.zip', headers={'Range': 'bytes=500-100'})
+
+    assert response.status_code == 200
+    assert 'Content-Range' not in response.headers
+    assert response.content == full.content
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('meeting_dir', ['missing-00000', '..'])
+async def test_download_recording_archive_404(client: TestClient, combined_recording, meeting_dir: str) -> None:
+    response = client.get(f'{API_ROUTES_PREFIX}/download/{meeting_dir}.zip')
+
+    assert response.status_code == 404
+    assert response.json().get('subtype') == 'file:not-found'
+
+
+@pytest.fixture()
+def job_store(tmp_path):
+    with patch.object(current, 'BASE_DIR', str(tmp_path)):
+        yield
+
+
+def _wait_for_job(client: TestClient, headers: dict, job_id: str) -> dict:
+    for _ in range(100):
+        job = client.get(f'{API_ROUTES_PREFIX}/jobs/{job_id}', headers=headers).json()['data']
+        if job['stage'] in ['done', 'failed']:
+            return job
+        time.sleep(0.02)
+    raise AssertionError(f'Job {job_id} did not finish')
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('error, stage, message', [
+    (None, 'done', None),
+    (ApiException(404, 'Not Found. Video files not found'), 'failed', 'Not Found. Video files not found'),
+])
+async def test_send_email_job_202(
+        client: TestClient, generate_fake_token: str, job_store, error, stage: str, message: str
+) -> None:
+    headers = {'Authorization': f'Bearer {generate_fake_token}', 'x-bearer': 'fake-x-bearer'}
+    stages = []
+
+    async def send_email(recording_send_email_input):
+        report_progress('combining', 0.5)
+        stages.append(recording_send_email_input.meeting_name)
+        if error:
+            raise error
+
+    with patch('app.api.services.recording_service.RecordingService.send_email', side_effect=send_email):
+        response = client.get(f'{API_ROUTES_PREFIX}/video/{MEETING_URL}:lecture/user@example.com', headers=headers)
+        assert response.status_code == 202
+        data = response.json()
+        assert (data['code'], data['data']['kind'], data['data']['stage']) == (202, 'video', 'queued')
+
+        job = _wait_for_job(client, headers, data['data']['id'])
+
+    meetings_dir = os.path.join(current.BASE_DIR, current.BBB.DOWNLOADED_MEETINGS_FOLDER)
+    assert stages == ['lecture']
+    assert (job['stage'], job['error']) == (stage, message)
+    assert job['progress'] == (1 if stage == 'done' else None)
+    assert JobService.stages(job['id']) == ['queued', 'combining', stage]
+    # The parameters of the job, credentials included, are kept out of the published meetings
+    assert os.path.isfile(job_store_util.store_path())
+    assert os.path.commonpath([job_store_util.store_path(), meetings_dir]) != meetings_dir
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('attempts, stage, runs', [(1, 'done', 1), (3, 'failed', 0)])
+async def test_interrupted_job_resumes_on_startup(
+        generate_fake_token: str, job_store, attempts: int, stage: str, runs: int
+) -> None:
+    headers = {'Authorization': f'Bearer {generate_fake_token}'}
+    params = {'x_bearer_encrypted': 'fake-x-bearer', 'url': MEETING_URL, 'meeting_name': 'lecture', 'email': 'a@b.c'}
+    # A previous run of the service stopped while combining
+    job_store_util.insert_job('interrupted', 'video', params, 'queued')
+    job_store_util.update_job('interrupted', 'combining', 0.3, attempts=attempts)
+    meetings = []
+
+    async def send_email(recording_send_email_input):
+        meetings.append(recording_send_email_input.meeting_name)
+
+    with patch('app.api.services.recording_service.RecordingService.send_email', side_effect=send_email):
+        with TestClient(app) as client:
+            job = _wait_for_job(client, headers, 'interrupted')
+
+    assert meetings == ['lecture'] * runs
+    assert (job['stage'], job['attempts']) == (stage, attempts + runs)
+    assert JobService.stages('interrupted') == ['queued', 'combining'] + ['queued'] * runs + [stage]
+
+
+@pytest.mark.asyncio
+async def test_send_email_job_rejects_url_without_meeting(client: TestClient, generate_fake_token: str) -> None:
+    headers = {'Authorization': f'Bearer {generate_fake_token}', 'x-bearer': 'fake-x-bearer'}
+    response = client.get(
+        f'{API_ROUTES_PREFIX}/video/https://bbb.example.com/nothing:lecture/user@example.com', headers=headers
+    )
+
+    assert response.status_code == 404
+    assert response.json().get('subtype') == 'meeting:not-found'
+
+
+@pytest.mark.asyncio
+async def test_get_job_404(client: TestClient, generate_fake_token: str, job_store) -> None:
+    headers = {'Authorization': f'Bearer {generate_fake_token}'}
+    response = client.get(f'{API_ROUTES_PREFIX}/jobs/unknown', headers=headers)
+
+    assert response.status_code == 404
+    assert response.json().get('subtype') == 'job:not-found'
@@ -38,3 +38,16 @@ async def test_get_version_endpoint_401(client: TestClient) -> None:
     assert data.get('subtype') == 'auth:token-invalid'
     assert data.get('message') == 'Unauthorized. Authorization error: Not enough segments. ' \
                                   'Could not validate credentials'
+
+
+@pytest.mark.asyncio
+async def test_get_download_metrics_endpoint_200(client: TestClient, generate_fake_token: str) -> None:
+    headers = {'Authorization': f'Bearer {generate_fake_token}'}
+    response = client.get(f'{API_ROUTES_PREFIX}/metrics/downloads', headers=headers)
+    data = response.json()
+
+    assert data.get('code') == 200
+    assert data.get('type') == 'DownloadMetricsResponse'
+    assert set(data.get('data').get('histograms')) == {
+        'transfer_ttfb_seconds', 'transfer_bytes_per_second', 'transfer_duration_seconds', 'job_duration_seconds'
+    }
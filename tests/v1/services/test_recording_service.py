@@ -1,12 +1,17 @@
+import asyncio
+import base64
 import pytest
-from unittest.mock import patch
+import threading
+from unittest.mock import MagicMock, patch
 from requests import Response
 
 from starlette.status import HTTP_201_CREATED
 
 from app.api.schemas.auth_schema import XBearerSchema
+from app.api.schemas.recording_schema import RecordingSendEmailInput
 from app.api.services.recording_service import RecordingService
 from app.api.services.web_dav_service import WebDAVService
+from app.config import current
 
 
 @pytest.mark.asyncio
@@ -31,3 +36,123 @@ async def test_create_full_folder_path(send_request_mock, folder_path, result):
 
     path = await recording_service._create_full_folder_path(folder_path)
     assert path == result
+
+
+@pytest.mark.asyncio
+@patch('app.api.services.recording_service.send_email')
+@patch('app.api.services.recording_service.RecordingService._prepare_recording')
+async def test_send_email_coalesces_same_meeting(prepare_recording_mock, send_email_mock):
+    async def prepare_recording(url, meeting_name):
+        await asyncio.sleep(0.01)
+        return f'{meeting_name}-{url[-5:]}'
+
+    prepare_recording_mock.side_effect = prepare_recording
+    url = 'https://bbb.example.com/playback/presentation/2.3/' \
+          '0123456789abcdef0123456789abcdef01234567-1700000000000'
+    x_bearer = base64.urlsafe_b64encode(b'fake-x-bearer').decode()
+
+    await asyncio.gather(*[
+        RecordingService.send_email(RecordingSendEmailInput(
+            x_bearer_encrypted=x_bearer, url=url, meeting_name=name, email=f'{name}@example.com'
+        ))
+        for name in ['first', 'second']
+    ])
+
+    prepare_recording_mock.assert_called_once()
+    assert sorted(call.args[0].to_email for call in send_email_mock.call_args_list) == [
+        'first@example.com', 'second@example.com'
+    ]
+    assert {call.args[0].download_meeting_dir for call in send_email_mock.call_args_list} == {'first-00000'}
+    assert {call.args[0].playback_link for call in send_email_mock.call_args_list} == {None}
+
+
+@pytest.mark.asyncio
+@patch('app.api.services.recording_service.send_email')
+@patch('app.api.services.recording_service.RecordingService._prepare_recording')
+@patch('app.api.services.recording_service.RecordingService._prepare_audio')
+async def test_send_email_audio_only_links_audio_file(prepare_audio_mock, prepare_recording_mock, send_email_mock):
+    prepare_audio_mock.return_value = ('lecture-00000', 'lecture-00000.m4a')
+    url = 'https://bbb.example.com/playback/presentation/2.3/' \
+          '0123456789abcdef0123456789abcdef01234567-1700000000000'
+    x_bearer = base64.urlsafe_b64encode(b'fake-x-bearer').decode()
+
+    await RecordingService.send_email(RecordingSendEmailInput(
+        x_bearer_encrypted=x_bearer, url=url, meeting_name='lecture', email='user@example.com', audio_only=True
+    ))
+
+    prepare_recording_mock.assert_not_called()
+    email_input = send_email_mock.call_args.args[0]
+    assert email_input.download_link.endswith('/lecture-00000/lecture-00000.m4a')
+    assert 'recording_url=' + email_input.download_link in email_input.upload_link
+
+
+@pytest.mark.asyncio
+@patch('app.utils.recording_util.smtplib.SMTP')
+async def test_send_email_audio_only_of_meeting_never_downloaded(smtp_mock, range_server, make_video, tmp_path):
+    base_url, remote_dir, requests_log = range_server
+    meeting_id = '0123456789abcdef0123456789abcdef01234567-1700000000000'
+    make_video(f'remote/presentation/{meeting_id}/video/webcams.mp4', 160, 120)
+    (remote_dir / f'presentation/{meeting_id}/metadata.xml').write_text(
+        '<recording><start_time>1700000000000</start_time></recording>'
+    )
+    server = MagicMock()
+    smtp_mock.return_value.__enter__.return_value = server
+    # The email is sent without blocking the event loop
+    threads = []
+    server.sendmail.side_effect = lambda *args: threads.append(threading.current_thread())
+    x_bearer = base64.urlsafe_b64encode(b'fake-x-bearer').decode()
+
+    with patch.object(current, 'BASE_DIR', str(tmp_path)), \
+            patch.object(current.BBB, 'SERVER', base_url.split('/')[2]):
+        await RecordingService.send_email(RecordingSendEmailInput(
+            x_bearer_encrypted=x_bearer, url=f'http://bbb.example.com/playback/presentation/2.3/{meeting_id}',
+            meeting_name='lecture', email='user@example.com', audio_only=True
+        ))
+
+    server.sendmail.assert_called_once()
+    assert threads != [threading.main_thread()]
+    assert smtp_mock.call_args.kwargs['timeout'] == current.EMAIL.TIMEOUT_SECONDS
+    meeting_dir = tmp_path / current.BBB.DOWNLOADED_MEETINGS_FOLDER / 'lecture-00000'
+    assert (meeting_dir / 'lecture-00000.m4a').is_file()
+    assert (meeting_dir / 'EMAIL_SENT.txt').read_text().endswith('/lecture-00000/lecture-00000.m4a\n')
+    assert not any('deskshare' in path for _, path, _ in requests_log)
+
+
+@pytest.mark.asyncio
+@patch('app.api.services.recording_service.send_email')
+@patch('app.api.services.recording_service.RecordingService._prepare_recording')
+async def test_send_email_links_hls_playback(prepare_recording_mock, send_email_mock, tmp_path):
+    prepare_recording_mock.return_value = 'lecture-00000'
+    playback_page = tmp_path / 'index.html'
+    playback_page.write_text('<html></html>')
+    url = 'https://bbb.example.com/playback/presentation/2.3/' \
+          '0123456789abcdef0123456789abcdef01234567-1700000000000'
+    x_bearer = base64.urlsafe_b64encode(b'fake-x-bearer').decode()
+
+    with patch('app.api.services.recording_service.playback_page_path', return_value=str(playback_page)):
+        await RecordingService.send_email(RecordingSendEmailInput(
+            x_bearer_encrypted=x_bearer, url=url, meeting_name='lecture', email='user@example.com'
+        ))
+
+    email_input = send_email_mock.call_args.args[0]
+    # The zip is streamed by this API
+    assert email_input.download_link == \
+        f'{current.API.HOST}{current.API.PREFIX}/{current.API.ACTIVE_VERSION}/download/lecture-00000.zip'
+    assert email_input.playback_link.endswith('/lecture-00000/hls/index.html')
+
+
+@pytest.mark.asyncio
+@patch('app.api.services.recording_service.send_email')
+@patch('app.api.services.recording_service.RecordingService._prepare_recording')
+async def test_send_email_links_video_without_archive(prepare_recording_mock, send_email_mock):
+    prepare_recording_mock.return_value = 'lecture-00000'
+    url = 'https://bbb.example.com/playback/presentation/2.3/' \
+          '0123456789abcdef0123456789abcdef01234567-1700000000000'
+    x_bearer = base64.urlsafe_b64encode(b'fake-x-bearer').decode()
+
+    with patch.object(current.BBB, 'ARCHIVE_MODE', 'none'):
+        await RecordingService.send_email(RecordingSendEmailInput(
+            x_bearer_encrypted=x_bearer, url=url, meeting_name='lecture', email='user@example.com'
+        ))
+
+    assert send_email_mock.call_args.args[0].download_link.endswith('/lecture-00000/lecture-00000.mp4')